@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodlocation.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from menufood.events import OrderEventStream  # noqa: E402
+
+# luồng sự kiện đơn hàng (SSE) chạy trước ứng dụng Django
+application = OrderEventStream(django_application)
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'menufood.db_router.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -96,6 +97,22 @@ DATABASES = {
     }
 }
 
+# đọc từ replica cho request GET (menufood/db_router.py): alias các replica trong DATABASES,
+# để trống thì chỉ dùng 'default'. Chạy thử local với 2 file SQLite:
+#   DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica.sqlite3'}
+#   DATABASE_REPLICAS = ['replica']
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_PIN_SECONDS = 5  # đọc từ primary trong N giây sau khi user ghi dữ liệu
+
+# chia dữ liệu đơn hàng theo cửa hàng (menufood/sharding.py): alias các shard trong DATABASES.
+# Chạy thử local với nhiều file SQLite:
+#   DATABASES['orders2'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'orders2.sqlite3'}
+#   ORDER_SHARDS = ['default', 'orders2']
+#   python manage.py migrate --database=orders2
+ORDER_SHARDS = ['default']
+ORDER_SHARD_CACHE_TIMEOUT = 60  # giây, thời gian cache shard của cửa hàng
+DATABASE_ROUTERS = ['menufood.sharding.ShardRouter', 'menufood.db_router.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -147,9 +164,12 @@ AUTH_USER_MODEL = 'menufood.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
+        'menufood.authentication.CachedOAuth2Authentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_THROTTLE_CLASSES': (
+        'menufood.throttling.BucketThrottle',
+    ),
 
     'PAGE_SIZE': 20,  # phân trang
 }
@@ -181,3 +201,112 @@ cloudinary.config(
 )
 
 
+# thống kê trang admin (menufood/stats.py)
+STATS_CACHE_TIMEOUT = 60 * 15
+STATS_PAGE_SIZE = 50
+
+# backend sinh url ảnh theo kích thước (menufood/images.py)
+# dùng 'menufood.images.LocalImageStorage' để chạy local không cần Cloudinary
+IMAGE_STORAGE = 'menufood.images.CloudinaryImageStorage'
+IMAGE_LOCAL_ROOT = MEDIA_ROOT
+
+# ảnh upload được lưu tạm rồi đẩy lên storage bằng thread pool (menufood/uploads.py)
+UPLOAD_STAGING_ROOT = '%s/uploads_staging/' % BASE_DIR
+UPLOAD_WORKERS = 4
+UPLOAD_MAX_ATTEMPTS = 3
+UPLOAD_RETRY_DELAY = 1  # giây, tăng gấp đôi sau mỗi lần lỗi
+
+# cổng thanh toán MoMo (menufood/payments.py)
+MOMO = {
+    'ENDPOINT': 'https://test-payment.momo.vn',
+    'PARTNER_CODE': 'MOMO',
+    'ACCESS_KEY': 'F8BBA842ECF85',
+    'SECRET_KEY': 'K951B6PE1waDMi640xX08PD3vg6EkVlz',
+    'CONNECT_TIMEOUT': 3,   # giây
+    'READ_TIMEOUT': 10,
+    'MAX_RETRIES': 2,
+    'POOL_SIZE': 10,
+}
+
+# thời gian lưu response của request có header Idempotency-Key (menufood/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# giây, request đầu tiên chưa trả response sau thời gian này (worker bị kill/timeout) thì request gửi lại được chạy
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# thời gian cache kết quả kiểm tra access token (menufood/authentication.py)
+# chạy nhiều process thì nên cấu hình CACHES dùng chung (redis/memcached)
+# để việc thu hồi token có hiệu lực ngay trên mọi process
+OAUTH2_TOKEN_CACHE_TTL = 60
+
+# đẩy sự kiện đơn hàng qua Server-Sent Events (menufood/events.py), chỉ chạy khi deploy bằng ASGI
+ORDER_EVENTS = {
+    'PATH': '/events/orders/',
+    'BROKER': 'menufood.events.InProcessBroker',
+    'HEARTBEAT': 15,  # giây
+    'QUEUE_SIZE': 100,  # số sự kiện chờ gửi tối đa cho mỗi kết nối
+}
+
+# chuyển đơn đã giao thành công sang bảng lưu trữ (menufood/archive.py, lệnh archive_orders)
+ORDER_ARCHIVE = {
+    'AFTER_DAYS': 180,
+    'BATCH_SIZE': 500,
+}
+
+# số dòng đọc/ghi mỗi lô khi xuất file csv/xlsx (menufood/exports.py)
+EXPORT_CHUNK_SIZE = 2000
+
+# tài liệu menu của cửa hàng (danh mục -> món -> tag) dựng sẵn trong cache (menufood/store_menus.py)
+# tài liệu được dựng lại ngay khi món/danh mục của cửa hàng thay đổi, TIMEOUT chỉ giới hạn dữ liệu cũ
+# khi dữ liệu bị sửa không qua model (queryset.update...)
+STORE_MENU = {
+    'TIMEOUT': 60 * 60 * 24,  # giây
+    'MAX_AGE': 30,  # giây, Cache-Control cho client/CDN, sau đó kiểm tra lại bằng If-None-Match
+}
+
+# API đồng bộ thay đổi cho app (menufood/sync.py)
+SYNC = {
+    # giây, lấy lại các dòng thay đổi ngay trước token cũ: transaction chưa commit, replica trễ
+    'OVERLAP': 60,
+    # ngày giữ Tombstone (lệnh purge_tombstones), token cũ hơn phải tải lại toàn bộ
+    'TOMBSTONE_DAYS': 30,
+}
+
+# báo giá giỏ hàng / tính tiền khi tạo đơn (menufood/pricing.py)
+PRICING = {
+    'MAX_ITEMS': 50,   # số món khác nhau trong một đơn
+    'MAX_QUANTITY': 99,   # số phần tối đa của một món
+    'DELIVERY_FEE': 15000,   # phí giao hàng khi chưa xác định được vị trí cửa hàng
+    'QUOTE_TIMEOUT': 60,   # giây, cache báo giá khi khách sửa giỏ hàng
+}
+
+# phí giao hàng theo khoảng cách từ cửa hàng tới địa chỉ nhận (menufood/delivery.py)
+# dùng 'menufood.delivery.LocalGeocoder' để chạy local/test không cần gọi dịch vụ geocode
+DELIVERY = {
+    'GEOCODER': 'menufood.delivery.NominatimGeocoder',
+    'GEOCODER_URL': 'https://nominatim.openstreetmap.org',
+    'GEOCODER_TIMEOUT': 5,   # giây
+    'USER_AGENT': 'foodlocation',   # Nominatim yêu cầu User-Agent riêng của ứng dụng
+    'GEOCODE_TIMEOUT': 60 * 60 * 24 * 30,   # giây, cache toạ độ (bảng GeocodedAddress lưu lâu dài)
+    # (bán kính km, phí) cho cửa hàng chưa cấu hình DeliveryZone
+    'DEFAULT_ZONES': [(3, 15000), (7, 25000), (15, 40000)],
+}
+
+# số lượt thích/đánh giá của món được cộng dồn trong bộ nhớ rồi ghi theo lô (menufood/popularity.py)
+POPULARITY = {
+    'FLUSH_INTERVAL': 5,   # giây
+    'MAX_PENDING': 1000,   # số món đang chờ, đủ thì ghi ngay
+}
+
+# giới hạn số request theo IP và theo user cho từng nhóm endpoint (menufood/throttling.py)
+# 'số request/khoảng thời gian': token bucket, cho phép dồn tối đa ngần ấy request liên tiếp
+# dùng 'menufood.throttling.CacheBucketStore' khi chạy nhiều process (cần CACHES dùng chung)
+THROTTLING = {
+    'STORE': 'menufood.throttling.LocalBucketStore',
+    'RATES': {
+        'write': {'user': '30/min', 'ip': '120/min'},   # thích, đánh giá, bình luận
+        'search': {'user': '60/min', 'ip': '120/min'},   # tìm kiếm theo tên (icontains)
+        'payment': {'ip': '20/min'},   # tạo thanh toán MoMo
+    },
+    'SEARCH_PARAMS': ('name', 'kw'),
+    'MAX_KEYS': 100000,   # số bucket tối đa trong bộ nhớ mỗi process
+}
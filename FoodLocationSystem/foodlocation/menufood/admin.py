@@ -1,13 +1,20 @@
 from django.contrib import admin
-from .models import MenuItem, Food, User, Tag, PaymentMethod, Subcribes, Order, OrderDetail
+from .models import MenuItem, Food, User, Tag, PaymentMethod, Subcribes, Order, OrderDetail, DeliveryZone
 from django.contrib.auth.models import Permission, Group
 from django import forms
 from ckeditor_uploader.widgets import CKEditorUploadingWidget
 from django.utils.html import mark_safe
-from . import cloud_path
+from .images import get_image_url
 from django.urls import path
 from django.template.response import TemplateResponse
-from django.db.models import Count
+from django.http import JsonResponse
+from django.utils.dateparse import parse_date
+from django.utils.html import strip_tags
+from django.db.models.functions import Substr
+from django.utils.text import Truncator
+from django.contrib.admin.widgets import AutocompleteSelect
+from .stats import get_store_stats
+from .paginators import EstimatedCountPaginator
 
 
 # cập nhật trang thống kê
@@ -16,22 +23,115 @@ class FoodLocationAppAdminSite(admin.AdminSite):
 
     def get_urls(self):
         return [
-           path('stats/', self.stats_view)
+           path('stats/', self.admin_view(self.stats_view)),
+           path('stats/json/', self.admin_view(self.stats_json_view)),
        ] + super().get_urls()
 
-    def stats_view(self, request):
-        orders_by_store = (
-            Order.objects.filter(order_status=Order.SUCCESSED).values('store__name_store').annotate(total_orders=Count('id')).order_by('store__name_store')
-        )
+    # số liệu đã được tính sẵn bởi lệnh refresh_store_stats, ở đây chỉ đọc (có cache)
+    def get_stats(self, request):
+        try:
+            date_from = parse_date(request.GET.get('from', ''))
+            date_to = parse_date(request.GET.get('to', ''))
+        except ValueError:
+            date_from = date_to = None
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
 
-        sum_food_store = User.objects.filter(user_role=User.STORE) \
-            .annotate(total_products=Count('menuitem_store__menuitem_food__id'))
+        return get_store_stats(date_from, date_to, page)
 
+    def stats_view(self, request):
         return TemplateResponse(request, 'admin/stats.html', {
-            'count_order_store': orders_by_store,
-            'sum_food_store': sum_food_store
+            **self.each_context(request),
+            'stats': self.get_stats(request)
         })
 
+    def stats_json_view(self, request):
+        return JsonResponse(self.get_stats(request))
+
+
+# bộ lọc chọn bằng autocomplete (ajax) thay cho danh sách tất cả user
+class AutocompleteFilter(admin.SimpleListFilter):
+    template = 'admin/autocomplete_filter.html'
+    # field FK dùng làm nguồn autocomplete: (model, tên field)
+    field_model = None
+    field_name = None
+    # lookup dùng để lọc queryset, mặc định là parameter_name
+    lookup = None
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        field = self.field_model._meta.get_field(self.field_name)
+        self.form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False
+        )
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def rendered_widget(self):
+        return self.form_field.widget.render(self.parameter_name, self.value(),
+                                             attrs={'id': 'id_filter_%s' % self.parameter_name})
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup or self.parameter_name: self.value()})
+
+
+class StoreFilter(AutocompleteFilter):
+    title = 'store'
+    parameter_name = 'store'
+    field_model = MenuItem
+    field_name = 'store'
+
+
+class FoodStoreFilter(StoreFilter):
+    lookup = 'menu_item__store'
+
+
+class SubcribesStoreFilter(AutocompleteFilter):
+    title = 'store'
+    parameter_name = 'store'
+    field_model = Subcribes
+    field_name = 'store'
+
+
+class SubcribesFollowerFilter(AutocompleteFilter):
+    title = 'follower'
+    parameter_name = 'follower'
+    field_model = Subcribes
+    field_name = 'follower'
+
+
+# ModelAdmin cho bảng lớn: nạp js/css của autocomplete, không đếm COUNT(*) toàn bảng
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions_on_top = False
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, self.admin_site).media
+
+    def has_add_permission(self, request):
+        # return False to disable the add functionality
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# bậc phí giao hàng của cửa hàng (menufood/delivery.py)
+class DeliveryZoneInline(admin.TabularInline):
+    model = DeliveryZone
+    extra = 0
+
 
 class UserAdmin(admin.ModelAdmin):
     list_display = ['pk', 'image', 'username', 'first_name', 'last_name', 'email',
@@ -40,12 +140,13 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ['username', 'email', 'first_name', 'last_name', "phone", 'name_store']
     list_filter = ["user_role", "is_verify", 'is_active']
     readonly_fields = [*list_display]
+    inlines = [DeliveryZoneInline]
     actions_on_top = False
 
     def image(self, user):
         if user.avatar:
             return mark_safe(
-                "<img src='{cloud_path}{image_name}' width='50' height='50' />".format(cloud_path=cloud_path, image_name=user.avatar))
+                "<img src='{url}' width='50' height='50' />".format(url=get_image_url(user.avatar, variant='thumbnail')))
 
     def has_add_permission(self, request):
         # return False to disable the add functionality
@@ -55,19 +156,12 @@ class UserAdmin(admin.ModelAdmin):
         return False
 
 
-class SubcribesAdmin(admin.ModelAdmin):
+class SubcribesAdmin(LargeTableAdmin):
     list_display = ['follower', 'store', 'active']
-    list_filter = ["store", "follower"]
-    actions_on_top = False
+    list_filter = [SubcribesStoreFilter, SubcribesFollowerFilter]
+    list_select_related = ['follower', 'store']
     readonly_fields = [*list_display]
 
-    def has_add_permission(self, request):
-        # return False to disable the add functionality
-        return False
-
-    def has_delete_permission(self, request, obj=None):
-        return False
-
 
 # class FoodForm(forms.ModelForm):
 #     description = forms.CharField(widget=CKEditorUploadingWidget)
@@ -92,20 +186,13 @@ class TagAdmin(admin.ModelAdmin):
     list_display = ['pk', 'name', 'active']
 
 
-class MenuItemAdmin(admin.ModelAdmin):
+class MenuItemAdmin(LargeTableAdmin):
     list_display = ['name', 'store', 'active']
     search_fields = ['name', 'store_id__name_store']
-    list_filter = ['store', 'active']
-    actions_on_top = False
+    list_filter = [StoreFilter, 'active']
+    list_select_related = ['store']
     readonly_fields = [*list_display]
 
-    def has_add_permission(self, request):
-        # return False to disable the add functionality
-        return False
-
-    def has_delete_permission(self, request, obj=None):
-        return False
-
 
 class UserFilter(admin.SimpleListFilter):
     title = 'user_role'
@@ -124,30 +211,29 @@ class UserFilter(admin.SimpleListFilter):
             return queryset.filter(menu_item__store__user_role=User.STORE)
 
 
-class FoodAdmin(admin.ModelAdmin):
-    list_display = ['img', 'name', 'menu_item', 'price', 'created_date', 'active', 'start_time', 'end_time', 'description']
+class FoodAdmin(LargeTableAdmin):
+    list_display = ['img', 'name', 'menu_item', 'price', 'created_date', 'active', 'start_time', 'end_time', 'short_description']
     search_fields = ['name']
     # list_editable = ['name', 'menu_item', 'price', 'start_time', 'end_time']
-    list_filter = ['menu_item__store', 'active']
+    list_filter = [FoodStoreFilter, 'active']
+    list_select_related = ['menu_item']
     # form = FoodForm
-    actions_on_top = False
-    readonly_fields = [*list_display]
+    readonly_fields = [*list_display, 'description']
 
     def img(self, food):
         if food.image_food:
             return mark_safe(
-                "<img src='{cloud_path}{image_name}' width='50' height='50' />".format(cloud_path=cloud_path, image_name=food.image_food))
+                "<img src='{url}' width='50' height='50' />".format(url=get_image_url(food.image_food, variant='thumbnail')))
 
-    def has_add_permission(self, request):
-        # return False to disable the add functionality
-        return False
-
-    def has_delete_permission(self, request, obj=None):
-        return False
+    # chỉ lấy 200 ký tự đầu của mô tả (RichText) thay vì cả nội dung
+    @admin.display(description='description')
+    def short_description(self, food):
+        return Truncator(strip_tags(food.description_head or '')).chars(80)
 
+    # menu chỉ thuộc về cửa hàng (limit_choices_to + kiểm tra ở API) nên không cần join qua role của store
     def get_queryset(self, request):
         qs = super(FoodAdmin, self).get_queryset(request)
-        return qs.filter(menu_item__store__user_role=User.STORE)
+        return qs.annotate(description_head=Substr('description', 1, 200)).defer('description')
 
 
 admin_site = FoodLocationAppAdminSite(name='myadmin')
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class MenufoodConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'menufood'
+
+    def ready(self):
+        # đăng ký signal xoá cache access token
+        from . import authentication  # noqa
+        # cấp id toàn cục cho đơn hàng khi chia nhiều shard
+        from . import sharding  # noqa
+        # dựng lại menu cửa hàng đã cache khi món/danh mục thay đổi
+        from . import store_menus  # noqa
+        # ghi Tombstone khi xoá dữ liệu được đồng bộ
+        from . import sync  # noqa
+        # báo giá giỏ hàng/bảng phí giao hàng đã cache hết hạn khi giá món, bậc phí thay đổi
+        from . import pricing  # noqa
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderDetail, ArchivedOrder, ArchivedOrderDetail
+from .sharding import all_shards, join_default, write_db
+
+
+def _copy(instance, model):
+    return model(**{f.attname: getattr(instance, f.attname) for f in type(instance)._meta.concrete_fields})
+
+
+def archive_orders(days=None, batch_size=None):
+    """
+    Chuyển các đơn đã giao thành công trước N ngày sang ArchivedOrder/ArchivedOrderDetail,
+    mỗi lô batch_size đơn trong một transaction. Trả về số đơn đã chuyển.
+    """
+    days = settings.ORDER_ARCHIVE['AFTER_DAYS'] if days is None else days
+    batch_size = batch_size or settings.ORDER_ARCHIVE['BATCH_SIZE']
+    before = timezone.now() - timedelta(days=days)
+
+    total = 0
+    for shard in all_shards(Order):
+        db = write_db(shard)
+        while True:
+            with transaction.atomic(using=db):
+                orders = list(shard.filter(order_status=Order.SUCCESSED, created_date__lt=before)
+                              .order_by('id').select_for_update()[:batch_size])
+                if not orders:
+                    break
+                ids = [o.pk for o in orders]
+                details = OrderDetail.objects.using(db).filter(order_id__in=ids)
+
+                ArchivedOrder.objects.using(db).bulk_create([_copy(o, ArchivedOrder) for o in orders])
+                ArchivedOrderDetail.objects.using(db).bulk_create([_copy(d, ArchivedOrderDetail) for d in details],
+                                                                  batch_size=1000)
+                details.delete()
+                Order.objects.using(db).filter(id__in=ids).delete()
+
+            total += len(orders)
+
+    return total
+
+
+def all_order_details(**lookups):
+    # chi tiết đơn ở cả bảng đang dùng và bảng lưu trữ trên mọi shard, lọc theo cùng điều kiện
+    return [d for model in (OrderDetail, ArchivedOrderDetail) for details in all_shards(model)
+            for d in join_default(details.filter(**lookups), 'food__menu_item')]
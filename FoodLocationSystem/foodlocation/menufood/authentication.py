@@ -0,0 +1,130 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.models import AccessToken
+from rest_framework import exceptions
+
+from .models import User
+
+TOKEN_CACHE_PREFIX = 'oauth2-token:'
+
+
+def token_cache_key(token):
+    # không đưa token gốc vào key của cache
+    return TOKEN_CACHE_PREFIX + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+# không đưa hash mật khẩu và token gốc vào cache (token lấy lại từ header của request)
+SNAPSHOT_EXCLUDE = {User: {'password'}, AccessToken: {'token'}}
+
+
+def _snapshot(obj):
+    exclude = SNAPSHOT_EXCLUDE[type(obj)]
+    return {f.attname: getattr(obj, f.attname) for f in obj._meta.concrete_fields if f.attname not in exclude}
+
+
+def _from_snapshot(model, values):
+    # field không có trong snapshot là deferred: đọc lại từ DB khi cần, save() không ghi đè
+    return model.from_db('default', list(values), list(values.values()))
+
+
+def invalidate_token(token):
+    cache.delete(token_cache_key(token))
+
+
+def invalidate_user_tokens(user_id):
+    tokens = AccessToken.objects.filter(user_id=user_id).values_list('token', flat=True)
+    cache.delete_many([token_cache_key(t) for t in tokens])
+
+
+def get_cached_token(token):
+    cached = cache.get(token_cache_key(token))
+    if not cached or cached['expires'] <= timezone.now():
+        return None
+
+    user = _from_snapshot(User, cached['user'])
+    access_token = _from_snapshot(AccessToken, cached['token'])
+    access_token.token = token
+    access_token.user = user
+    return user, access_token
+
+
+def cache_token(token, user, access_token):
+    ttl = min(settings.OAUTH2_TOKEN_CACHE_TTL, int((access_token.expires - timezone.now()).total_seconds()))
+    if ttl > 0 and user is not None:
+        cache.set(token_cache_key(token), {
+            'expires': access_token.expires,
+            'user': _snapshot(user),
+            'token': _snapshot(access_token),
+        }, ttl)
+
+
+def get_token_user(token):
+    """
+    Trả về user đang hoạt động của access token còn hạn (None nếu không hợp lệ),
+    dùng cho các kết nối không đi qua DRF như luồng sự kiện ASGI.
+    """
+    result = get_cached_token(token)
+    if result is None:
+        access_token = AccessToken.objects.select_related('user').filter(token=token).first()
+        if access_token is None or not access_token.is_valid():
+            return None
+        result = access_token.user, access_token
+        cache_token(token, *result)
+
+    user = result[0]
+    return user if user is not None and user.is_active else None
+
+
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """
+    Lưu kết quả kiểm tra access token (token -> user) vào cache trong
+    OAUTH2_TOKEN_CACHE_TTL giây để request có token không phải truy vấn
+    bảng oauth2_provider_accesstoken và user mỗi lần.
+    Cache bị xoá khi token bị thu hồi/cập nhật hoặc user thay đổi.
+    """
+
+    def authenticate(self, request):
+        token = self._get_bearer_token(request)
+        if not token:
+            return super().authenticate(request)
+
+        result = get_cached_token(token)
+        if result is None:
+            result = super().authenticate(request)
+            if result is None:
+                return None
+            cache_token(token, *result)
+
+        user, access_token = result
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return user, access_token
+
+    @staticmethod
+    def _get_bearer_token(request):
+        auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(auth) == 2 and auth[0].lower() == 'bearer':
+            return auth[1]
+
+        return None
+
+
+# token bị thu hồi (revoke() xoá dòng AccessToken) hoặc được cập nhật
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def clear_access_token_cache(sender, instance, **kwargs):
+    invalidate_token(instance.token)
+
+
+# user bị khoá hoặc đổi thông tin: bỏ các bản lưu user cũ trong cache
+@receiver(post_save, sender=User)
+def clear_user_token_cache(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_user_tokens(instance.pk)
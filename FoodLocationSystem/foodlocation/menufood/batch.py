@@ -0,0 +1,18 @@
+# lấy nhiều object trong một request (/foods/batch/?ids=..., /stores/batch/?ids=...)
+BATCH_LIMIT = 100
+
+
+def parse_ids(value):
+    # "3,1,3" -> [3, 1] (bỏ trùng, giữ thứ tự), None nếu không hợp lệ
+    ids = [i.strip() for i in (value or '').split(',') if i.strip()]
+    if not ids or not all(i.isdigit() for i in ids):
+        return None
+    ids = list(dict.fromkeys(int(i) for i in ids))
+
+    return ids if len(ids) <= BATCH_LIMIT else None
+
+
+def batch_result(ids, items):
+    # items: các cặp (id, dữ liệu); kết quả theo thứ tự ids, kèm các id không tìm thấy
+    found = dict(items)
+    return {'results': [found[i] for i in ids if i in found], 'missing': [i for i in ids if i not in found]}
@@ -0,0 +1,85 @@
+import contextvars
+import hashlib
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+PIN_COOKIE = 'db_pin'
+
+# trạng thái của request đang xử lý: {'replica': được đọc từ replica, 'wrote': đã ghi vào primary}
+_request_state = contextvars.ContextVar('db_request_state', default=None)
+
+
+class ReplicaRouter:
+    """
+    Request GET/HEAD/OPTIONS đọc từ một trong các DATABASE_REPLICAS,
+    ghi và mọi truy vấn trong transaction đi vào 'default' (primary).
+    Ngoài request (lệnh quản trị, thread nền) luôn dùng primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or state is None or not state['replica'] or connections['default'].in_atomic_block:
+            return 'default'
+
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            # các truy vấn đọc sau đó trong request cũng đọc từ primary
+            state['replica'] = False
+            state['wrote'] = True
+
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica là bản sao của primary nên object đọc từ replica được gán cho object của primary
+        dbs = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+
+        return None
+
+
+def _pin_key(request):
+    auth = request.META.get('HTTP_AUTHORIZATION')
+    if auth:
+        return 'db-pin:' + hashlib.sha256(auth.encode('utf-8')).hexdigest()
+
+    return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sau khi user ghi dữ liệu, các request của user đó đọc từ primary trong
+    DATABASE_REPLICA_PIN_SECONDS giây để không thấy dữ liệu cũ do replica trễ.
+    User được nhận diện theo header Authorization (cache) hoặc cookie.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        key = _pin_key(request)
+        pinned = request.COOKIES.get(PIN_COOKIE) or (key and cache.get(key))
+        state = {'replica': request.method in ('GET', 'HEAD', 'OPTIONS') and not pinned, 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if state['wrote']:
+            seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+            if key:
+                cache.set(key, True, seconds)
+            response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True)
+
+        return response
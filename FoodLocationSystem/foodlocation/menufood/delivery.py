@@ -0,0 +1,177 @@
+import hashlib
+import math
+import re
+from bisect import bisect_left
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import User, DeliveryZone, GeocodedAddress
+
+GEOCODE_KEY = 'geocode:%s'
+ZONE_TABLE_KEY = 'delivery-zones:%s'
+EARTH_RADIUS = 6371.0  # km
+
+
+class DeliveryError(Exception):
+    # message trả về cho client
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class GeocodeError(Exception):
+    # lỗi kết nối dịch vụ geocode, kết quả không được lưu lại
+    pass
+
+
+class NominatimGeocoder:
+    # dịch vụ geocode của OpenStreetMap (hoặc server Nominatim tự dựng, DELIVERY['GEOCODER_URL'])
+    def __init__(self):
+        self.config = settings.DELIVERY
+        retry = Retry(total=2, status_forcelist=(502, 503, 504), backoff_factor=0.2, raise_on_status=False)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(max_retries=retry))
+        self.session.mount('http://', HTTPAdapter(max_retries=retry))
+        self.session.headers['User-Agent'] = self.config['USER_AGENT']
+
+    def geocode(self, address):
+        try:
+            res = self.session.get(self.config['GEOCODER_URL'] + '/search', timeout=self.config['GEOCODER_TIMEOUT'],
+                                   params={'q': address, 'format': 'json', 'limit': 1, 'countrycodes': 'vn'})
+            res.raise_for_status()
+            results = res.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeocodeError(str(e)) from e
+
+        return (float(results[0]['lat']), float(results[0]['lon'])) if results else None
+
+
+class LocalGeocoder:
+    """
+    Không gọi mạng, dùng khi chạy local/test: địa chỉ dạng "10.77,106.70" trả về đúng toạ độ đó,
+    địa chỉ khác được đặt cố định (theo hash) trong bán kính khoảng 5km quanh trung tâm TP.HCM.
+    """
+    center = (10.7769, 106.7009)
+    point_re = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+    def geocode(self, address):
+        match = self.point_re.match(address)
+        if match:
+            return float(match.group(1)), float(match.group(2))
+
+        digest = hashlib.sha1(address.encode('utf-8')).digest()
+        return (self.center[0] + (digest[0] - 128) / 128 * 0.03,
+                self.center[1] + (digest[1] - 128) / 128 * 0.03)
+
+
+_geocoders = {}
+
+
+def get_geocoder():
+    # một instance cho mỗi backend (giữ kết nối keep-alive)
+    path = settings.DELIVERY['GEOCODER']
+    if path not in _geocoders:
+        _geocoders[path] = import_string(path)()
+
+    return _geocoders[path]
+
+
+def normalize_address(address):
+    return ' '.join(address.lower().split())
+
+
+def geocode(address):
+    """
+    Toạ độ (lat, lng) của địa chỉ, None nếu không tìm thấy. Kết quả (kể cả không tìm thấy) được lưu
+    trong bảng GeocodedAddress và cache, mỗi địa chỉ chỉ gọi dịch vụ geocode một lần.
+    Raise GeocodeError khi không gọi được dịch vụ.
+    """
+    address = normalize_address(address)
+    address_hash = hashlib.sha1(address.encode('utf-8')).hexdigest()
+    key = GEOCODE_KEY % address_hash
+    point = cache.get(key)
+    if point is None:
+        point = GeocodedAddress.objects.filter(address_hash=address_hash) \
+            .values_list('latitude', 'longitude').first()
+        if point is None:
+            point = get_geocoder().geocode(address) or (None, None)
+            GeocodedAddress.objects.get_or_create(address_hash=address_hash, defaults={
+                'address': address[:255], 'latitude': point[0], 'longitude': point[1]})
+        cache.set(key, tuple(point), settings.DELIVERY['GEOCODE_TIMEOUT'])
+
+    return None if point[0] is None else tuple(point)
+
+
+def distance_km(a, b):
+    # khoảng cách đường chim bay (haversine)
+    lat1, lng1, lat2, lng2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(h))
+
+
+def get_zone_table(store_id):
+    """
+    Bảng phí tính sẵn của cửa hàng: (toạ độ cửa hàng, bán kính các bậc tăng dần, phí tương ứng).
+    Toạ độ None khi chưa xác định được vị trí cửa hàng.
+    """
+    key = ZONE_TABLE_KEY % store_id
+    table = cache.get(key)
+    if table is None:
+        address = User.objects.filter(pk=store_id).values_list('address', flat=True).first()
+        zones = list(DeliveryZone.objects.filter(store_id=store_id).order_by('max_distance')
+                     .values_list('max_distance', 'fee')) or settings.DELIVERY['DEFAULT_ZONES']
+        try:
+            point = geocode(address) if address else None
+        except GeocodeError:
+            # không lưu bảng, lần sau thử geocode lại
+            return None, (), ()
+        table = (point, tuple(float(d) for d, _ in zones), tuple(Decimal(f) for _, f in zones))
+        cache.set(key, table, None)
+
+    return table
+
+
+def delivery_fee(store_id, address):
+    # bảng phí và toạ độ địa chỉ đã cache: hai lần đọc cache, một phép tính khoảng cách và tìm nhị phân
+    point, bounds, fees = get_zone_table(store_id)
+    if point is None:
+        return Decimal(settings.PRICING['DELIVERY_FEE'])
+
+    try:
+        target = geocode(address)
+    except GeocodeError:
+        raise DeliveryError("Không xác định được vị trí địa chỉ giao hàng, vui lòng thử lại!")
+    if target is None:
+        raise DeliveryError("Không tìm thấy địa chỉ giao hàng!")
+
+    i = bisect_left(bounds, distance_km(point, target))
+    if i == len(bounds):
+        raise DeliveryError("Địa chỉ giao hàng nằm ngoài phạm vi giao hàng của cửa hàng!")
+
+    return fees[i]
+
+
+def invalidate_zone_table(store_id):
+    transaction.on_commit(lambda: cache.delete(ZONE_TABLE_KEY % store_id))
+
+
+@receiver(post_save, sender=DeliveryZone)
+@receiver(post_delete, sender=DeliveryZone)
+def zone_changed(sender, instance, **kwargs):
+    invalidate_zone_table(instance.store_id)
+
+
+# địa chỉ cửa hàng có thể đã đổi
+@receiver(post_save, sender=User)
+def store_changed(sender, instance, **kwargs):
+    if instance.user_role == User.STORE:
+        invalidate_zone_table(instance.pk)
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+ORDER_CREATED = 'order.created'
+ORDER_STATUS_CHANGED = 'order.status_changed'
+
+_broker = None
+_broker_path = None
+
+
+class Subscription:
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.ORDER_EVENTS['QUEUE_SIZE'])
+
+    def put(self, message):
+        # client đọc không kịp thì bỏ sự kiện, client sẽ tải lại danh sách khi kết nối lại
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Pub/sub trong cùng process: publish() gọi được từ thread của view đồng bộ,
+    sự kiện được đẩy vào queue của các kết nối đang mở trên event loop.
+    Chạy nhiều process thì thay bằng broker dùng chung (redis...) có cùng
+    giao diện publish/subscribe/unsubscribe qua setting ORDER_EVENTS['BROKER'].
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self.lock:
+            for channel in channels:
+                self.subscriptions.setdefault(channel, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subs = self.subscriptions.get(channel)
+                if subs is not None:
+                    subs.discard(subscription)
+                    if not subs:
+                        del self.subscriptions[channel]
+
+    def publish(self, channel, message):
+        with self.lock:
+            subs = list(self.subscriptions.get(channel, ()))
+        for subscription in subs:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # event loop của kết nối đã đóng
+                self.unsubscribe(subscription)
+
+
+def get_broker():
+    global _broker, _broker_path
+    path = settings.ORDER_EVENTS['BROKER']
+    if _broker is None or _broker_path != path:
+        _broker = import_string(path)()
+        _broker_path = path
+
+    return _broker
+
+
+def store_channel(store_id):
+    return 'store:%s' % store_id
+
+
+def user_channel(user_id):
+    return 'user:%s' % user_id
+
+
+def publish_order_event(order, event):
+    # gửi sau khi transaction commit để client không nhận sự kiện của đơn bị rollback
+    message = {
+        'event': event,
+        'order': order.pk,
+        'order_status': order.order_status,
+        'payment_status': order.payment_status,
+        'store': order.store_id,
+        'user': order.user_id,
+    }
+
+    def send():
+        broker = get_broker()
+        broker.publish(store_channel(order.store_id), message)
+        broker.publish(user_channel(order.user_id), message)
+
+    transaction.on_commit(send)
+
+
+def _get_token(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            auth = value.decode('latin1').split()
+            if len(auth) == 2 and auth[0].lower() == 'bearer':
+                return auth[1]
+    # EventSource của trình duyệt không gửi được header
+    token = parse_qs(scope.get('query_string', b'').decode('latin1')).get('access_token')
+    return token[0] if token else None
+
+
+class OrderEventStream:
+    """
+    ASGI app bọc ứng dụng Django: GET ORDER_EVENTS['PATH'] mở luồng Server-Sent Events
+    nhận sự kiện tạo đơn/đổi trạng thái đơn (cửa hàng nhận đơn của cửa hàng,
+    khách hàng nhận đơn của mình), các đường dẫn khác chuyển cho Django.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != settings.ORDER_EVENTS['PATH']:
+            return await self.app(scope, receive, send)
+
+        from .authentication import get_token_user
+        from .models import User
+
+        token = _get_token(scope)
+        user = await sync_to_async(get_token_user)(token) if token else None
+        if user is None:
+            return await self._send_json(send, 401, {"message": "Bạn chưa đăng nhập!"})
+
+        channel = store_channel(user.pk) if user.user_role == User.STORE else user_channel(user.pk)
+        subscription = get_broker().subscribe([channel])
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+            await self._stream(subscription, receive, send)
+        finally:
+            subscription.close()
+
+    async def _stream(self, subscription, receive, send):
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            while True:
+                message = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait({message, disconnected}, timeout=settings.ORDER_EVENTS['HEARTBEAT'],
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    message.cancel()
+                    return
+                if message in done:
+                    data = message.result()
+                    body = 'event: %s\ndata: %s\n\n' % (data['event'], json.dumps(data))
+                else:
+                    message.cancel()
+                    body = ': ping\n\n'
+                await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+        finally:
+            disconnected.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def _send_json(send, status, data):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(data, ensure_ascii=False).encode('utf-8')})
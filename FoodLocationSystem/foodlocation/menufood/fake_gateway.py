@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .payments import MomoClient, build_raw_signature, sign, verify_signature
+
+
+# cổng MoMo giả chạy local để test/benchmark MomoClient
+class FakeMomoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # giữ kết nối keep-alive như cổng thật
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server.requests += 1
+        if server.delay:
+            time.sleep(server.delay)
+
+        if server.requests <= server.fail_times:
+            return self.send_json({'resultCode': 99, 'message': 'Service unavailable'}, 503)
+        if not verify_signature(body, MomoClient.create_signature_keys, body.get('signature'), server.secret_key):
+            return self.send_json({'resultCode': 11, 'message': 'Invalid signature'}, 400)
+
+        self.send_json({
+            'partnerCode': body['partnerCode'],
+            'orderId': body['orderId'],
+            'requestId': body['requestId'],
+            'amount': body['amount'],
+            'responseTime': int(time.time() * 1000),
+            'message': 'Thành công.',
+            'resultCode': 0,
+            'payUrl': 'http://%s:%d/pay/%s' % (*server.server_address[:2], body['orderId']),
+        })
+
+    def send_json(self, data, code=200):
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeMomoGateway(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, secret_key, host='127.0.0.1', port=0, delay=0, fail_times=0):
+        super().__init__((host, port), FakeMomoHandler)
+        self.secret_key = secret_key
+        self.delay = delay
+        self.fail_times = fail_times
+        self.requests = 0
+        self.connections = 0
+
+    # client bỏ kết nối khi timeout, không cần in traceback
+    def handle_error(self, request, client_address):
+        pass
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+# IPN đã ký giống MoMo gửi về ipnUrl
+def make_ipn(config, request_id, amount, result_code=0, trans_id=None):
+    data = {
+        'partnerCode': config['PARTNER_CODE'],
+        'accessKey': config['ACCESS_KEY'],
+        'orderId': request_id,
+        'requestId': request_id,
+        'amount': int(amount),
+        'orderInfo': 'pay with MoMo',
+        'orderType': 'momo_wallet',
+        'transId': trans_id or int(time.time() * 1000),
+        'resultCode': result_code,
+        'message': 'Thành công.' if result_code == 0 else 'Giao dịch thất bại.',
+        'payType': 'qr',
+        'responseTime': int(time.time() * 1000),
+        'extraData': '',
+    }
+    data['signature'] = sign(build_raw_signature(data, MomoClient.ipn_signature_keys), config['SECRET_KEY'])
+    del data['accessKey']
+
+    return data
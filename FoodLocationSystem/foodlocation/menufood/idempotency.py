@@ -0,0 +1,105 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+
+def get_expired_before():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def take_over(existing, request_hash):
+    """
+    Request đầu tiên giữ key quá IDEMPOTENCY_LOCK_TIMEOUT mà chưa có response (worker bị kill/timeout):
+    request gửi lại nhận key bằng UPDATE có điều kiện, created_date mới là lượt giữ key của nó.
+    Trả về None nếu key vẫn đang được giữ hoặc request khác đã nhận trước.
+    """
+    now = timezone.now()
+    if existing.request_hash != request_hash \
+            or existing.created_date >= now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+        return None
+    claimed = IdempotencyKey.objects.filter(pk=existing.pk, response_status=None,
+                                            created_date=existing.created_date).update(created_date=now)
+    if not claimed:
+        return None
+
+    existing.created_date = now
+    return existing
+
+
+def idempotent(view_method):
+    """
+    Request POST gửi lại với cùng header Idempotency-Key nhận lại response đã lưu
+    mà không thực hiện ghi lần nữa. Dòng IdempotencyKey được chèn một lần trước khi
+    chạy view nên các request trùng gửi đồng thời sẽ nhận 409.
+    Chỉ lưu response thành công (2xx/3xx): response lỗi (trả về hay raise) trả lại key để client sửa rồi gửi lại.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        header = request.headers.get('Idempotency-Key')
+        if not header:
+            return view_method(self, request, *args, **kwargs)
+        if len(header) > 255:
+            return Response({"message": "Idempotency-Key không hợp lệ!"}, status=status.HTTP_400_BAD_REQUEST)
+
+        key = '%s:%s' % (request.user.pk or '', header)
+        request_hash = hashlib.sha256(('%s %s %s' % (request.method, request.path,
+                                                     json.dumps(request.data, sort_keys=True, default=str)))
+                                      .encode('utf-8')).hexdigest()
+
+        record = None
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(key=key, request_hash=request_hash)
+                break
+            except IntegrityError:
+                existing = IdempotencyKey.objects.filter(key=key).first()
+                if existing and existing.created_date < get_expired_before():
+                    # key đã hết hạn: xóa rồi chèn lại
+                    existing.delete()
+                    continue
+                if existing is not None and existing.response_status is None:
+                    record = take_over(existing, request_hash)
+                    if record is not None:
+                        break
+                if existing is None or existing.response_status is None:
+                    return Response({"message": "Request với Idempotency-Key này đang được xử lý!"},
+                                    status=status.HTTP_409_CONFLICT)
+                if existing.request_hash != request_hash:
+                    return Response({"message": "Idempotency-Key đã được dùng cho một request khác!"},
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+                response = Response(json.loads(existing.response_body), status=existing.response_status)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+        if record is None:
+            return Response({"message": "Request với Idempotency-Key này đang được xử lý!"},
+                            status=status.HTTP_409_CONFLICT)
+
+        # chỉ ghi/xoá khi vẫn còn giữ key (chưa bị request gửi lại nhận thay)
+        lease = IdempotencyKey.objects.filter(pk=record.pk, created_date=record.created_date)
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            lease.delete()
+            raise
+
+        if response.status_code >= 400:
+            lease.delete()
+        else:
+            lease.update(response_status=response.status_code,
+                         response_body=json.dumps(response.data, cls=JSONEncoder))
+
+        return response
+
+    return wrapper
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils._os import safe_join
+from django.utils.module_loading import import_string
+import cloudinary.uploader
+from PIL import Image, ImageOps
+
+from . import cloud_path
+
+# các kích thước ảnh client có thể chọn qua ?image_size=
+IMAGE_VARIANTS = {
+    'thumbnail': {'width': 100, 'height': 100, 'crop': 'fill', 'format': 'webp'},
+    'card': {'width': 480, 'height': 360, 'crop': 'fill', 'format': 'webp'},
+    'full': {},
+}
+DEFAULT_VARIANT = 'full'
+
+
+def get_image_storage():
+    return import_string(settings.IMAGE_STORAGE)()
+
+
+def requested_variant(request):
+    variant = request.GET.get('image_size') if request else None
+    return variant if variant in IMAGE_VARIANTS else DEFAULT_VARIANT
+
+
+def get_image_url(image, request=None, variant=None):
+    if image:
+        return get_image_storage().url(str(image), variant or requested_variant(request))
+
+
+def image_url_getter(request=None, variant=None):
+    # như get_image_url, storage và kích thước được chọn một lần cho cả danh sách
+    storage = get_image_storage()
+    variant = variant or requested_variant(request)
+    return lambda image: storage.url(str(image), variant) if image else None
+
+
+# url ảnh trên Cloudinary, kích thước/định dạng được Cloudinary biến đổi khi tải
+class CloudinaryImageStorage:
+    def upload(self, path):
+        return cloudinary.uploader.upload_resource(path, type='upload', resource_type='image')
+
+    def url(self, public_id, variant=DEFAULT_VARIANT):
+        options = IMAGE_VARIANTS[variant]
+        if not options:
+            return '{cloud_path}{image_name}'.format(cloud_path=cloud_path, image_name=public_id)
+
+        transformation = 'c_{crop},w_{width},h_{height},f_{format},q_auto'.format(**options)
+        return '{cloud_path}image/upload/{transformation}/{image_name}'.format(
+            cloud_path=cloud_path, transformation=transformation, image_name=public_id)
+
+
+# thay thế Cloudinary khi chạy local/test: ảnh gốc nằm trong IMAGE_LOCAL_ROOT,
+# ảnh theo kích thước được sinh ra một lần rồi lưu lại trong thư mục _variants
+class LocalImageStorage:
+    variants_dir = '_variants'
+
+    def __init__(self, root=None):
+        self.root = str(root or settings.IMAGE_LOCAL_ROOT)
+
+    def url(self, public_id, variant=DEFAULT_VARIANT):
+        return reverse('image-variant', kwargs={'variant': variant, 'public_id': public_id})
+
+    # chép file vào thư mục uploads, trả về giá trị lưu trong CloudinaryField
+    def upload(self, path):
+        name = os.path.basename(path)
+        os.makedirs(safe_join(self.root, 'uploads'), exist_ok=True)
+        shutil.copyfile(path, safe_join(self.root, 'uploads', name))
+
+        return 'image/upload/uploads/%s' % name
+
+    def original_path(self, public_id):
+        path = safe_join(self.root, public_id)
+        if os.path.isfile(path):
+            return path
+
+        # Cloudinary lưu public_id không có phần mở rộng
+        directory, name = os.path.split(path)
+        if os.path.isdir(directory):
+            for f in sorted(os.listdir(directory)):
+                if os.path.splitext(f)[0] == name:
+                    return os.path.join(directory, f)
+
+    def variant_path(self, public_id, variant):
+        original = self.original_path(public_id)
+        options = IMAGE_VARIANTS.get(variant)
+        if original is None or options is None:
+            return None
+        if not options:
+            return original
+
+        path = safe_join(self.root, self.variants_dir, variant,
+                         '%s.%s' % (os.path.splitext(public_id)[0], options['format']))
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(original):
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with Image.open(original) as img:
+            size = (options['width'], options['height'])
+            if options['crop'] == 'fill':
+                img = ImageOps.fit(img, size)
+            else:
+                img.thumbnail(size)
+            if options['format'] in ('jpg', 'jpeg') and img.mode != 'RGB':
+                img = img.convert('RGB')
+            # ghi ra file tạm rồi đổi tên để request song song không đọc phải file ghi dở
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as tmp:
+                img.save(tmp, format='JPEG' if options['format'] == 'jpg' else options['format'].upper())
+        os.replace(tmp.name, path)
+
+        return path
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from menufood.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Chuyển các đơn hàng đã giao thành công lâu ngày sang bảng lưu trữ (chạy định kỳ bằng cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Chỉ chuyển đơn tạo trước N ngày (mặc định ORDER_ARCHIVE["AFTER_DAYS"])')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Số đơn chuyển trong mỗi transaction')
+
+    def handle(self, *args, **options):
+        total = archive_orders(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Đã chuyển %d đơn hàng sang bảng lưu trữ.' % total))
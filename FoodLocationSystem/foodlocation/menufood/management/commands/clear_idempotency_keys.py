@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from menufood.idempotency import get_expired_before
+from menufood.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Xóa các Idempotency-Key đã hết hạn (chạy định kỳ bằng cron)'
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(created_date__lt=get_expired_before()).delete()
+        self.stdout.write(self.style.SUCCESS('Đã xóa %d Idempotency-Key hết hạn.' % deleted))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from menufood.fake_gateway import FakeMomoGateway
+
+
+class Command(BaseCommand):
+    help = 'Chạy cổng thanh toán MoMo giả ở local (đặt MOMO["ENDPOINT"] trỏ về đây để test/benchmark)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8010)
+        parser.add_argument('--delay', type=float, default=0, help='Độ trễ (giây) của mỗi response')
+
+    def handle(self, *args, **options):
+        server = FakeMomoGateway(settings.MOMO['SECRET_KEY'], port=options['port'], delay=options['delay'])
+        self.stdout.write('Fake MoMo gateway: %s' % server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from menufood.models import User
+from menufood.sharding import get_shards, shard_for_store, move_store
+
+
+class Command(BaseCommand):
+    help = 'Chuyển đơn hàng của một cửa hàng sang shard khác (nên tạm ngưng nhận đơn của cửa hàng khi chạy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('store_id', type=int)
+        parser.add_argument('shard', help='Alias của shard đích trong ORDER_SHARDS')
+
+    def handle(self, *args, **options):
+        store_id, shard = options['store_id'], options['shard']
+        if shard not in get_shards():
+            raise CommandError('Shard %s không có trong ORDER_SHARDS.' % shard)
+        if not User.objects.filter(id=store_id, user_role=User.STORE).exists():
+            raise CommandError('Không tìm thấy cửa hàng %d.' % store_id)
+
+        source = shard_for_store(store_id)
+        moved = move_store(store_id, shard)
+        self.stdout.write(self.style.SUCCESS('Đã chuyển %d đơn hàng của cửa hàng %d từ %s sang %s.'
+                                             % (moved, store_id, source, shard)))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from menufood.models import MediaUpload
+from menufood.uploads import process_upload
+
+
+class Command(BaseCommand):
+    help = 'Đẩy lại các ảnh còn chờ upload (vd: sau khi server khởi động lại)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Thử lại cả các ảnh đã upload lỗi')
+        parser.add_argument('--stale-minutes', type=int, default=10,
+                            help='Ảnh đang UPLOADING quá số phút này được xem như worker đã dừng')
+
+    def handle(self, *args, **options):
+        stale = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        MediaUpload.objects.filter(status=MediaUpload.UPLOADING, updated_date__lt=stale) \
+            .update(status=MediaUpload.PENDING, updated_date=timezone.now())
+        if options['retry_failed']:
+            MediaUpload.objects.filter(status=MediaUpload.FAILED) \
+                .update(status=MediaUpload.PENDING, updated_date=timezone.now())
+
+        done = failed = 0
+        for upload_id in MediaUpload.objects.filter(status=MediaUpload.PENDING).values_list('id', flat=True):
+            if process_upload(upload_id):
+                done += 1
+            else:
+                failed += 1
+
+        self.stdout.write(self.style.SUCCESS('Upload xong %d ảnh, lỗi %d ảnh.' % (done, failed)))
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from menufood.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Xóa Tombstone cũ hơn SYNC["TOMBSTONE_DAYS"] ngày (chạy định kỳ bằng cron)'
+
+    def handle(self, *args, **options):
+        expired_before = timezone.now() - timedelta(days=settings.SYNC['TOMBSTONE_DAYS'])
+        deleted, _ = Tombstone.objects.filter(deleted_date__lt=expired_before).delete()
+        self.stdout.write(self.style.SUCCESS('Đã xóa %d Tombstone.' % deleted))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from menufood.popularity import rebuild
+
+
+class Command(BaseCommand):
+    help = ('Đếm lại số lượt thích/đánh giá của món từ bảng Like/Rating '
+            '(chỉ chạy khi đã dừng các process đang phục vụ request, vd: lúc bảo trì)')
+
+    def handle(self, *args, **options):
+        total = rebuild()
+        self.stdout.write(self.style.SUCCESS('Đã cập nhật số liệu của %d món.' % total))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from menufood.stats import refresh_store_stats
+
+
+class Command(BaseCommand):
+    help = 'Tính lại thống kê đơn hàng/món ăn của các cửa hàng cho trang admin (chạy định kỳ bằng cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Chỉ tính lại số đơn hàng của N ngày gần nhất')
+
+    def handle(self, *args, **options):
+        refresh_store_stats(days=options['days'])
+        self.stdout.write(self.style.SUCCESS('Đã cập nhật thống kê cửa hàng.'))
@@ -28,7 +28,8 @@ class User(AbstractUser):
 
 class BaseModel(models.Model):
     created_date = models.DateTimeField(auto_now_add=True)
-    updated_date = models.DateTimeField(auto_now=True)
+    # index cho đồng bộ theo thời điểm thay đổi (menufood/sync.py)
+    updated_date = models.DateTimeField(auto_now=True, db_index=True)
     active = models.BooleanField(default=True)
 
     class Meta:
@@ -101,9 +102,10 @@ class Order(models.Model):
     payment_date = models.DateTimeField(auto_now=True)
     payment_status = models.BooleanField(default=False)
 
-    paymentmethod = models.ForeignKey(PaymentMethod, on_delete=models.PROTECT)
-    user = models.ForeignKey(User, on_delete=models.PROTECT)
-    store = models.ForeignKey(User, related_name='store_order', on_delete=models.CASCADE)
+    # đơn hàng có thể nằm ở shard khác với user/phương thức thanh toán (menufood/sharding.py)
+    paymentmethod = models.ForeignKey(PaymentMethod, on_delete=models.PROTECT, db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, db_constraint=False)
+    store = models.ForeignKey(User, related_name='store_order', on_delete=models.CASCADE, db_constraint=False)
 
     def __str__(self):
         return self.receiver_name
@@ -114,7 +116,7 @@ class OrderDetail(models.Model):
     quantity = models.IntegerField(default=1)
 
     order = models.ForeignKey(Order, on_delete=models.PROTECT)
-    food = models.ForeignKey(Food, on_delete=models.PROTECT)
+    food = models.ForeignKey(Food, on_delete=models.PROTECT, db_constraint=False)
 
 
 class ActionBase(BaseModel):
@@ -161,3 +163,194 @@ class Subcribes(BaseModel):
 
     class Meta:
         unique_together = ("follower", "store")
+
+
+# số lượt thích/đánh giá của món, cộng dồn theo lô từ bộ đệm ghi sau (menufood/popularity.py)
+class FoodPopularity(models.Model):
+    food = models.OneToOneField(Food, related_name='popularity', on_delete=models.CASCADE)
+    likes = models.IntegerField(default=0)
+    ratings = models.IntegerField(default=0)   #số lượt đánh giá
+    rating_total = models.IntegerField(default=0)   #tổng điểm đánh giá
+    updated_date = models.DateTimeField(auto_now=True)
+
+
+# thống kê được tính sẵn cho trang admin (cập nhật bởi lệnh refresh_store_stats)
+class StoreStats(models.Model):
+    store = models.OneToOneField(User, related_name='stats', on_delete=models.CASCADE)
+    total_products = models.PositiveIntegerField(default=0)
+    refreshed_date = models.DateTimeField(auto_now=True)
+
+
+class StoreDailyStats(models.Model):
+    store = models.ForeignKey(User, related_name='daily_stats', on_delete=models.CASCADE)
+    date = models.DateField(db_index=True)
+    total_orders = models.PositiveIntegerField(default=0)   #số đơn giao thành công trong ngày
+    revenue = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+
+    class Meta:
+        unique_together = ('store', 'date')
+
+
+# ảnh đã nhận từ request, đang chờ đẩy lên storage (menufood/uploads.py)
+class MediaUpload(models.Model):
+    PENDING, UPLOADING, DONE, FAILED = range(4)
+    STATUS = [
+        (PENDING, "PENDING"),
+        (UPLOADING, "UPLOADING"),
+        (DONE, "DONE"),
+        (FAILED, "FAILED")
+    ]
+    status = models.PositiveSmallIntegerField(choices=STATUS, default=PENDING)
+
+    model = models.CharField(max_length=100)   #vd: menufood.Food
+    object_id = models.BigIntegerField()
+    field_name = models.CharField(max_length=50)
+    staged_path = models.CharField(max_length=255)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=255, null=True)
+
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'updated_date'])]
+
+
+# mỗi lần gọi cổng thanh toán MoMo tạo link thanh toán (menufood/payments.py)
+class PaymentAttempt(models.Model):
+    INITIATED, PENDING, SUCCESS, FAILED = range(4)
+    STATUS = [
+        (INITIATED, "INITIATED"),   #đang gọi cổng thanh toán
+        (PENDING, "PENDING"),   #đã có payUrl, chờ khách thanh toán
+        (SUCCESS, "SUCCESS"),
+        (FAILED, "FAILED")
+    ]
+    status = models.PositiveSmallIntegerField(choices=STATUS, default=INITIATED)
+
+    # không ràng buộc khoá ngoại: đơn đã giao có thể được chuyển sang bảng lưu trữ (menufood/archive.py)
+    order = models.ForeignKey(Order, related_name='payment_attempts', on_delete=models.DO_NOTHING, null=True,
+                              db_constraint=False)
+    request_id = models.CharField(max_length=50, unique=True)   #requestId = orderId gửi cho MoMo
+    amount = models.DecimalField(max_digits=10, decimal_places=0)
+    pay_url = models.CharField(max_length=500, null=True)
+    result_code = models.IntegerField(null=True)
+    message = models.CharField(max_length=255, null=True)
+
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+
+# IPN của MoMo đã nhận, transaction_key duy nhất để mỗi giao dịch chỉ được xử lý một lần
+class PaymentNotification(models.Model):
+    transaction_key = models.CharField(max_length=100, unique=True)   #orderId:transId
+    request_id = models.CharField(max_length=50)
+    result_code = models.IntegerField()
+    created_date = models.DateTimeField(auto_now_add=True)
+
+
+# response đã trả cho request POST có header Idempotency-Key (menufood/idempotency.py)
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=300, unique=True)   #user_id:Idempotency-Key
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)   #null: request đầu tiên đang xử lý
+    response_body = models.TextField(null=True)
+    created_date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+# log chuyển trạng thái đơn hàng, chỉ ghi thêm (menufood/orders.py)
+class OrderEvent(models.Model):
+    # không ràng buộc khoá ngoại để log vẫn còn khi đơn bị xoá/chuyển đi
+    order = models.ForeignKey(Order, related_name='events', on_delete=models.DO_NOTHING, db_constraint=False)
+    store = models.ForeignKey(User, related_name='store_order_events', on_delete=models.DO_NOTHING,
+                              db_constraint=False)
+    user = models.ForeignKey(User, related_name='order_events', on_delete=models.DO_NOTHING, db_constraint=False)
+    from_status = models.PositiveSmallIntegerField(choices=Order.STATUS, null=True)   #null: đơn mới tạo
+    to_status = models.PositiveSmallIntegerField(choices=Order.STATUS)
+    actor = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True, db_constraint=False)
+    created_date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        # "các đơn thay đổi từ thời điểm X" của cửa hàng / khách hàng
+        indexes = [models.Index(fields=['store', 'created_date']), models.Index(fields=['user', 'created_date'])]
+
+
+# đơn hàng đã giao thành công lâu ngày được chuyển khỏi bảng Order (menufood/archive.py), giữ nguyên id
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    created_date = models.DateTimeField(db_index=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=0)
+    delivery_fee = models.DecimalField(max_digits=6, decimal_places=0)
+    order_status = models.PositiveSmallIntegerField(choices=Order.STATUS)
+
+    receiver_name = models.CharField(max_length=100)
+    receiver_phone = models.CharField(max_length=11)
+    receiver_address = models.CharField(max_length=255)
+
+    payment_date = models.DateTimeField()
+    payment_status = models.BooleanField()
+
+    paymentmethod = models.ForeignKey(PaymentMethod, related_name='+', on_delete=models.PROTECT, db_constraint=False)
+    user = models.ForeignKey(User, related_name='archived_orders', on_delete=models.PROTECT, db_constraint=False)
+    store = models.ForeignKey(User, related_name='store_archived_orders', on_delete=models.CASCADE,
+                              db_constraint=False)
+    archived_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['store', 'created_date']), models.Index(fields=['user', 'created_date'])]
+
+    def __str__(self):
+        return self.receiver_name
+
+
+class ArchivedOrderDetail(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=0)
+    quantity = models.IntegerField(default=1)
+
+    order = models.ForeignKey(ArchivedOrder, related_name='details', on_delete=models.CASCADE)
+    food = models.ForeignKey(Food, related_name='+', on_delete=models.PROTECT, db_constraint=False)
+
+
+# shard chứa đơn của cửa hàng khi đã được chuyển khỏi shard mặc định (menufood/sharding.py)
+class StoreShard(models.Model):
+    store = models.OneToOneField(User, related_name='shard', on_delete=models.CASCADE)
+    shard = models.CharField(max_length=50)   #alias trong DATABASES
+    updated_date = models.DateTimeField(auto_now=True)
+
+
+# cấp id duy nhất cho đơn/chi tiết đơn trên mọi shard
+class OrderSequence(models.Model):
+    pass
+
+
+# dòng đã bị xoá, để client đồng bộ (menufood/sync.py) xoá bản lưu trên máy
+class Tombstone(models.Model):
+    model = models.CharField(max_length=50)   #tên danh sách trong response đồng bộ, vd: foods
+    object_id = models.BigIntegerField()
+    # dòng riêng của một user (like, đánh giá, theo dõi), null: dữ liệu chung
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, null=True, db_constraint=False)
+    deleted_date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'deleted_date'])]
+
+
+# bậc phí giao hàng theo khoảng cách từ cửa hàng (menufood/delivery.py)
+class DeliveryZone(models.Model):
+    store = models.ForeignKey(User, related_name='delivery_zones', on_delete=models.CASCADE,
+                              limit_choices_to={'user_role': User.STORE})
+    max_distance = models.DecimalField(max_digits=5, decimal_places=2)   #km, giao trong bán kính này
+    fee = models.DecimalField(max_digits=6, decimal_places=0)
+
+    class Meta:
+        unique_together = ('store', 'max_distance')
+
+
+# kết quả geocode địa chỉ, mỗi địa chỉ chỉ gọi dịch vụ geocode một lần (menufood/delivery.py)
+class GeocodedAddress(models.Model):
+    address_hash = models.CharField(max_length=40, unique=True)   #sha1 của địa chỉ đã chuẩn hoá
+    address = models.CharField(max_length=255)
+    # null: dịch vụ geocode không tìm thấy địa chỉ
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    created_date = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,164 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .events import publish_order_event, ORDER_CREATED, ORDER_STATUS_CHANGED
+from .models import Order, OrderEvent
+from .sharding import for_store, all_shards, join_default, write_db
+
+# vòng đời đơn hàng: PENDING -> ACCEPTED -> SUCCESSED
+NEXT_STATUS = {
+    Order.PENDING: Order.ACCEPTED,
+    Order.ACCEPTED: Order.SUCCESSED,
+}
+PREVIOUS_STATUS = {v: k for k, v in NEXT_STATUS.items()}
+
+# số đơn tối đa trong một lần xác nhận hàng loạt
+BULK_CONFIRM_LIMIT = 100
+
+logger = logging.getLogger(__name__)
+
+_mail_executor = None
+
+
+def get_mail_executor():
+    global _mail_executor
+    if _mail_executor is None:
+        _mail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='order-mail')
+
+    return _mail_executor
+
+
+def _status_values(to_status):
+    values = {'order_status': to_status, 'payment_date': timezone.now()}
+    if to_status == Order.SUCCESSED:
+        # giao thành công = đã thu tiền
+        values['payment_status'] = True
+    return values
+
+
+def _event(order, from_status, to_status, actor):
+    return OrderEvent(order_id=order.pk, store_id=order.store_id, user_id=order.user_id,
+                      from_status=from_status, to_status=to_status, actor=actor)
+
+
+def record_created(order, actor=None):
+    OrderEvent.objects.using(order._state.db).create(order_id=order.pk, store_id=order.store_id,
+                                                     user_id=order.user_id, from_status=None,
+                                                     to_status=order.order_status, actor=actor)
+    publish_order_event(order, ORDER_CREATED)
+
+
+def transition(order, to_status, actor=None):
+    """
+    Chuyển đơn sang to_status bằng UPDATE có điều kiện trạng thái hiện tại.
+    Trả về False nếu đơn không ở trạng thái liền trước (đã bị request khác xử lý),
+    khi đó không ghi log và không gửi sự kiện.
+    """
+    from_status = PREVIOUS_STATUS.get(to_status)
+    if from_status is None:
+        return False
+
+    values = _status_values(to_status)
+    with transaction.atomic(using=order._state.db):
+        if not Order.objects.using(order._state.db).filter(id=order.pk, order_status=from_status).update(**values):
+            return False
+        _event(order, from_status, to_status, actor).save(using=order._state.db)
+
+    for k, v in values.items():
+        setattr(order, k, v)
+    publish_order_event(order, ORDER_STATUS_CHANGED)
+    return True
+
+
+def bulk_transition(orders, to_status, actor=None):
+    """
+    Chuyển nhiều đơn (queryset trên cùng một shard) sang to_status trong một transaction:
+    khoá các đơn đang ở trạng thái liền trước, một câu UPDATE cho cả nhóm và bulk insert log.
+    Trả về danh sách đơn đã được chuyển.
+    """
+    from_status = PREVIOUS_STATUS.get(to_status)
+    if from_status is None:
+        return []
+
+    values = _status_values(to_status)
+    db = write_db(orders)
+    with transaction.atomic(using=db):
+        changed = list(orders.filter(order_status=from_status).select_for_update()
+                       .only('id', 'store_id', 'user_id', 'order_status', 'payment_status'))
+        if not changed:
+            return []
+        Order.objects.using(db).filter(id__in=[o.pk for o in changed], order_status=from_status).update(**values)
+        OrderEvent.objects.using(db).bulk_create([_event(o, from_status, to_status, actor) for o in changed],
+                                                 batch_size=1000)
+
+    for order in changed:
+        for k, v in values.items():
+            setattr(order, k, v)
+        publish_order_event(order, ORDER_STATUS_CHANGED)
+    return changed
+
+
+def changed_order_ids(since, store=None, user=None):
+    # id các đơn có thay đổi trạng thái sau thời điểm since (dùng index store/user + created_date)
+    shards = [for_store(OrderEvent, getattr(store, 'pk', store))] if store is not None else all_shards(OrderEvent)
+    ids = set()
+    for events in shards:
+        events = events.filter(created_date__gt=since)
+        if store is not None:
+            events = events.filter(store=store)
+        if user is not None:
+            events = events.filter(user=user)
+        ids.update(events.order_by().values_list('order_id', flat=True).distinct())
+    return ids
+
+
+def completed_email(order):
+    # mail gửi khách hàng khi đơn giao thành công, None nếu khách không có email
+    email = order.user.email
+    if not email:
+        return None
+    subject = "Xác nhận đơn hàng đã được giao thành công"
+    content = """
+        Chào {0},
+        Chúng tôi đã ghi nhận thanh toán của bạn.
+        Chi tiết:
+        Mã đơn hàng: {1}
+        Tên cửa hàng: {2}
+        Tên khách hàng nhận: {3}
+        Địa chỉ giao hàng: {4}
+        Tổng thanh toán: {5:,.0f} VND
+        Hình thức thanh toán: {6}
+        Ngày thanh toán: {7}
+        Cám ơn bạn đã tin tưởng chọn dịch vụ của chúng tôi.
+        Mọi thắc mắc và yêu cầu hỗ trợ xin gửi về địa chỉ foodlocationapp@gmail.com.
+        """.format(order.user.first_name + " " + order.user.last_name,
+                   order.pk, order.store.name_store,
+                   order.receiver_name, order.receiver_address,
+                   order.amount, order.paymentmethod.name, order.payment_date)
+    return EmailMessage(subject, content, to=[email])
+
+
+def _send_messages(messages):
+    # lỗi SMTP chỉ ghi log: trạng thái đơn đã được lưu, không được làm hỏng response
+    try:
+        get_connection().send_messages(messages)
+    except Exception:
+        logger.exception('Sending %d order emails failed', len(messages))
+
+
+def notify_completed(orders):
+    """
+    Gửi mail cho các đơn vừa giao thành công (queryset) sau khi commit.
+    Mail được dựng trong request, kết nối SMTP chạy ở thread nền qua một kết nối duy nhất.
+    """
+    def send():
+        messages = [m for m in map(completed_email, join_default(orders, 'user', 'store', 'paymentmethod'))
+                    if m is not None]
+        if messages:
+            get_mail_executor().submit(_send_messages, messages)
+
+    transaction.on_commit(send, using=write_db(orders))
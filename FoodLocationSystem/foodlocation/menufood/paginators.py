@@ -1,3 +1,6 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from rest_framework import pagination
 from rest_framework.response import Response
 
@@ -20,3 +23,34 @@ class BaseCustomPaginator(pagination.PageNumberPagination):
 
 class StorePaginator(pagination.PageNumberPagination):
     page_size = 5
+
+
+# số dòng ước lượng theo thống kê của DB (MySQL/PostgreSQL), None nếu không hỗ trợ
+def estimate_table_rows(model, using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                           "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [model._meta.db_table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [model._meta.db_table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+# phân trang cho bảng lớn: không lọc thì dùng số dòng ước lượng thay cho COUNT(*)
+class EstimatedCountPaginator(Paginator):
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimate_table_rows(queryset.model, queryset.db)
+            if estimate and estimate > self.estimate_threshold:
+                return estimate
+
+        return super().count
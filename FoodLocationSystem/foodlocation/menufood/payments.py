@@ -0,0 +1,148 @@
+import hashlib
+import hmac
+import time
+import uuid
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import Order, PaymentAttempt, PaymentNotification
+from .sharding import all_shards
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+# chuỗi ký theo định dạng của MoMo: key=value nối bằng &, key theo thứ tự alphabet
+def build_raw_signature(params, keys):
+    return '&'.join('%s=%s' % (k, params[k]) for k in sorted(keys))
+
+
+def sign(raw_signature, secret_key=None):
+    secret_key = secret_key or settings.MOMO['SECRET_KEY']
+    return hmac.new(secret_key.encode('utf-8'), raw_signature.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def verify_signature(params, keys, signature, secret_key=None):
+    return hmac.compare_digest(sign(build_raw_signature(params, keys), secret_key), signature or '')
+
+
+class MomoClient:
+    create_path = '/v2/gateway/api/create'
+    create_signature_keys = ['accessKey', 'amount', 'extraData', 'ipnUrl', 'orderId', 'orderInfo',
+                             'partnerCode', 'redirectUrl', 'requestId', 'requestType']
+    ipn_signature_keys = ['accessKey', 'amount', 'extraData', 'message', 'orderId', 'orderInfo', 'orderType',
+                          'partnerCode', 'payType', 'requestId', 'responseTime', 'resultCode', 'transId']
+
+    def __init__(self, config):
+        self.config = config
+        # giữ kết nối keep-alive, tự thử lại khi lỗi kết nối/timeout/5xx
+        # (cùng requestId/orderId nên MoMo không tạo trùng giao dịch)
+        retry = Retry(total=config['MAX_RETRIES'], status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['POST']), backoff_factor=0.2, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['POOL_SIZE'], max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def new_request_id(self):
+        return '%s%d%s' % (self.config['PARTNER_CODE'], int(time.time() * 1000), uuid.uuid4().hex[:8])
+
+    def create_payment(self, amount, order_info, redirect_url, ipn_url, extra_data='', order=None):
+        request_id = self.new_request_id()
+        attempt = PaymentAttempt.objects.create(order=order, request_id=request_id, amount=amount)
+
+        data = {
+            'partnerCode': self.config['PARTNER_CODE'],
+            'accessKey': self.config['ACCESS_KEY'],
+            'requestId': request_id,
+            'amount': str(amount),
+            'orderId': request_id,
+            'orderInfo': order_info,
+            'redirectUrl': redirect_url,
+            'ipnUrl': ipn_url,
+            'extraData': extra_data,
+            'requestType': 'captureWallet',
+        }
+        data['signature'] = sign(build_raw_signature(data, self.create_signature_keys), self.config['SECRET_KEY'])
+        data['lang'] = 'en'
+
+        try:
+            res = self.session.post(self.config['ENDPOINT'] + self.create_path, json=data,
+                                    timeout=(self.config['CONNECT_TIMEOUT'], self.config['READ_TIMEOUT']))
+            result = res.json()
+        except (requests.RequestException, ValueError) as e:
+            attempt.status = PaymentAttempt.FAILED
+            attempt.message = str(e)[:255]
+            attempt.save()
+            raise PaymentGatewayError('Không kết nối được cổng thanh toán!') from e
+
+        attempt.result_code = result.get('resultCode')
+        attempt.message = (result.get('message') or '')[:255]
+        attempt.pay_url = result.get('payUrl')
+        attempt.status = PaymentAttempt.PENDING if attempt.pay_url else PaymentAttempt.FAILED
+        attempt.save()
+        if not attempt.pay_url:
+            raise PaymentGatewayError(attempt.message or 'Tạo thanh toán không thành công!')
+
+        return attempt
+
+    def verify_ipn(self, data):
+        params = {**data, 'accessKey': self.config['ACCESS_KEY']}
+        if any(k not in params for k in self.ipn_signature_keys):
+            return False
+
+        return verify_signature(params, self.ipn_signature_keys, data.get('signature'), self.config['SECRET_KEY'])
+
+
+def process_ipn(data):
+    """
+    Ghi nhận kết quả thanh toán từ IPN đã được xác thực chữ ký.
+    Trả về False nếu giao dịch này đã được xử lý trước đó (MoMo gửi lại/gửi trùng).
+    """
+    result_code = int(data['resultCode'])
+    with transaction.atomic():
+        # chèn một lần theo key duy nhất: các IPN trùng (kể cả gửi đồng thời) đều dừng ở đây
+        try:
+            with transaction.atomic():
+                PaymentNotification.objects.create(transaction_key='%s:%s' % (data['orderId'], data['transId']),
+                                                   request_id=data['orderId'], result_code=result_code)
+        except IntegrityError:
+            return False
+
+        # UPDATE có điều kiện, không đọc-sửa-ghi
+        attempts = PaymentAttempt.objects.filter(request_id=data['orderId'], amount=data['amount'],
+                                                 status=PaymentAttempt.PENDING)
+        attempts.update(status=PaymentAttempt.SUCCESS if result_code == 0 else PaymentAttempt.FAILED,
+                        result_code=result_code, message=str(data.get('message', ''))[:255],
+                        updated_date=timezone.now())
+        if result_code == 0:
+            # đơn hàng có thể nằm ở shard khác với bảng PaymentAttempt
+            order_ids = list(PaymentAttempt.objects.filter(request_id=data['orderId'], status=PaymentAttempt.SUCCESS,
+                                                           order__isnull=False).values_list('order_id', flat=True))
+            if order_ids:
+                # số tiền đã trả phải bằng tổng tiền đơn (tiền món + phí giao hàng)
+                for orders in all_shards(Order):
+                    orders.filter(id__in=order_ids, payment_status=False,
+                                  amount=Decimal(data['amount']) - F('delivery_fee')) \
+                        .update(payment_status=True, payment_date=timezone.now())
+
+    return True
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None or _client.config is not settings.MOMO:
+        _client = MomoClient(settings.MOMO)
+
+    return _client
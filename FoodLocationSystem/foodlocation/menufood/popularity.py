@@ -0,0 +1,132 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction, DatabaseError
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import Coalesce, NullIf
+
+from .models import Like, Rating, FoodPopularity
+
+logger = logging.getLogger(__name__)
+
+# food_id -> [likes, ratings, rating_total] chưa ghi xuống DB (trong process)
+_pending = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_flusher = None
+
+
+def record(food_id, likes=0, ratings=0, rating_total=0):
+    """
+    Cộng dồn thay đổi số lượt thích/đánh giá của món trong bộ nhớ, ghi theo lô bằng flush()
+    (định kỳ mỗi POPULARITY['FLUSH_INTERVAL'] giây hoặc khi đủ MAX_PENDING món).
+    Món được nhiều người thích cùng lúc không bị khoá dòng FoodPopularity theo từng request.
+    Chỉ tính khi transaction của request commit.
+    """
+    transaction.on_commit(lambda: _add(food_id, (likes, ratings, rating_total)))
+
+
+def _add(food_id, delta):
+    global _flusher
+    with _lock:
+        counts = _pending.setdefault(food_id, [0, 0, 0])
+        for i, d in enumerate(delta):
+            counts[i] += d
+        due = len(_pending) >= settings.POPULARITY['MAX_PENDING'] \
+            or time.monotonic() - _last_flush >= settings.POPULARITY['FLUSH_INTERVAL']
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='popularity-flush', daemon=True)
+            _flusher.start()
+
+    if due:
+        flush()
+
+
+def _flush_loop():
+    # process không còn request vẫn ghi các thay đổi đang chờ
+    while True:
+        time.sleep(settings.POPULARITY['FLUSH_INTERVAL'])
+        try:
+            flush()
+        except Exception:
+            logger.exception('Popularity flush failed')
+        finally:
+            connections.close_all()
+
+
+def flush():
+    """
+    Ghi các thay đổi đang chờ: tạo dòng FoodPopularity còn thiếu và một câu UPDATE col = col + n
+    cho mỗi nhóm món có cùng thay đổi. Lỗi DB thì trả lại bộ đệm để lần sau ghi. Trả về số món đã ghi.
+    """
+    global _pending, _last_flush
+    with _lock:
+        pending, _pending = _pending, {}
+        _last_flush = time.monotonic()
+    pending = {food_id: counts for food_id, counts in pending.items() if any(counts)}
+    if not pending:
+        return 0
+
+    groups = defaultdict(list)
+    for food_id in sorted(pending):
+        groups[tuple(pending[food_id])].append(food_id)
+    try:
+        with transaction.atomic():
+            FoodPopularity.objects.bulk_create([FoodPopularity(food_id=food_id) for food_id in sorted(pending)],
+                                               ignore_conflicts=True)
+            for (likes, ratings, rating_total), food_ids in groups.items():
+                FoodPopularity.objects.filter(food_id__in=food_ids).update(
+                    likes=F('likes') + likes, ratings=F('ratings') + ratings,
+                    rating_total=F('rating_total') + rating_total)
+    except DatabaseError:
+        with _lock:
+            for food_id, delta in pending.items():
+                counts = _pending.setdefault(food_id, [0, 0, 0])
+                for i, d in enumerate(delta):
+                    counts[i] += d
+        raise
+
+    return len(pending)
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Popularity flush failed')
+
+
+atexit.register(_flush_at_exit)
+
+
+def annotate_counts(queryset):
+    # số lượt thích/đánh giá của món (JOIN FoodPopularity), không đếm bảng Like/Rating mỗi request
+    return queryset.annotate(
+        like_count=Coalesce(F('popularity__likes'), 0),
+        rating_count=Coalesce(F('popularity__ratings'), 0),
+        rating_avg=ExpressionWrapper(F('popularity__rating_total') * 1.0 / NullIf(F('popularity__ratings'), 0),
+                                     output_field=FloatField()))
+
+
+def rebuild():
+    """
+    Đếm lại từ bảng Like/Rating, ghi đè toàn bộ FoodPopularity.
+    Thay đổi còn trong bộ đệm của process khác (đã được tính trong lần đếm này) sẽ bị cộng thêm lần nữa khi
+    process đó flush: chỉ chạy khi không còn process nào đang ghi (vd: lúc bảo trì, trước khi chạy server).
+    """
+    flush()
+    likes = dict(Like.objects.filter(liked=True).values('food').annotate(n=Count('id')).values_list('food', 'n'))
+    ratings = {food: (n, total) for food, n, total in Rating.objects.values('food')
+               .annotate(n=Count('id'), total=Sum('rate')).values_list('food', 'n', 'total')}
+    rows = [FoodPopularity(food_id=food_id, likes=likes.get(food_id, 0), ratings=ratings.get(food_id, (0, 0))[0],
+                           rating_total=ratings.get(food_id, (0, 0))[1] or 0)
+            for food_id in sorted(set(likes) | set(ratings))]
+    with transaction.atomic():
+        FoodPopularity.objects.all().delete()
+        FoodPopularity.objects.bulk_create(rows, batch_size=1000)
+
+    return len(rows)
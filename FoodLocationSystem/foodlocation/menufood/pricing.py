@@ -0,0 +1,130 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import delivery
+from .models import Food, MenuItem, DeliveryZone
+
+PRICE_VERSION_KEY = 'price-version'
+QUOTE_KEY = 'cart-quote:%s:%s'  # version giá, hash giỏ hàng
+
+
+class PricingError(Exception):
+    # message trả về cho client
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def parse_cart(items):
+    """
+    [{'food': id, 'quantity': n}, ...] -> ((food_id, quantity), ...) sắp theo id, gộp các dòng cùng món.
+    Raise PricingError nếu giỏ hàng không hợp lệ.
+    """
+    if not isinstance(items, list) or not items or len(items) > settings.PRICING['MAX_ITEMS']:
+        raise PricingError("Giỏ hàng không hợp lệ (tối đa %d món)!" % settings.PRICING['MAX_ITEMS'])
+
+    cart = {}
+    for item in items:
+        food, quantity = (item.get('food'), item.get('quantity', 1)) if isinstance(item, dict) else (None, None)
+        if not _is_int(food) or not _is_int(quantity) or quantity < 1:
+            raise PricingError("Món ăn nào được đặt không hợp lệ!")
+        cart[food] = cart.get(food, 0) + quantity
+    if max(cart.values()) > settings.PRICING['MAX_QUANTITY']:
+        raise PricingError("Mỗi món được đặt tối đa %d phần!" % settings.PRICING['MAX_QUANTITY'])
+
+    return tuple(sorted(cart.items()))
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def quote(items, address=None, use_cache=True):
+    """
+    Tính tiền giỏ hàng: giá từng dòng, tổng tiền món (amount), phí giao hàng và tổng cộng.
+    Một truy vấn cho mọi món; kiểm tra món còn bán, trong giờ bán và cùng một cửa hàng.
+    Kết quả được cache theo hash giỏ hàng cho các lần báo giá lặp lại khi khách sửa giỏ,
+    tạo đơn thì gọi với use_cache=False.
+    """
+    cart = parse_cart(items)
+    if not use_cache:
+        return _quote(cart, address)
+
+    version = cache.get_or_set(PRICE_VERSION_KEY, time.time_ns, None)
+    digest = hashlib.sha1(json.dumps([cart, address]).encode()).hexdigest()
+    key = QUOTE_KEY % (version, digest)
+    result = cache.get(key)
+    if result is None:
+        result = _quote(cart, address)
+        cache.set(key, result, settings.PRICING['QUOTE_TIMEOUT'])
+
+    return result
+
+
+def _quote(cart, address):
+    foods = {f['id']: f for f in Food.objects.filter(pk__in=[food for food, _ in cart]).values(
+        'id', 'name', 'price', 'active', 'start_time', 'end_time', 'menu_item__active', 'menu_item__store_id')}
+
+    now = timezone.localtime().time()
+    lines = []
+    for food_id, quantity in cart:
+        food = foods.get(food_id)
+        if food is None:
+            raise PricingError("Món ăn nào được đặt không hợp lệ!")
+        if not food['active'] or not food['menu_item__active']:
+            raise PricingError(f"Món ăn {food['name']} hiện tại không còn bán!")
+        if not in_selling_window(food['start_time'], food['end_time'], now):
+            raise PricingError(f"Món ăn {food['name']} chỉ bán từ {food['start_time'] or ''} "
+                               f"đến {food['end_time'] or ''}!")
+        lines.append({'food': food_id, 'name': food['name'], 'unit_price': food['price'], 'quantity': quantity,
+                      'line_total': food['price'] * quantity})
+
+    stores = {food['menu_item__store_id'] for food in foods.values()}
+    if len(stores) > 1:
+        raise PricingError("Các món trong một đơn phải cùng một cửa hàng!")
+
+    store = stores.pop()
+    amount = sum(line['line_total'] for line in lines)
+    delivery_fee = get_delivery_fee(store, address)
+    return {'store': store, 'lines': lines, 'amount': amount, 'delivery_fee': delivery_fee,
+            'total': amount + delivery_fee if delivery_fee is not None else None}
+
+
+def in_selling_window(start, end, now):
+    # khung giờ bán có thể qua nửa đêm (22:00 - 02:00)
+    if start is not None and end is not None and start > end:
+        return now >= start or now <= end
+
+    return (start is None or now >= start) and (end is None or now <= end)
+
+
+def get_delivery_fee(store_id, address):
+    # chưa có địa chỉ giao hàng (báo giá khi đang chọn món): chưa tính phí
+    if not address:
+        return None
+    try:
+        return delivery.delivery_fee(store_id, address)
+    except delivery.DeliveryError as e:
+        raise PricingError(e.message)
+
+
+def bump_price_version():
+    # báo giá đã cache không còn dùng được sau khi giá/trạng thái món, bậc phí giao hàng thay đổi
+    transaction.on_commit(lambda: cache.set(PRICE_VERSION_KEY, time.time_ns(), None))
+
+
+@receiver(post_save, sender=Food)
+@receiver(post_delete, sender=Food)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_save, sender=DeliveryZone)
+@receiver(post_delete, sender=DeliveryZone)
+def catalog_changed(sender, **kwargs):
+    bump_price_version()
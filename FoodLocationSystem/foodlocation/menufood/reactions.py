@@ -0,0 +1,63 @@
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from . import popularity
+from .models import Like, Rating
+
+# số lần thử lại khi request khác cùng ghi like/đánh giá của user
+MAX_ATTEMPTS = 3
+# thang điểm đánh giá
+MIN_RATE, MAX_RATE = 1, 5
+
+
+def toggle_like(food_id, user_id):
+    """
+    Đổi trạng thái thích món của user bằng UPDATE có điều kiện (không đọc rồi ghi cả dòng),
+    chưa có thì INSERT; hai request đồng thời không làm lỗi unique (food, user). Trả về trạng thái mới.
+    """
+    likes = Like.objects.filter(food_id=food_id, user_id=user_id)
+    for _ in range(MAX_ATTEMPTS):
+        for liked in (True, False):
+            if likes.filter(liked=not liked).update(liked=liked, updated_date=timezone.now()):
+                popularity.record(food_id, likes=1 if liked else -1)
+                return liked
+        try:
+            with transaction.atomic():
+                Like.objects.create(food_id=food_id, user_id=user_id, liked=True)
+        except IntegrityError:
+            # request khác vừa tạo dòng, đổi trạng thái dòng đó
+            continue
+        popularity.record(food_id, likes=1)
+        return True
+
+    return likes.values_list('liked', flat=True).get()
+
+
+def set_rating(food_id, user_id, rate):
+    """
+    Ghi điểm đánh giá: INSERT nếu chưa có, nếu có thì UPDATE với điều kiện điểm cũ chưa bị request khác đổi
+    (so sánh và ghi), để cộng đúng thay đổi vào tổng điểm của món.
+    Điểm ngoài thang MIN_RATE..MAX_RATE báo ValueError.
+    """
+    if not MIN_RATE <= rate <= MAX_RATE:
+        raise ValueError('rate must be between %d and %d' % (MIN_RATE, MAX_RATE))
+
+    ratings = Rating.objects.filter(food_id=food_id, user_id=user_id)
+    for _ in range(MAX_ATTEMPTS):
+        old = ratings.values_list('rate', flat=True).first()
+        if old is None:
+            try:
+                with transaction.atomic():
+                    Rating.objects.create(food_id=food_id, user_id=user_id, rate=rate)
+            except IntegrityError:
+                continue
+            popularity.record(food_id, ratings=1, rating_total=rate)
+            return
+        if old == rate:
+            return
+        if ratings.filter(rate=old).update(rate=rate, updated_date=timezone.now()):
+            popularity.record(food_id, rating_total=rate - old)
+            return
+
+    # tranh chấp liên tục: ghi đè, số liệu được đếm lại bằng lệnh rebuild_popularity
+    ratings.update(rate=rate, updated_date=timezone.now())
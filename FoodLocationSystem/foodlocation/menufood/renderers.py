@@ -0,0 +1,54 @@
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Cho ra đúng các byte như JSONRenderer (gọn, unicode, escape \\u2028/\\u2029) nhưng mã hoá bằng orjson.
+    Giá trị orjson không tự mã hoá (Decimal, datetime, Promise...) đi qua encoder của DRF.
+    Chỉ dùng cho các view không trả về số thực: orjson viết 1e-05 thành 0.00001.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact \
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # số nguyên quá 64 bit...
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    # client gửi Accept: application/msgpack
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder_class = JSONRenderer.encoder_class
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return msgpack.packb(data, default=self.encoder_class().default, use_bin_type=True)
+
+
+# renderer cho các viewset có danh sách đọc nhanh (menufood/values_serializers.py)
+FAST_RENDERER_CLASSES = [FastJSONRenderer, BrowsableAPIRenderer]
+if msgpack is not None:
+    FAST_RENDERER_CLASSES.append(MessagePackRenderer)
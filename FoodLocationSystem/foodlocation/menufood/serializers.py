@@ -1,26 +1,144 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files.uploadedfile import UploadedFile
 from rest_framework import serializers
-from . import cloud_path
-from .models import Food, User, MenuItem, Order, OrderDetail, Tag, PaymentMethod, Comment, Subcribes, Rating
+from rest_framework.permissions import SAFE_METHODS
+from .images import get_image_url, image_url_getter
+from .uploads import stage_upload
+from .models import (Food, User, MenuItem, Order, OrderDetail, Tag, PaymentMethod, Comment, Subcribes, Rating,
+                     ArchivedOrder)
+from .sharding import for_store
+from .values_serializers import ValuesSerializer
+
+
+def parse_field_paths(value):
+    # "id,menu_item.name" -> {'id': {}, 'menu_item': {'name': {}}}
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in filter(None, path.strip().split('.')):
+            node = node.setdefault(name, {})
+
+    return tree
+
+
+class DynamicFieldsMixin:
+    """
+    Request GET: ?fields=id,name,menu_item.name chỉ trả về các field được chọn (field lồng viết bằng dấu chấm),
+    ?expand=menu_item,menu_item.store chỉ trả về dạng object các field lồng được liệt kê, các field lồng khác
+    trả về id nên không cần JOIN/prefetch. Không có ?expand thì lồng toàn bộ như trước.
+    """
+    # (fields, expand) do serializer cha truyền xuống, None: không giới hạn
+    dynamic_fields = None
+
+    def get_dynamic_fields(self):
+        if self.dynamic_fields is not None:
+            return self.dynamic_fields
+
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        request = self.context.get('request')
+        if parent is not None or request is None or request.method not in SAFE_METHODS:
+            return None, None
+
+        fields, expand = request.GET.get('fields'), request.GET.get('expand')
+        return (parse_field_paths(fields) if fields is not None else None,
+                parse_field_paths(expand) if expand is not None else None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self.get_dynamic_fields()
+        for name, field in list(fields.items()):
+            if only is not None and name not in only:
+                del fields[name]
+                continue
+
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if not isinstance(nested, serializers.BaseSerializer):
+                continue
+            sub_fields = only.get(name) or None if only is not None else None
+            if expand is not None and name not in expand and sub_fields is None:
+                source = field.source if field.source != name else None
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, source=source,
+                                                                  many=nested is not field)
+            elif isinstance(nested, DynamicFieldsMixin):
+                nested.dynamic_fields = (sub_fields, expand.get(name, {}) if expand is not None else None)
+
+        return fields
+
+
+def optimize_queryset(queryset, serializer):
+    # select_related/prefetch_related đúng các object lồng mà serializer sẽ trả về
+    lookups = _related_lookups(queryset.model, serializer, '', False)
+    select = [path for path, many in lookups if not many]
+    prefetch = [path for path, many in lookups if many]
+    queryset = queryset.select_related(None).prefetch_related(None).prefetch_related(*prefetch)
+    # select_related() không tham số sẽ JOIN mọi khoá ngoại
+    return queryset.select_related(*select) if select else queryset
+
+
+def _related_lookups(model, serializer, prefix, many):
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    lookups = []
+    for field in serializer.fields.values():
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if not isinstance(nested, serializers.BaseSerializer) or field.source == '*':
+            continue
+        try:
+            relation = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        path = prefix + field.source
+        lookups.append((path, many or nested is not field))
+        lookups.extend(_related_lookups(relation.related_model, nested, path + '__', many or nested is not field))
+
+    return lookups
+
 
+# hàm tính SerializerMethodField từ một cột values() (menufood/values_serializers.py)
+def column_value(request):
+    return lambda value: value
 
-class TagSerializer(serializers.ModelSerializer):
+
+def rate_value(request):
+    return lambda rate: rate or 0
+
+
+# điểm trung bình trả về dạng chuỗi như giá tiền ("4.5"): FastJSONRenderer không dùng cho số thực
+RATING_AVG_FIELD = serializers.DecimalField(max_digits=2, decimal_places=1)
+
+
+def rating_avg(value):
+    return RATING_AVG_FIELD.to_representation(value) if value is not None else None
+
+
+def rating_avg_value(request):
+    return rating_avg
+
+
+class TagSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     image = serializers.SerializerMethodField(source='avatar')
+    values_methods = {'image': ('avatar', image_url_getter)}
 
     def get_image(self, user):
-        if user.avatar:
-            return '{cloud_path}{image_name}'.format(cloud_path=cloud_path, image_name=user.avatar)
+        return get_image_url(user.avatar, self.context.get('request'))
 
     def create(self, validated_data):
         data = validated_data.copy()
+        # file ảnh được upload nền, không chờ Cloudinary trong request
+        avatar = data.pop('avatar', None)
         user = User(**data)
         user.set_password(user.password)
+        if not isinstance(avatar, UploadedFile):
+            user.avatar = avatar
         user.save()
+        if isinstance(avatar, UploadedFile):
+            stage_upload(user, 'avatar', avatar)
 
         return user
 
@@ -34,7 +152,7 @@ class UserSerializer(serializers.ModelSerializer):
         }
 
 
-class MenuItemSerializer2(serializers.ModelSerializer):
+class MenuItemSerializer2(DynamicFieldsMixin, serializers.ModelSerializer):
     store = UserSerializer()
 
     class Meta:
@@ -42,14 +160,14 @@ class MenuItemSerializer2(serializers.ModelSerializer):
         fields = ['id', 'name', 'active', 'store']
 
 
-class FoodSerializer(serializers.ModelSerializer):
+class FoodSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     image = serializers.SerializerMethodField(source='image_food')
     tags = TagSerializer(many=True, read_only=True)
     menu_item = MenuItemSerializer2()
+    values_methods = {'image': ('image_food', image_url_getter)}
 
     def get_image(self, food):
-        if food.image_food:
-            return '{cloud_path}{image_name}'.format(cloud_path=cloud_path, image_name=food.image_food)
+        return get_image_url(food.image_food, self.context.get('request'))
 
     class Meta:
         model = Food
@@ -59,6 +177,16 @@ class FoodSerializer(serializers.ModelSerializer):
         }
 
 
+# món trong tài liệu menu của cửa hàng (menufood/store_menus.py), không lặp lại danh mục/cửa hàng
+class MenuFoodSerializer(FoodSerializer):
+    dynamic_fields = (parse_field_paths('id,name,price,active,start_time,end_time,description,image,tags'), None)
+
+
+# dòng phẳng cho API đồng bộ (menufood/sync.py): danh mục/tag trả về id, được đồng bộ trong danh sách riêng
+class SyncFoodSerializer(FoodSerializer):
+    dynamic_fields = (None, {})
+
+
 class FoodDetailsSerializer(FoodSerializer):
     tags = TagSerializer(many=True)
 
@@ -67,29 +195,60 @@ class FoodDetailsSerializer(FoodSerializer):
         fields = FoodSerializer.Meta.fields + ['content', 'tags']
 
 
-class AuthorizedFoodDetailsSerializer(FoodDetailsSerializer):
+# món của /foods/: kèm số lượt thích/đánh giá, các cột được annotate bằng popularity.annotate_counts
+class PopularFoodSerializer(FoodSerializer):
+    like_count = serializers.SerializerMethodField()
+    rating_count = serializers.SerializerMethodField()
+    rating_avg = serializers.SerializerMethodField()
+    values_methods = {**FoodSerializer.values_methods, 'like_count': ('like_count', column_value),
+                      'rating_count': ('rating_count', column_value), 'rating_avg': ('rating_avg', rating_avg_value)}
+
+    def get_like_count(self, food):
+        return food.like_count
+
+    def get_rating_count(self, food):
+        return food.rating_count
+
+    def get_rating_avg(self, food):
+        return rating_avg(food.rating_avg)
+
+    class Meta:
+        model = FoodSerializer.Meta.model
+        fields = FoodSerializer.Meta.fields + ['like_count', 'rating_count', 'rating_avg']
+        extra_kwargs = FoodSerializer.Meta.extra_kwargs
+
+
+class AuthorizedFoodDetailsSerializer(PopularFoodSerializer):
     liked = serializers.SerializerMethodField()
     rate = serializers.SerializerMethodField()
+    # cột user_liked/user_rate được annotate trong FoodViewSet.get_queryset
+    values_methods = {**PopularFoodSerializer.values_methods,
+                      'liked': ('user_liked', column_value), 'rate': ('user_rate', rate_value)}
 
     def get_liked(self, food):
         request = self.context.get('request')
         if request:
+            if hasattr(food, 'user_liked'):
+                return food.user_liked
             return food.like_set.filter(user=request.user, liked=True).exists()
 
     def get_rate(self, food):
         request = self.context.get('request')
         if request:
+            if hasattr(food, 'user_rate'):
+                return food.user_rate or 0
             r = food.rating_set.filter(user=request.user).first()
             return r.rate if r else 0
 
     class Meta:
         model = FoodSerializer.Meta.model
-        fields = FoodSerializer.Meta.fields + ['liked', 'rate']
+        fields = PopularFoodSerializer.Meta.fields + ['liked', 'rate']
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     food_count = serializers.SerializerMethodField()
     store = UserSerializer()
+    values_methods = {'food_count': ('food_count', column_value)}
 
     def get_food_count(self, menu):
         return menu.food_count
@@ -99,13 +258,16 @@ class MenuItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'active', 'store', 'food_count']
 
 
+class SyncMenuItemSerializer(MenuItemSerializer):
+    dynamic_fields = (parse_field_paths('id,name,active,store'), {})
+
+
 class StoreSerializer(serializers.ModelSerializer):
     menu_count = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField(source='avatar')
 
     def get_image(self, user):
-        if user.avatar:
-            return '{cloud_path}{image_name}'.format(cloud_path=cloud_path, image_name=user.avatar)
+        return get_image_url(user.avatar, self.context.get('request'))
 
     def get_menu_count(self, store):
         return store.menu_count
@@ -121,7 +283,7 @@ class PaymentMethodSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class OrderDetailSerializer(serializers.ModelSerializer):
+class OrderDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     food = FoodSerializer(many=False, read_only=True)
 
     class Meta:
@@ -129,7 +291,7 @@ class OrderDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'unit_price', 'quantity', 'food']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     order_details = OrderDetailSerializer(many=True, read_only=True)
 
     class Meta:
@@ -137,9 +299,39 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'created_date', 'amount', 'delivery_fee', 'order_status', 'receiver_name',
                   'receiver_phone', 'receiver_address', 'payment_date', 'payment_status',
                   'paymentmethod', 'user', 'store', 'order_details']
+        # tính từ giá món khi tạo đơn (menufood/pricing.py)
+        read_only_fields = ['amount', 'delivery_fee']
+
+    def create(self, validated_data):
+        # lưu đơn vào shard của cửa hàng
+        return for_store(Order, validated_data['store'].pk).create(**validated_data)
+
+
+# báo giá giỏ hàng (menufood/pricing.py), tiền trả về dạng chuỗi như các field giá khác
+class QuoteLineSerializer(serializers.Serializer):
+    food = serializers.IntegerField()
+    name = serializers.CharField()
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=0)
+    quantity = serializers.IntegerField()
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=0)
+
+
+class CartQuoteSerializer(serializers.Serializer):
+    store = serializers.IntegerField()
+    lines = QuoteLineSerializer(many=True)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=0)
+    # null khi chưa có địa chỉ giao hàng
+    delivery_fee = serializers.DecimalField(max_digits=6, decimal_places=0, allow_null=True)
+    total = serializers.DecimalField(max_digits=12, decimal_places=0, allow_null=True)
+
+
+# đơn trong bảng lưu trữ, trả về cùng định dạng với OrderSerializer
+class ArchivedOrderSerializer(OrderSerializer):
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer()
 
     class Meta:
@@ -147,9 +339,21 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'content', 'created_date', 'user']
 
 
-class SubcribeSerializer(serializers.ModelSerializer):
+class SubcribeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     follower = UserSerializer()
 
     class Meta:
         model = Subcribes
-        fields = ['id', 'follower', 'store', 'created_date']
\ No newline at end of file
+        fields = ['id', 'follower', 'store', 'created_date']
+
+# các danh sách đọc nhiều dựng thẳng từ values(), cùng định dạng với serializer tương ứng
+food_values = ValuesSerializer(FoodSerializer)
+popular_food_values = ValuesSerializer(PopularFoodSerializer)
+authorized_food_values = ValuesSerializer(AuthorizedFoodDetailsSerializer)
+menu_item_values = ValuesSerializer(MenuItemSerializer)
+order_values = ValuesSerializer(OrderSerializer)
+archived_order_values = ValuesSerializer(ArchivedOrderSerializer)
+menu_food_values = ValuesSerializer(MenuFoodSerializer)
+tag_values = ValuesSerializer(TagSerializer)
+sync_food_values = ValuesSerializer(SyncFoodSerializer)
+sync_menu_item_values = ValuesSerializer(SyncMenuItemSerializer)
@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from .models import (Order, OrderDetail, OrderEvent, ArchivedOrder, ArchivedOrderDetail, StoreShard,
+                     OrderSequence)
+
+# dữ liệu đơn hàng được chia theo cửa hàng, các bảng khác chỉ nằm trong 'default'
+SHARDED_MODELS = (Order, OrderDetail, OrderEvent, ArchivedOrder, ArchivedOrderDetail)
+STORE_SHARD_KEY = 'store-shard:%s'
+
+
+def get_shards():
+    return settings.ORDER_SHARDS
+
+
+def is_sharded(model):
+    return model in SHARDED_MODELS
+
+
+def shard_for_store(store_id):
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+
+    key = STORE_SHARD_KEY % store_id
+    shard = cache.get(key)
+    if shard is None:
+        # cửa hàng đã được chuyển shard (lệnh move_store_shard), nếu không thì chia theo store_id
+        shard = StoreShard.objects.using('default').filter(store_id=store_id).values_list('shard', flat=True).first() \
+            or shards[store_id % len(shards)]
+        cache.set(key, shard, settings.ORDER_SHARD_CACHE_TIMEOUT)
+
+    return shard
+
+
+def for_store(model, store_id):
+    # queryset của model trên shard chứa đơn của cửa hàng
+    if len(get_shards()) == 1:
+        return model.objects.all()
+
+    return model.objects.using(shard_for_store(store_id))
+
+
+def all_shards(model):
+    # một queryset cho mỗi shard, dùng cho truy vấn không theo cửa hàng (lịch sử đơn của khách hàng...)
+    if len(get_shards()) == 1:
+        return [model.objects.all()]
+
+    return [model.objects.using(shard) for shard in get_shards()]
+
+
+def find(model, **lookups):
+    for queryset in all_shards(model):
+        obj = queryset.filter(**lookups).first()
+        if obj is not None:
+            return obj
+
+    return None
+
+
+def write_db(queryset):
+    # alias để ghi cho queryset: shard đã chọn bằng using(), nếu không thì theo router
+    return queryset._db or router.db_for_write(queryset.model)
+
+
+def join_default(queryset, *lookups):
+    # bảng món ăn/user chỉ có ở 'default' (và replica): trên shard khác phải prefetch thay vì JOIN
+    if queryset.db in ('default', *settings.DATABASE_REPLICAS):
+        return queryset.select_related(*lookups)
+
+    return queryset.prefetch_related(*lookups)
+
+
+def move_store(store_id, target):
+    """
+    Chuyển toàn bộ đơn (kể cả đơn lưu trữ và log) của cửa hàng sang shard target.
+    Nên chạy khi cửa hàng tạm ngưng nhận đơn. Trả về số đơn đã chuyển.
+    """
+    source = shard_for_store(store_id)
+    if source == target:
+        return 0
+
+    copies = [
+        (Order, {'store_id': store_id}),
+        (OrderDetail, {'order__store_id': store_id}),
+        (OrderEvent, {'store_id': store_id}),
+        (ArchivedOrder, {'store_id': store_id}),
+        (ArchivedOrderDetail, {'order__store_id': store_id}),
+    ]
+    with transaction.atomic(using='default'), transaction.atomic(using=source), transaction.atomic(using=target):
+        moved = 0
+        for model, lookups in copies:
+            # id của log chỉ duy nhất trong từng shard, các bảng khác dùng id toàn cục
+            fields = [f for f in model._meta.concrete_fields if not (model is OrderEvent and f.primary_key)]
+            rows = [model(**{f.attname: getattr(o, f.attname) for f in fields})
+                    for o in model.objects.using(source).filter(**lookups).iterator()]
+            model.objects.using(target).bulk_create(rows, batch_size=1000)
+            if model is Order:
+                moved = len(rows)
+        # xoá bảng con trước
+        for model, lookups in reversed(copies):
+            model.objects.using(source).filter(**lookups).delete()
+
+        StoreShard.objects.using('default').update_or_create(store_id=store_id, defaults={'shard': target})
+
+    cache.delete(STORE_SHARD_KEY % store_id)
+    return moved
+
+
+class ShardRouter:
+    """
+    Đặt trước ReplicaRouter trong DATABASE_ROUTERS. Object đơn hàng được lưu vào shard
+    theo store_id, đọc theo shard của object; truy vấn queryset phải chọn shard bằng
+    for_store()/all_shards(), các model khác để router sau xử lý.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if len(get_shards()) > 1 and is_sharded(model) and instance is not None and is_sharded(type(instance)):
+            return instance._state.db
+
+        return None
+
+    def db_for_write(self, model, **hints):
+        if len(get_shards()) == 1 or not is_sharded(model):
+            return None
+
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if instance._state.db:
+            return instance._state.db
+        if getattr(instance, 'store_id', None):
+            return shard_for_store(instance.store_id)
+        # chi tiết đơn nằm cùng shard với đơn
+        order = instance._state.fields_cache.get('order')
+        if order is not None:
+            return order._state.db or shard_for_store(order.store_id)
+
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # khoá ngoại từ đơn hàng sang user/món ăn ở 'default' không có ràng buộc trong DB
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default' or db not in get_shards():
+            return None
+        # shard khác chỉ chứa bảng đơn hàng
+        return app_label == 'menufood' and model_name in {m._meta.model_name for m in SHARDED_MODELS}
+
+
+@receiver(pre_save, sender=Order)
+@receiver(pre_save, sender=OrderDetail)
+def assign_global_id(sender, instance, **kwargs):
+    # nhiều shard: id đơn/chi tiết đơn lấy từ bảng sequence chung để không trùng giữa các shard
+    if instance.pk is None and len(get_shards()) > 1:
+        instance.pk = OrderSequence.objects.using('default').create().pk
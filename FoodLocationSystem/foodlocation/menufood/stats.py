@@ -0,0 +1,107 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import User, Order, ArchivedOrder, StoreStats, StoreDailyStats
+from .sharding import all_shards
+
+STATS_VERSION_KEY = 'store-stats-version'
+
+
+def refresh_store_stats(days=None):
+    """
+    Tính lại bảng thống kê từ dữ liệu đơn hàng.
+    days: chỉ tính lại số đơn/doanh thu của N ngày gần nhất (None = toàn bộ).
+    """
+    # gồm cả đơn đã chuyển sang bảng lưu trữ (menufood/archive.py)
+    # và đơn trên mọi shard (menufood/sharding.py)
+    sources = [orders.filter(order_status=Order.SUCCESSED)
+               for model in (Order, ArchivedOrder) for orders in all_shards(model)]
+    daily = StoreDailyStats.objects.all()
+    if days is not None:
+        since = timezone.localdate() - timedelta(days=days)
+        sources = [orders.filter(created_date__date__gte=since) for orders in sources]
+        daily = daily.filter(date__gte=since)
+
+    rows = {}
+    for orders in sources:
+        for r in orders.annotate(date=TruncDate('created_date')).values('store_id', 'date') \
+                .annotate(total_orders=Count('id'), revenue=Sum('amount')).order_by().iterator():
+            row = rows.setdefault((r['store_id'], r['date']), {'total_orders': 0, 'revenue': 0})
+            row['total_orders'] += r['total_orders']
+            row['revenue'] += r['revenue'] or 0
+
+    stores = User.objects.filter(user_role=User.STORE) \
+        .annotate(total_products=Count('menuitem_store__menuitem_food__id')).values_list('id', 'total_products')
+
+    with transaction.atomic():
+        daily.delete()
+        StoreDailyStats.objects.bulk_create([
+            StoreDailyStats(store_id=store_id, date=date, total_orders=r['total_orders'], revenue=r['revenue'])
+            for (store_id, date), r in rows.items()
+        ], batch_size=1000)
+
+        StoreStats.objects.all().delete()
+        StoreStats.objects.bulk_create([
+            StoreStats(store_id=store_id, total_products=total_products)
+            for store_id, total_products in stores.iterator()
+        ], batch_size=1000)
+
+    # đổi version để bỏ toàn bộ cache cũ
+    cache.set(STATS_VERSION_KEY, time.time_ns(), None)
+
+
+def get_store_stats(date_from=None, date_to=None, page=1):
+    version = cache.get_or_set(STATS_VERSION_KEY, 0, None)
+    key = 'store-stats:%s:%s:%s:%s' % (version, date_from, date_to, page)
+    data = cache.get(key)
+    if data is None:
+        data = _build_store_stats(date_from, date_to, page)
+        cache.set(key, data, settings.STATS_CACHE_TIMEOUT)
+
+    return data
+
+
+def _build_store_stats(date_from, date_to, page):
+    daily = StoreDailyStats.objects.all()
+    if date_from:
+        daily = daily.filter(date__gte=date_from)
+    if date_to:
+        daily = daily.filter(date__lte=date_to)
+
+    # phân trang trên danh sách cửa hàng rồi mới cộng dồn cho các cửa hàng của trang đó
+    stores = StoreStats.objects.select_related('store').only('total_products', 'refreshed_date', 'store__name_store') \
+        .order_by('store__name_store', 'store_id')
+    paginator = Paginator(stores, settings.STATS_PAGE_SIZE)
+    page = paginator.get_page(page)
+
+    totals = {
+        r['store_id']: r for r in daily.filter(store_id__in=[s.store_id for s in page])
+        .values('store_id').annotate(total_orders=Sum('total_orders'), revenue=Sum('revenue')).order_by()
+    }
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'page': page.number,
+        'num_pages': paginator.num_pages,
+        'count': paginator.count,
+        'stores': [{
+            'store_id': s.store_id,
+            'name_store': s.store.name_store,
+            'total_products': s.total_products,
+            'total_orders': totals.get(s.store_id, {}).get('total_orders') or 0,
+            'revenue': totals.get(s.store_id, {}).get('revenue') or 0,
+            'refreshed_date': s.refreshed_date,
+        } for s in page],
+        # tổng theo ngày của tất cả cửa hàng (dùng để vẽ biểu đồ)
+        'daily': list(daily.values('date').annotate(total_orders=Sum('total_orders'),
+                                                     revenue=Sum('revenue')).order_by('date')),
+    }
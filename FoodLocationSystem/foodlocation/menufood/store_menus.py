@@ -0,0 +1,169 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.http import HttpRequest, QueryDict
+
+from .images import image_url_getter
+from .models import User, MenuItem, Food, Tag
+from .renderers import FastJSONRenderer
+from .serializers import menu_food_values
+
+STORE_VERSION_KEY = 'store-menu-version:%s'
+MENU_VERSION_KEY = 'store-menu-part-version:%s'
+DOCUMENT_KEY = 'store-menu:%s:%s:%s'  # cửa hàng, version, kích thước ảnh
+PART_KEY = 'store-menu-part:%s:%s:%s'  # danh mục, version, kích thước ảnh
+
+# luôn đọc từ primary: replica trễ sẽ làm dữ liệu cũ được cache với version mới
+DB = 'default'
+
+
+def _render(data):
+    return FastJSONRenderer().render(data)
+
+
+def _variant_request(variant):
+    # url ảnh theo kích thước đã chọn, không áp dụng ?fields=/?expand= của request gốc
+    request = HttpRequest()
+    request.GET = QueryDict(mutable=True)
+    request.GET['image_size'] = variant
+    return request
+
+
+def get_store_menu(store_id, variant):
+    """
+    Trả về (etag, nội dung JSON dạng bytes) menu của cửa hàng: thông tin cửa hàng -> danh mục -> món -> tag,
+    None nếu không có cửa hàng. Tài liệu ghép từ các phần đã render sẵn của từng danh mục,
+    khi món/danh mục thay đổi chỉ phần của danh mục đó phải dựng lại.
+    """
+    version = cache.get_or_set(STORE_VERSION_KEY % store_id, time.time_ns, None)
+    key = DOCUMENT_KEY % (store_id, version, variant)
+    document = cache.get(key)
+    if document is None:
+        document = _build_document(store_id, variant)
+        if document is not None:
+            cache.set(key, document, settings.STORE_MENU['TIMEOUT'])
+
+    return document
+
+
+def _build_document(store_id, variant):
+    store = User.objects.using(DB).filter(pk=store_id, user_role=User.STORE, is_active=True, is_verify=True) \
+        .values('id', 'name_store', 'avatar', 'address', 'phone', 'is_verify').first()
+    if store is None:
+        return None
+    store['image'] = image_url_getter(variant=variant)(store.pop('avatar'))
+
+    menus = dict(MenuItem.objects.using(DB).filter(store_id=store_id, active=True).order_by('id')
+                 .values_list('id', 'name'))
+    version_keys = [MENU_VERSION_KEY % m for m in menus]
+    versions = cache.get_many(version_keys)
+    missing = [k for k in version_keys if k not in versions]
+    if missing:
+        # add: không ghi đè version do invalidate_menus() vừa đặt
+        stamp = time.time_ns()
+        for k in missing:
+            cache.add(k, stamp, None)
+        versions.update(cache.get_many(missing))
+
+    part_keys = {m: PART_KEY % (m, versions.get(MENU_VERSION_KEY % m), variant) for m in menus}
+    parts = cache.get_many(part_keys.values())
+    missing = {m: name for m, name in menus.items() if part_keys[m] not in parts}
+    if missing:
+        parts.update(_build_parts(missing, part_keys, variant))
+
+    body = b''.join([b'{"store":', _render(store), b',"menu_items":[',
+                     b','.join(parts[part_keys[m]] for m in menus), b']}'])
+    return '"%s"' % hashlib.md5(body, usedforsecurity=False).hexdigest(), body
+
+
+def _build_parts(menus, part_keys, variant):
+    # một truy vấn món (và một truy vấn tag) cho mọi danh mục cần dựng lại
+    request = _variant_request(variant)
+    foods = Food.objects.using(DB).filter(menu_item__in=list(menus), active=True).order_by('id')
+    rows = list(menu_food_values.values(foods, request, extra=('menu_item_id',)))
+    grouped = {m: [] for m in menus}
+    for row, food in zip(rows, menu_food_values.represent(rows, request, DB)):
+        grouped[row['menu_item_id']].append(food)
+
+    parts = {part_keys[m]: _render({'id': m, 'name': name, 'foods': grouped[m]}) for m, name in menus.items()}
+    cache.set_many(parts, settings.STORE_MENU['TIMEOUT'])
+    return parts
+
+
+def _bump(keys):
+    # đổi version sau khi commit, request đọc chen giữa không cache lại dữ liệu chưa commit với version mới
+    transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, time.time_ns()), None), using=DB)
+
+
+def invalidate_store(store_id):
+    _bump([STORE_VERSION_KEY % store_id])
+
+
+def invalidate_menus(menu_ids):
+    menu_ids = [m for m in menu_ids if m is not None]
+    if menu_ids:
+        stores = MenuItem.objects.using(DB).filter(pk__in=menu_ids).values_list('store_id', flat=True).distinct()
+        _bump([MENU_VERSION_KEY % m for m in menu_ids] + [STORE_VERSION_KEY % s for s in stores])
+
+
+def invalidate_object(model, pk):
+    # cho các chỗ ghi bằng queryset.update() (không có signal)
+    if model is Food:
+        invalidate_menus(list(Food.objects.using(DB).filter(pk=pk).values_list('menu_item_id', flat=True)))
+    elif model is User:
+        invalidate_store(pk)
+
+
+def _tag_menu_ids(tag_id):
+    return Food.objects.using(DB).filter(tags=tag_id).values_list('menu_item_id', flat=True).distinct()
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def menu_item_changed(sender, instance, **kwargs):
+    invalidate_menus([instance.pk])
+    invalidate_store(instance.store_id)
+
+
+# món được chuyển sang danh mục khác thì phần của danh mục cũ cũng phải dựng lại
+@receiver(pre_save, sender=Food)
+def remember_food_menu(sender, instance, **kwargs):
+    if instance.pk:
+        instance._old_menu_item_id = Food.objects.using(DB).filter(pk=instance.pk) \
+            .values_list('menu_item_id', flat=True).first()
+
+
+@receiver(post_save, sender=Food)
+@receiver(post_delete, sender=Food)
+def food_changed(sender, instance, **kwargs):
+    invalidate_menus({instance.menu_item_id, getattr(instance, '_old_menu_item_id', None)})
+
+
+@receiver(m2m_changed, sender=Food.tags.through)
+def food_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_menus([instance.menu_item_id])
+    elif action == 'pre_clear':
+        invalidate_menus(list(_tag_menu_ids(instance.pk)))
+    else:
+        invalidate_menus(list(Food.objects.using(DB).filter(pk__in=pk_set)
+                              .values_list('menu_item_id', flat=True).distinct()))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    invalidate_menus(list(_tag_menu_ids(instance.pk)))
+
+
+@receiver(post_save, sender=User)
+def store_changed(sender, instance, **kwargs):
+    if instance.user_role == User.STORE:
+        invalidate_store(instance.pk)
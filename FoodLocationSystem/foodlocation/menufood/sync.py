@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import User, Food, MenuItem, Tag, Like, Rating, Subcribes, OrderEvent, Tombstone
+from .serializers import sync_food_values, sync_menu_item_values, tag_values
+from .sharding import all_shards, for_store
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class _ColumnValues:
+    # như ValuesSerializer, trả về nguyên các cột
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def values(self, queryset, request=None, extra=()):
+        return queryset.values(*self.fields, *extra)
+
+    def represent(self, rows, request=None, using=None):
+        return [{f: row[f] for f in self.fields} for row in rows]
+
+
+# dữ liệu chung: (tên danh sách, model, cách dựng dòng)
+CATALOG = [
+    ('foods', Food, sync_food_values),
+    ('menu_items', MenuItem, sync_menu_item_values),
+    ('tags', Tag, tag_values),
+]
+
+# dữ liệu riêng của user đăng nhập: (tên danh sách, model, field user, cách dựng dòng)
+OWN = [
+    ('likes', Like, 'user', _ColumnValues('id', 'food', 'liked')),
+    ('ratings', Rating, 'user', _ColumnValues('id', 'food', 'rate')),
+    ('subcribes', Subcribes, 'follower', _ColumnValues('id', 'store', 'created_date')),
+]
+
+TOMBSTONES = {model: (name, None) for name, model, _ in CATALOG}
+TOMBSTONES.update({model: (name, user_field) for name, model, user_field, _ in OWN})
+
+
+def make_token(value):
+    # số micro giây từ 1970, client gửi lại nguyên giá trị qua ?since=
+    return str((value - EPOCH) // timedelta(microseconds=1))
+
+
+def parse_token(token):
+    if not token.isdigit():
+        raise ValueError(token)
+
+    return EPOCH + timedelta(microseconds=int(token))
+
+
+def get_changes(user, token=None, request=None):
+    """
+    Thay đổi từ lần đồng bộ trước (token), mỗi danh sách gồm created/updated (dòng đầy đủ),
+    deactivated (id dòng active=False) và deleted (id dòng đã xoá, theo Tombstone).
+    Không có token hoặc token cũ hơn thời gian giữ Tombstone: trả về toàn bộ dữ liệu đang active, reset=True
+    để client xoá dữ liệu cũ. Trạng thái đơn hàng chỉ có khi đồng bộ tiếp, lúc reset client tải lại /orders/.
+    """
+    now = timezone.now()
+    since = parse_token(token) if token else None
+    reset = since is None or since < now - timedelta(days=settings.SYNC['TOMBSTONE_DAYS'])
+    data = {'token': make_token(now if reset else max(now, since)), 'reset': reset}
+    # lùi lại một khoảng: dòng ghi trong transaction chưa commit / replica chưa kịp nhận lúc lấy token trước
+    start = None if reset else since - timedelta(seconds=settings.SYNC['OVERLAP'])
+
+    deleted = {}
+    if start is not None:
+        tombstones = Tombstone.objects.filter(deleted_date__gte=start)
+        tombstones = tombstones.filter(Q(user=None) | Q(user=user)) if user.is_authenticated \
+            else tombstones.filter(user=None)
+        for model, object_id in tombstones.values_list('model', 'object_id'):
+            deleted.setdefault(model, []).append(object_id)
+
+    entities = [(name, model.objects.all(), values) for name, model, values in CATALOG]
+    if user.is_authenticated:
+        entities += [(name, model.objects.filter(**{field: user}), values) for name, model, field, values in OWN]
+    for name, queryset, values in entities:
+        data[name] = _changes(queryset, values, start, deleted.get(name, []), request)
+
+    if user.is_authenticated:
+        data['orders'] = _order_changes(user, start) if start is not None else []
+
+    return data
+
+
+def _changes(queryset, values, start, deleted, request):
+    if start is None:
+        queryset = queryset.filter(active=True)
+    else:
+        queryset = queryset.filter(updated_date__gte=start)
+    rows = list(values.values(queryset.order_by('id'), request, extra=('active', 'created_date')))
+
+    active = [row for row in rows if row['active']]
+    result = {'created': [], 'updated': [], 'deactivated': [row['id'] for row in rows if not row['active']],
+              'deleted': deleted}
+    for row, item in zip(active, values.represent(active, request, queryset.db)):
+        result['created' if start is None or row['created_date'] >= start else 'updated'].append(item)
+
+    return result
+
+
+def _order_changes(user, start):
+    # trạng thái mới nhất của các đơn thay đổi, theo log chuyển trạng thái
+    if user.user_role == User.STORE:
+        querysets = [for_store(OrderEvent, user.pk).filter(store=user)]
+    else:
+        querysets = [q.filter(user=user) for q in all_shards(OrderEvent)]
+
+    orders = {}
+    for queryset in querysets:
+        for order_id, order_status, date in queryset.filter(created_date__gte=start) \
+                .order_by('created_date', 'id').values_list('order_id', 'to_status', 'created_date'):
+            orders[order_id] = {'id': order_id, 'order_status': order_status, 'updated_date': date}
+
+    return list(orders.values())
+
+
+def record_tombstone(sender, instance, **kwargs):
+    name, user_field = TOMBSTONES[sender]
+    Tombstone.objects.create(model=name, object_id=instance.pk,
+                             user_id=getattr(instance, user_field + '_id') if user_field else None)
+
+
+for _model in TOMBSTONES:
+    post_delete.connect(record_tombstone, sender=_model)
+
+
+def touch_foods(queryset):
+    # update() không tự cập nhật auto_now
+    queryset.update(updated_date=timezone.now())
+
+
+# danh sách tag nằm trong dòng món ăn: đổi tag của món thì món được đồng bộ lại
+@receiver(m2m_changed, sender=Food.tags.through)
+def food_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear') or action != 'pre_clear' and not pk_set:
+        return
+    if not reverse:
+        touch_foods(Food.objects.filter(pk=instance.pk))
+    elif action == 'pre_clear':
+        touch_foods(Food.objects.filter(tags=instance.pk))
+    else:
+        touch_foods(Food.objects.filter(pk__in=pk_set))
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    touch_foods(Food.objects.filter(tags=instance.pk))
@@ -1,3 +1,1595 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+from unittest import mock, skipUnless
+from datetime import time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, router as db_router, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+from django.urls import reverse
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .models import (User, MenuItem, Food, Tag, PaymentMethod, Order, OrderDetail, Comment, Like, Rating, Subcribes,
+                     MediaUpload, PaymentAttempt, PaymentNotification, IdempotencyKey, OrderEvent,
+                     ArchivedOrder, ArchivedOrderDetail, StoreShard, Tombstone, DeliveryZone, GeocodedAddress,
+                     FoodPopularity)
+from .authentication import token_cache_key
+from .events import OrderEventStream, get_broker
+from .orders import transition, bulk_transition, changed_order_ids
+from .archive import archive_orders
+from .db_router import ReplicaRoutingMiddleware, PIN_COOKIE
+from .sharding import move_store, shard_for_store
+from .fake_gateway import FakeMomoGateway, make_ipn
+from .images import LocalImageStorage
+from .uploads import process_upload, stage_upload
+from .pricing import in_selling_window
+from . import popularity
+from .popularity import annotate_counts
+from .reactions import toggle_like, set_rating
+from .throttling import LocalBucketStore
+from .delivery import DeliveryError, LocalGeocoder, delivery_fee, distance_km
+from .stats import refresh_store_stats, get_store_stats
+from .urls import router
+from .renderers import FastJSONRenderer, msgpack
+from .serializers import (FoodSerializer, PopularFoodSerializer, AuthorizedFoodDetailsSerializer, MenuItemSerializer,
+                          OrderSerializer, MenuFoodSerializer, food_values, popular_food_values, authorized_food_values,
+                          menu_item_values, order_values)
+
+
+class QueryBudgetTests(TestCase):
+    # chạy mọi route GET của router với 2 kích thước dữ liệu:
+    # số truy vấn không được tăng theo số dòng và không vượt query_budget khai báo ở viewset
+    SMALL, LARGE = 2, 6
+
+    # object dùng cho các route detail, theo basename
+    DETAIL_LOOKUPS = {
+        'tag': 'tag',
+        'food': 'food',
+        'user': 'customer',
+        'store': 'store',
+        'menu-item': 'menu',
+        'order': 'order',
+        'order-details': 'order_detail',
+        'comment': 'comment',
+        'subcribe': 'store',
+        'food-store': 'food',
+        'food-list': 'store',
+    }
+
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111',
+                                                 user_role=User.USER)
+        self.payment_method = PaymentMethod.objects.create(name='Tiền mặt')
+        self.menu = MenuItem.objects.create(name='Menu', store=self.store)
+        self.tag = Tag.objects.create(name='tag')
+        self.food = self._create_food('food')
+        self.order = self._create_order(Order.PENDING)
+        self.order_detail = self.order.orderdetail_set.first()
+        self.comment = Comment.objects.create(content='ngon', food=self.food, user=self.customer)
+        Subcribes.objects.create(follower=self.customer, store=self.store)
+
+        self.counter = 0
+        cache.clear()
+
+    def _create_food(self, name):
+        food = Food.objects.create(name=name, price=10000, description='', menu_item=self.menu,
+                                   start_time=time(7), end_time=time(21))
+        food.tags.add(self.tag)
+        return food
+
+    def _create_order(self, order_status):
+        order = Order.objects.create(amount=10000, delivery_fee=0, order_status=order_status,
+                                     receiver_name='A', receiver_phone='0911111111', receiver_address='HCM',
+                                     paymentmethod=self.payment_method, user=self.customer, store=self.store)
+        OrderDetail.objects.create(order=order, food=self.food, unit_price=10000, quantity=1)
+        return order
+
+    # thêm n dòng cho mỗi tập dữ liệu mà các endpoint trả về
+    def _grow(self, n):
+        for _ in range(n):
+            self.counter += 1
+            i = self.counter
+            tag = Tag.objects.create(name='tag-%d' % i)
+            menu = MenuItem.objects.create(name='Menu %d' % i, store=self.store)
+            food = Food.objects.create(name='food %d' % i, price=10000, description='', menu_item=menu)
+            food.tags.add(tag, self.tag)
+            self.food.tags.add(tag)
+            Like.objects.create(food=food, user=self.customer)
+            Rating.objects.create(food=food, user=self.customer, rate=5)
+            for order_status in (Order.PENDING, Order.ACCEPTED):
+                self._create_order(order_status)
+            follower = User.objects.create_user(username='follower-%d' % i, password='123',
+                                                phone='08%08d' % i)
+            Subcribes.objects.create(follower=follower, store=self.store)
+            Comment.objects.create(content='ngon %d' % i, food=self.food, user=follower)
+            PaymentMethod.objects.create(name='method %d' % i)
+
+    def _get_routes(self):
+        for prefix, viewset, basename in router.registry:
+            for route in router.get_routes(viewset):
+                action = router.get_method_map(viewset, route.mapping).get('get')
+                if not action:
+                    continue
+                kwargs = {}
+                if route.detail:
+                    lookup = getattr(viewset, 'lookup_url_kwarg', None) or getattr(viewset, 'lookup_field', 'pk')
+                    kwargs[lookup] = getattr(self, self.DETAIL_LOOKUPS[basename]).pk
+                yield viewset, action, reverse(route.name.format(basename=basename), kwargs=kwargs)
+
+    def _clients(self):
+        yield 'anonymous', APIClient()
+        for user in (self.customer, self.store):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            yield user.username, client
+
+    def _count_queries(self):
+        counts = {}
+        params = {'food_id': self.food.pk}
+        for viewset, action, url in self._get_routes():
+            for role, client in self._clients():
+                with CaptureQueriesContext(connection) as ctx:
+                    response = client.get(url, params)
+                    # file xuất được đọc từ DB khi stream nội dung
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 500, '%s (%s)' % (url, role))
+                counts[(viewset, action, url, role)] = len(ctx.captured_queries)
+        return counts
+
+    def test_query_budget(self):
+        # cache bị invalidate sau commit như khi chạy thật
+        with self.captureOnCommitCallbacks(execute=True):
+            self._grow(self.SMALL)
+        small = self._count_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._grow(self.LARGE - self.SMALL)
+        large = self._count_queries()
+
+        for (viewset, action, url, role), count in large.items():
+            with self.subTest(url=url, role=role):
+                budget = getattr(viewset, 'query_budget', {}).get(action)
+                self.assertIsNotNone(budget, '%s.query_budget thiếu action "%s"' % (viewset.__name__, action))
+                self.assertEqual(small[(viewset, action, url, role)], count,
+                                 'Số truy vấn tăng theo số dòng dữ liệu (N+1)')
+                self.assertLessEqual(count, budget, 'Vượt query_budget của %s.%s' % (viewset.__name__, action))
+
+
+class StoreStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        menu = MenuItem.objects.create(name='Menu', store=self.store)
+        Food.objects.create(name='food', price=10000, description='', menu_item=menu)
+        payment_method = PaymentMethod.objects.create(name='Tiền mặt')
+        for order_status in (Order.SUCCESSED, Order.SUCCESSED, Order.PENDING):
+            Order.objects.create(amount=10000, delivery_fee=0, order_status=order_status,
+                                 receiver_name='A', receiver_phone='0911111111', receiver_address='HCM',
+                                 paymentmethod=payment_method, user=customer, store=self.store)
+
+    def test_refresh_and_filter(self):
+        self.assertEqual(get_store_stats()['stores'], [])
+
+        refresh_store_stats()
+        stats = get_store_stats()
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['stores'][0]['total_orders'], 2)
+        self.assertEqual(stats['stores'][0]['revenue'], 20000)
+        self.assertEqual(stats['stores'][0]['total_products'], 1)
+
+        tomorrow = self.store.date_joined.date() + timedelta(days=1)
+        self.assertEqual(get_store_stats(date_from=tomorrow)['stores'][0]['total_orders'], 0)
+
+    def test_json_view(self):
+        refresh_store_stats()
+        admin = User.objects.create_superuser(username='admin', password='123', phone='0922222222')
+        self.client.force_login(admin)
+
+        self.assertContains(self.client.get('/admin/stats/'), 'Store')
+        data = self.client.get('/admin/stats/json/').json()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_store_stats()['count'], data['count'])
+        self.assertEqual(data['stores'][0]['name_store'], 'Store')
+        self.assertEqual(data['daily'][0]['total_orders'], 2)
+
+
+class AdminChangelistTests(TestCase):
+    URLS = ['/admin/menufood/food/', '/admin/menufood/menuitem/', '/admin/menufood/subcribes/']
+
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.menu = MenuItem.objects.create(name='Menu', store=self.store)
+        admin = User.objects.create_superuser(username='admin', password='123', phone='0922222222')
+        self.client.force_login(admin)
+        self.counter = 0
+
+    def _grow(self, n):
+        for _ in range(n):
+            self.counter += 1
+            i = self.counter
+            menu = MenuItem.objects.create(name='Menu %d' % i, store=self.store)
+            Food.objects.create(name='food %d' % i, price=10000, description='<p>%s</p>' % ('ngon ' * 100),
+                                menu_item=menu)
+            follower = User.objects.create_user(username='follower-%d' % i, password='123', phone='08%08d' % i)
+            Subcribes.objects.create(follower=follower, store=self.store)
+
+    def _count_queries(self):
+        counts = {}
+        for url in self.URLS:
+            for params in ({}, {'store': self.store.pk}):
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                counts[(url, str(params))] = len(ctx.captured_queries)
+        return counts
+
+    def test_changelist_queries_constant(self):
+        self._grow(2)
+        small = self._count_queries()
+        self._grow(5)
+        self.assertEqual(small, self._count_queries())
+
+    def test_food_changelist(self):
+        self._grow(1)
+        response = self.client.get('/admin/menufood/food/', {'store': self.store.pk})
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertContains(response, 'ngon ngon')
+        self.assertNotContains(response, '<p>ngon')
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'foods'))
+        Image.new('RGB', (800, 600), 'red').save(os.path.join(self.root, 'foods', 'pho.jpg'))
+        store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                         name_store='Store', user_role=User.STORE, is_verify=True)
+        menu = MenuItem.objects.create(name='Menu', store=store)
+        self.food = Food.objects.create(name='pho', price=10000, description='', menu_item=menu,
+                                        image_food='image/upload/foods/pho')
+
+    def test_cloudinary_urls(self):
+        self.assertEqual(self.client.get('/foods/%d/' % self.food.pk).json()['image'],
+                         'https://res.cloudinary.com/tr-ng-h-m-tp-hcm/foods/pho')
+        self.assertEqual(self.client.get('/foods/%d/' % self.food.pk, {'image_size': 'thumbnail'}).json()['image'],
+                         'https://res.cloudinary.com/tr-ng-h-m-tp-hcm/image/upload/'
+                         'c_fill,w_100,h_100,f_webp,q_auto/foods/pho')
+
+    def test_local_variant_cached_on_disk(self):
+        with override_settings(IMAGE_STORAGE='menufood.images.LocalImageStorage', IMAGE_LOCAL_ROOT=self.root):
+            url = self.client.get('/foods/', {'image_size': 'card'}).json()['results'][0]['image']
+            self.assertEqual(url, '/images/card/foods/pho')
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+            path = LocalImageStorage(self.root).variant_path('foods/pho', 'card')
+            with Image.open(path) as img:
+                self.assertEqual((img.size, img.format), ((480, 360), 'WEBP'))
+            mtime = os.path.getmtime(path)
+            self.client.get(url)
+            self.assertEqual(os.path.getmtime(path), mtime)
+            self.assertEqual(self.client.get('/images/card/foods/missing').status_code, 404)
+
+
+class FailingStorage:
+    calls = 0
+
+    def upload(self, path):
+        FailingStorage.calls += 1
+        raise ConnectionError('timeout')
+
+
+class UploadPipelineTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(IMAGE_STORAGE='menufood.images.LocalImageStorage',
+                                                   IMAGE_LOCAL_ROOT=self.root, UPLOAD_STAGING_ROOT=tempfile.mkdtemp(),
+                                                   UPLOAD_RETRY_DELAY=0)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.menu = MenuItem.objects.create(name='Menu', store=self.store)
+
+    def _image(self):
+        f = tempfile.SpooledTemporaryFile()
+        Image.new('RGB', (10, 10)).save(f, 'JPEG')
+        f.seek(0)
+        return SimpleUploadedFile('pho.jpg', f.read(), content_type='image/jpeg')
+
+    def test_create_food_returns_pending_image(self):
+        client = APIClient()
+        client.force_authenticate(user=self.store)
+        with mock.patch('menufood.uploads.get_executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/food-store/', {'name': 'pho', 'price': 10000, 'menu_item': self.menu.pk,
+                                                    'tags': '[]', 'image_food': self._image()})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['image_status'], 'PENDING')
+        self.assertIsNone(response.data['data']['image'])
+        self.assertEqual(executor.return_value.submit.call_count, 1)
+
+        upload = MediaUpload.objects.get()
+        self.assertTrue(process_upload(upload.pk))
+        self.assertFalse(process_upload(upload.pk))
+        food = Food.objects.get()
+        self.assertTrue(str(food.image_food).startswith('uploads/'))
+        self.assertIsNotNone(LocalImageStorage(self.root).original_path(str(food.image_food)))
+        self.assertFalse(os.path.exists(upload.staged_path))
+
+    def test_register_user_with_avatar(self):
+        with self.captureOnCommitCallbacks():
+            response = self.client.post('/users/', {'username': 'u', 'password': '123', 'phone': '0911111111',
+                                                    'avatar': self._image()})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['image_status'], 'PENDING')
+        self.assertEqual(MediaUpload.objects.get().model, 'menufood.User')
+
+    def test_stale_check_does_not_steal_claimed_upload(self):
+        # ảnh được stage từ lâu (vd: server khởi động lại) rồi mới được worker nhận
+        upload = MediaUpload.objects.create(model='menufood.Food', object_id=1, field_name='image_food',
+                                            staged_path=os.path.join(settings.UPLOAD_STAGING_ROOT, 'pho.jpg'))
+        MediaUpload.objects.filter(pk=upload.pk).update(updated_date=timezone.now() - timedelta(hours=1))
+        open(upload.staged_path, 'wb').close()
+
+        def upload_while_checking(path):
+            # process_uploads chạy trong lúc worker đang đẩy ảnh
+            if storage_upload.call_count == 1:
+                call_command('process_uploads', stdout=io.StringIO())
+            return 'uploads/pho.jpg'
+
+        with mock.patch.object(LocalImageStorage, 'upload', side_effect=upload_while_checking) as storage_upload:
+            self.assertTrue(process_upload(upload.pk))
+        self.assertEqual(storage_upload.call_count, 1)
+        self.assertEqual(MediaUpload.objects.get().status, MediaUpload.DONE)
+
+    def test_upload_retries_then_fails(self):
+        upload = MediaUpload.objects.create(model='menufood.Food', object_id=1, field_name='image_food',
+                                            staged_path='/tmp/missing.jpg')
+        with override_settings(IMAGE_STORAGE='menufood.tests.FailingStorage'):
+            self.assertFalse(process_upload(upload.pk))
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.attempts, FailingStorage.calls), (MediaUpload.FAILED, 3, 3))
+        self.assertEqual(upload.last_error, 'timeout')
+
+
+class PaymentGatewayTests(TestCase):
+    PAYLOAD = {'orderInfo': 'pay with MoMo', 'redirectUrl': 'http://app/return', 'ipnUrl': 'http://app/ipn',
+               'amount': '1', 'extraData': ''}
+
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        self.order = Order.objects.create(amount=45000, delivery_fee=5000, receiver_name='A',
+                                          receiver_phone='0911111111', receiver_address='HCM', user=customer,
+                                          store=self.store, paymentmethod=PaymentMethod.objects.create(name='MoMo'))
+        self.client = APIClient()
+        self.client.force_authenticate(user=customer)
+
+    def _momo(self, gateway, **config):
+        return override_settings(MOMO={**settings.MOMO, 'ENDPOINT': gateway.url, **config})
+
+    def _create_payment(self, order=None):
+        order = self.order.pk if order is None else order
+        return self.client.post('/create_payment/', json.dumps({**self.PAYLOAD, 'order': order}),
+                                content_type='application/json')
+
+    def test_create_payment_reuses_connection(self):
+        with FakeMomoGateway(settings.MOMO['SECRET_KEY']) as gateway, self._momo(gateway):
+            for _ in range(3):
+                response = self._create_payment()
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual((gateway.requests, gateway.connections), (3, 1))
+
+        attempt = self.order.payment_attempts.last()
+        self.assertEqual(response.json()['data']['payURL'], attempt.pay_url)
+        self.assertEqual((attempt.status, attempt.result_code), (PaymentAttempt.PENDING, 0))
+        # số tiền theo đơn hàng (tiền món + phí giao hàng), bỏ qua amount client gửi
+        self.assertEqual(attempt.amount, 50000)
+
+    def test_order_required_and_owned(self):
+        other = Order.objects.create(amount=50000, delivery_fee=0, receiver_name='B', receiver_phone='0922222222',
+                                     receiver_address='HCM', user=self.store, store=self.store,
+                                     paymentmethod=self.order.paymentmethod)
+        self.assertEqual(self._create_payment('abc').status_code, 400)
+        self.assertEqual(self.client.post('/create_payment/', json.dumps(self.PAYLOAD),
+                                          content_type='application/json').status_code, 400)
+        self.assertEqual(self._create_payment(other.pk).status_code, 404)
+        self.assertEqual(self._create_payment(999).status_code, 404)
+        Order.objects.filter(pk=self.order.pk).update(payment_status=True)
+        self.assertEqual(self._create_payment().status_code, 400)
+
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self._create_payment().status_code, 401)
+        self.assertFalse(PaymentAttempt.objects.exists())
+
+    def test_retry_on_unavailable(self):
+        with FakeMomoGateway(settings.MOMO['SECRET_KEY'], fail_times=2) as gateway, self._momo(gateway):
+            self.assertEqual(self._create_payment().status_code, 200)
+            self.assertEqual(gateway.requests, 3)
+
+    def test_read_timeout(self):
+        with FakeMomoGateway(settings.MOMO['SECRET_KEY'], delay=0.5) as gateway, \
+                self._momo(gateway, READ_TIMEOUT=0.1, MAX_RETRIES=0):
+            response = self._create_payment()
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.order.payment_attempts.get().status, PaymentAttempt.FAILED)
+
+    def test_invalid_signature(self):
+        with FakeMomoGateway('wrong-secret') as gateway, self._momo(gateway):
+            self.assertEqual(self._create_payment().status_code, 502)
+        self.assertEqual(self.order.payment_attempts.get().result_code, 11)
+
+
+class PaymentIpnTests(TestCase):
+    def setUp(self):
+        store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                         name_store='Store', user_role=User.STORE, is_verify=True)
+        customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        self.order = Order.objects.create(amount=45000, delivery_fee=5000, receiver_name='A', receiver_phone='0911111111',
+                                          receiver_address='HCM', user=customer, store=store,
+                                          paymentmethod=PaymentMethod.objects.create(name='MoMo'))
+        self.attempt = PaymentAttempt.objects.create(order=self.order, request_id='MOMO1', amount=50000,
+                                                     status=PaymentAttempt.PENDING)
+
+    def _post(self, data):
+        return self.client.post('/momo_ipn/', json.dumps(data), content_type='application/json')
+
+    def test_success_processed_once(self):
+        ipn = make_ipn(settings.MOMO, 'MOMO1', 50000, trans_id=123)
+        self.assertEqual(self._post(ipn).status_code, 204)
+        self.order.refresh_from_db()
+        self.attempt.refresh_from_db()
+        self.assertTrue(self.order.payment_status)
+        self.assertEqual(self.attempt.status, PaymentAttempt.SUCCESS)
+
+        # IPN gửi lại: chỉ một lần INSERT bị từ chối, không cập nhật gì thêm
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._post(ipn).status_code, 204)
+        self.assertEqual([q['sql'].split()[0] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']],
+                         ['INSERT'])
+        self.assertEqual(PaymentNotification.objects.count(), 1)
+
+    def test_amount_below_order_total(self):
+        # attempt tạo với số tiền thấp hơn tổng tiền đơn hàng (client cũ tự gửi amount)
+        PaymentAttempt.objects.create(order=self.order, request_id='MOMO2', amount=1, status=PaymentAttempt.PENDING)
+        self.assertEqual(self._post(make_ipn(settings.MOMO, 'MOMO2', 1)).status_code, 204)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.payment_status)
+
+    def test_failed_payment(self):
+        self.assertEqual(self._post(make_ipn(settings.MOMO, 'MOMO1', 50000, result_code=1006)).status_code, 204)
+        self.order.refresh_from_db()
+        self.attempt.refresh_from_db()
+        self.assertFalse(self.order.payment_status)
+        self.assertEqual((self.attempt.status, self.attempt.result_code), (PaymentAttempt.FAILED, 1006))
+
+    def test_invalid_signature(self):
+        ipn = make_ipn(settings.MOMO, 'MOMO1', 50000)
+        ipn['amount'] = 1
+        self.assertEqual(self._post(ipn).status_code, 400)
+        self.assertEqual(self._post({}).status_code, 400)
+        self.assertFalse(PaymentNotification.objects.exists())
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        menu = MenuItem.objects.create(name='Menu', store=self.store)
+        self.food = Food.objects.create(name='pho', price=10000, description='', menu_item=menu)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.customer)
+        self.order = {'amount': 20000, 'delivery_fee': 0, 'receiver_name': 'A', 'receiver_phone': '0911111111',
+                      'receiver_address': 'HCM', 'paymentmethod': PaymentMethod.objects.create(name='Tiền mặt').pk,
+                      'user': self.customer.pk, 'store': self.store.pk,
+                      'order_details': [{'food': self.food.pk, 'unit_price': 10000, 'quantity': 2}]}
+
+    def _post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_order_is_created_once(self):
+        first = self._post('/orders/', self.order, 'k1')
+        second = self._post('/orders/', self.order, 'k1')
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual((Order.objects.count(), OrderDetail.objects.count()), (1, 1))
+
+        self.assertEqual(self._post('/orders/', {**self.order, 'amount': 1}, 'k1').status_code, 422)
+        self.assertEqual(self._post('/orders/', self.order, 'k2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_in_progress_duplicate(self):
+        IdempotencyKey.objects.create(key='%d:k1' % self.customer.pk, request_hash='')
+        self.assertEqual(self._post('/foods/%d/comments/' % self.food.pk, {'content': 'ngon'}, 'k1').status_code, 409)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_abandoned_request_taken_over(self):
+        url = '/foods/%d/comments/' % self.food.pk
+        self.assertEqual(self._post(url, {'content': 'ngon'}, 'k1').status_code, 201)
+        # worker bị kill sau khi chèn key, trước khi ghi bình luận và response:
+        # giữ key quá IDEMPOTENCY_LOCK_TIMEOUT thì request gửi lại được chạy
+        Comment.objects.all().delete()
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            key='%d:k2' % self.customer.pk, response_status=None, response_body=None,
+            created_date=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT + 1))
+        self.assertEqual(self._post(url, {'content': 'khác'}, 'k2').status_code, 409)
+        self.assertEqual(self._post(url, {'content': 'ngon'}, 'k2').status_code, 201)
+        self.assertEqual(self._post(url, {'content': 'ngon'}, 'k2')['Idempotent-Replayed'], 'true')
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_client_errors_not_stored(self):
+        # response 400 trả về (giỏ hàng sai) và lỗi raise (ValidationError của serializer) đều trả lại key
+        cart = [{'food': 999, 'unit_price': 10000, 'quantity': 1}]
+        for _ in range(2):
+            self.assertEqual(self._post('/orders/', {**self.order, 'order_details': cart}, 'k1').status_code, 400)
+            response = self._post('/orders/', {**self.order, 'receiver_phone': ''}, 'k2')
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('Idempotent-Replayed', response)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self._post('/orders/', self.order, 'k2').status_code, 201)
+
+    def test_like_and_subscribe_retry(self):
+        for _ in range(2):
+            self._post('/foods/%d/like/' % self.food.pk, {}, 'like-1')
+            response = self._post('/subcribes/', {'store_id': self.store.pk}, 'sub-1')
+        self.assertTrue(Like.objects.get().liked)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.post('/subcribes/', {'store_id': self.store.pk}).status_code, 200)
+        self.assertEqual(Subcribes.objects.count(), 1)
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        app = Application.objects.create(name='app', client_type=Application.CLIENT_CONFIDENTIAL,
+                                         authorization_grant_type=Application.GRANT_PASSWORD)
+        self.token = AccessToken.objects.create(user=self.user, application=app, token='abc',
+                                                expires=timezone.now() + timedelta(hours=1), scope='read write')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer abc')
+
+    def test_cached_token_skips_database(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get('/users/current-user/').json()['username'], 'customer')
+        self.assertGreater(len(first), 0)
+        with self.assertNumQueries(0):
+            response = self.client.get('/users/current-user/')
+        self.assertEqual(response.json()['username'], 'customer')
+
+    def test_password_not_cached(self):
+        self.client.get('/users/current-user/')
+        cached = cache.get(token_cache_key('abc'))
+        self.assertNotIn('password', cached['user'])
+        self.assertNotIn('token', cached['token'])
+        self.assertNotIn('abc', str(cached))
+
+        # user dựng từ cache vẫn cập nhật được mà không mất mật khẩu
+        response = self.client.put('/users/current-user/', {'first_name': 'An'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'An')
+        self.assertTrue(self.user.check_password('123'))
+
+    def test_revoked_token_is_rejected(self):
+        self.client.get('/users/current-user/')
+        self.token.revoke()
+        self.assertEqual(self.client.get('/users/current-user/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/users/current-user/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/users/current-user/').status_code, 401)
+
+    def test_expired_token_is_not_served_from_cache(self):
+        self.client.get('/users/current-user/')
+        AccessToken.objects.filter(pk=self.token.pk).update(expires=timezone.now() - timedelta(seconds=1))
+        key = token_cache_key('abc')
+        cache.set(key, {**cache.get(key), 'expires': timezone.now() - timedelta(seconds=1)})
+        self.assertEqual(self.client.get('/users/current-user/').status_code, 401)
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, channel, message):
+        self.messages.append((channel, message['event'], message['order_status']))
+
+
+class OrderEventTests(TestCase):
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        app = Application.objects.create(name='app', client_type=Application.CLIENT_CONFIDENTIAL,
+                                         authorization_grant_type=Application.GRANT_PASSWORD)
+        AccessToken.objects.create(user=self.customer, application=app, token='customer-token',
+                                   expires=timezone.now() + timedelta(hours=1))
+        menu = MenuItem.objects.create(name='Menu', store=self.store)
+        self.food = Food.objects.create(name='pho', price=10000, description='', menu_item=menu)
+        self.method = PaymentMethod.objects.create(name='Tiền mặt')
+
+    @override_settings(ORDER_EVENTS={**settings.ORDER_EVENTS, 'BROKER': 'menufood.tests.RecordingBroker'})
+    def test_order_views_publish_events(self):
+        client = APIClient()
+        client.force_authenticate(user=self.customer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/orders/', {
+                'amount': 10000, 'delivery_fee': 0, 'receiver_name': 'A', 'receiver_phone': '0911111111',
+                'receiver_address': 'HCM', 'paymentmethod': self.method.pk, 'user': self.customer.pk,
+                'store': self.store.pk, 'order_details': [{'food': self.food.pk, 'unit_price': 10000, 'quantity': 1}],
+            }, format='json')
+        order_id = response.json()['data']['id']
+
+        client.force_authenticate(user=self.store)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/orders/%d/confirm-order/' % order_id)
+
+        self.assertEqual(get_broker().messages, [
+            ('store:%d' % self.store.pk, 'order.created', Order.PENDING),
+            ('user:%d' % self.customer.pk, 'order.created', Order.PENDING),
+            ('store:%d' % self.store.pk, 'order.status_changed', Order.ACCEPTED),
+            ('user:%d' % self.customer.pk, 'order.status_changed', Order.ACCEPTED),
+        ])
+
+    def _stream(self, query_string, publish=None):
+        scope = {'type': 'http', 'path': settings.ORDER_EVENTS['PATH'], 'query_string': query_string, 'headers': []}
+
+        async def run():
+            sent = []
+            closed = asyncio.Event()
+
+            async def receive():
+                await closed.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message.get('body', b'').startswith(b'event:'):
+                    closed.set()
+
+            task = asyncio.ensure_future(OrderEventStream(None)(scope, receive, send))
+            while len(sent) < 2 and not task.done():
+                await asyncio.sleep(0.01)
+            if publish:
+                # publish từ thread khác như view đồng bộ
+                await sync_to_async(publish, thread_sensitive=False)()
+            await asyncio.wait_for(task, 5)
+            return sent
+
+        return async_to_sync(run)()
+
+    def test_stream_pushes_events_to_subscriber(self):
+        message = {'event': 'order.status_changed', 'order': 1, 'order_status': Order.ACCEPTED}
+        sent = self._stream(b'access_token=customer-token', lambda: (
+            get_broker().publish('user:%d' % self.store.pk, {**message, 'order': 2}),
+            get_broker().publish('user:%d' % self.customer.pk, message)))
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(sent[-1]['body'].decode(), 'event: order.status_changed\ndata: %s\n\n' % json.dumps(message))
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(get_broker().subscriptions, {})
+
+    def test_stream_requires_token(self):
+        self.assertEqual(self._stream(b'access_token=wrong')[0]['status'], 401)
+
+
+class OrderLifecycleTests(TestCase):
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111',
+                                                 email='customer@example.com')
+        method = PaymentMethod.objects.create(name='Tiền mặt')
+        self.orders = [Order.objects.create(amount=10000, delivery_fee=0, receiver_name='A', receiver_phone='0911111111',
+                                            receiver_address='HCM', paymentmethod=method, user=self.customer,
+                                            store=self.store) for _ in range(3)]
+
+    def test_stale_transition_is_rejected(self):
+        order = self.orders[0]
+        stale = Order.objects.get(pk=order.pk)
+        self.assertTrue(transition(order, Order.ACCEPTED, actor=self.store))
+        self.assertFalse(transition(stale, Order.ACCEPTED, actor=self.store))
+        self.assertFalse(transition(order, Order.PENDING))
+        self.assertEqual(list(OrderEvent.objects.values_list('order_id', 'from_status', 'to_status')),
+                         [(order.pk, Order.PENDING, Order.ACCEPTED)])
+
+    def test_confirm_order_sends_one_email(self):
+        client = APIClient()
+        client.force_authenticate(user=self.store)
+        url = '/orders/%d/confirm-order/' % self.orders[0].pk
+        self.assertEqual(client.post(url).status_code, 200)
+        self.assertEqual(client.post(url).status_code, 200)
+        self.assertEqual(client.post(url).status_code, 400)
+        order = Order.objects.get(pk=self.orders[0].pk)
+        self.assertEqual((order.order_status, order.payment_status), (Order.SUCCESSED, True))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OrderEvent.objects.filter(order=order).count(), 2)
+
+    def test_bulk_transition(self):
+        since = timezone.now() - timedelta(seconds=1)
+        transition(self.orders[0], Order.ACCEPTED)
+        with CaptureQueriesContext(connection) as queries:
+            changed = bulk_transition(Order.objects.filter(store=self.store), Order.ACCEPTED, actor=self.store)
+        self.assertEqual([q['sql'].split()[0] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']],
+                         ['SELECT', 'UPDATE', 'INSERT'])
+        self.assertEqual(sorted(o.pk for o in changed), [o.pk for o in self.orders[1:]])
+        self.assertEqual(Order.objects.filter(order_status=Order.ACCEPTED).count(), 3)
+        self.assertEqual(sorted(changed_order_ids(since, store=self.store)), [o.pk for o in self.orders])
+        self.assertEqual(list(changed_order_ids(timezone.now(), user=self.customer)), [])
+
+    def test_confirm_orders_in_batch(self):
+        other_store = User.objects.create_user(username='store2', password='123', phone='0922222222',
+                                               user_role=User.STORE, is_verify=True)
+        other = Order.objects.create(amount=10000, delivery_fee=0, receiver_name='B', receiver_phone='0911111111',
+                                     receiver_address='HCM', paymentmethod=self.orders[0].paymentmethod,
+                                     user=self.customer, store=other_store)
+        transition(self.orders[0], Order.ACCEPTED)
+        client = APIClient()
+        client.force_authenticate(user=self.store)
+        ids = [o.pk for o in self.orders] + [other.pk]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/orders/confirm-orders/', {'ids': ids, 'order_status': Order.ACCEPTED},
+                                   format='json')
+        self.assertEqual([r['success'] for r in response.json()['results']], [False, True, True, False])
+        self.assertEqual(Order.objects.get(pk=other.pk).order_status, Order.PENDING)
+
+        with mock.patch('menufood.orders.get_mail_executor') as executor, \
+                self.captureOnCommitCallbacks(execute=True):
+            executor.return_value.submit.side_effect = lambda fn, *args: fn(*args)
+            response = client.post('/orders/confirm-orders/', {'ids': ids, 'order_status': Order.SUCCESSED},
+                                   format='json')
+        self.assertEqual(response.json()['message'], 'Đã cập nhật 3/4 đơn hàng!')
+        self.assertEqual(len(mail.outbox), 3)
+
+        self.assertEqual(client.post('/orders/confirm-orders/', {'ids': ids, 'order_status': Order.PENDING},
+                                     format='json').status_code, 400)
+        self.assertEqual(client.post('/orders/confirm-orders/', {'ids': list(range(1, 200)), 'order_status': 1},
+                                     format='json').status_code, 400)
+
+    def test_confirm_orders_survives_smtp_error(self):
+        for order in self.orders:
+            transition(order, Order.ACCEPTED)
+        client = APIClient()
+        client.force_authenticate(user=self.store)
+        with mock.patch('menufood.orders.get_mail_executor') as executor, \
+                mock.patch('menufood.orders.get_connection', side_effect=OSError('smtp down')), \
+                self.assertLogs('menufood.orders', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            executor.return_value.submit.side_effect = lambda fn, *args: fn(*args)
+            response = client.post('/orders/confirm-orders/', {'ids': [o.pk for o in self.orders],
+                                                               'order_status': Order.SUCCESSED}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.filter(order_status=Order.SUCCESSED).count(), 3)
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        menu = MenuItem.objects.create(name='Menu', store=self.store)
+        food = Food.objects.create(name='pho', price=10000, description='', menu_item=menu)
+        method = PaymentMethod.objects.create(name='Tiền mặt')
+        self.orders = []
+        for i, (status, age) in enumerate([(Order.SUCCESSED, 400), (Order.SUCCESSED, 300), (Order.ACCEPTED, 400),
+                                           (Order.SUCCESSED, 10)]):
+            order = Order.objects.create(amount=10000 * (i + 1), delivery_fee=0, receiver_name='A',
+                                         receiver_phone='0911111111', receiver_address='HCM', paymentmethod=method,
+                                         user=self.customer, store=self.store, order_status=status)
+            Order.objects.filter(pk=order.pk).update(created_date=timezone.now() - timedelta(days=age))
+            OrderDetail.objects.create(order=order, food=food, unit_price=order.amount, quantity=1)
+            self.orders.append(order)
+        PaymentAttempt.objects.create(order=self.orders[0], request_id='r1', amount=10000)
+
+    def test_archive_moves_old_completed_orders(self):
+        client = APIClient()
+        client.force_authenticate(user=self.customer)
+        before = client.get('/orders/').json()
+        year = {'year': (timezone.now() - timedelta(days=300)).year}
+        revenue = self.client.post('/revenue-stats-year/', year).json()['total_revenue']
+        refresh_store_stats()
+        stats = get_store_stats()['daily']
+
+        self.assertEqual(archive_orders(days=180, batch_size=1), 2)
+        self.assertEqual(sorted(Order.objects.values_list('id', flat=True)), [self.orders[2].pk, self.orders[3].pk])
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('id', flat=True)),
+                         [self.orders[0].pk, self.orders[1].pk])
+        self.assertEqual(ArchivedOrderDetail.objects.count(), 2)
+        self.assertEqual(PaymentAttempt.objects.get().order_id, self.orders[0].pk)
+
+        # API đọc và thống kê không đổi sau khi lưu trữ
+        self.assertEqual(client.get('/orders/').json(), before)
+        self.assertEqual(client.get('/orders/%d/' % self.orders[0].pk).json(), before[0])
+        refresh_store_stats()
+        self.assertEqual(get_store_stats()['daily'], stats)
+        self.assertEqual(self.client.post('/revenue-stats-year/', year).json()['total_revenue'], revenue)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def _request(self, method, write=False, **extra):
+        def view(request):
+            if write:
+                db_router.db_for_write(Food)
+            return HttpResponse(Food.objects.all().db)
+
+        response = ReplicaRoutingMiddleware(view)(getattr(self.factory, method)('/foods/', **extra))
+        return response.content.decode(), response
+
+    def test_reads_use_replica_until_user_writes(self):
+        auth = {'HTTP_AUTHORIZATION': 'Bearer abc'}
+        self.assertEqual(self._request('get', **auth)[0], 'replica')
+        self.assertEqual(self._request('post', **auth)[0], 'default')
+
+        db, response = self._request('post', write=True, **auth)
+        self.assertEqual(db, 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self._request('get', **auth)[0], 'default')
+        self.assertEqual(self._request('get', HTTP_AUTHORIZATION='Bearer other')[0], 'replica')
+
+        self.assertEqual(self._request('get', HTTP_COOKIE='%s=1' % PIN_COOKIE)[0], 'default')
+
+    def test_transactions_and_background_use_primary(self):
+        self.assertEqual(Food.objects.all().db, 'default')
+
+        def view(request):
+            with transaction.atomic():
+                db = Food.objects.all().db
+            return HttpResponse(db)
+
+        self.assertEqual(ReplicaRoutingMiddleware(view)(self.factory.get('/foods/')).content, b'default')
+
+
+# cần khai báo ít nhất 2 shard trong DATABASES/ORDER_SHARDS (vd. 2 file SQLite) để chạy
+@skipUnless(len(settings.ORDER_SHARDS) > 1, 'ORDER_SHARDS chỉ có một shard')
+class OrderShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.first, self.second = settings.ORDER_SHARDS[:2]
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        method = PaymentMethod.objects.create(name='Tiền mặt')
+        self.stores, self.orders = [], []
+        for i, shard in enumerate([self.first, self.second]):
+            store = User.objects.create_user(username='store%d' % i, password='123', phone='090000000%d' % i,
+                                             name_store='Store %d' % i, user_role=User.STORE, is_verify=True)
+            StoreShard.objects.create(store=store, shard=shard)
+            food = Food.objects.create(name='pho', price=10000, description='',
+                                       menu_item=MenuItem.objects.create(name='Menu', store=store))
+            self.client.force_login(self.customer)
+            client = APIClient()
+            client.force_authenticate(user=self.customer)
+            response = client.post('/orders/', {
+                'amount': 10000, 'delivery_fee': 0, 'receiver_name': 'A', 'receiver_phone': '0911111111',
+                'receiver_address': 'HCM', 'paymentmethod': method.pk, 'user': self.customer.pk, 'store': store.pk,
+                'order_details': [{'food': food.pk, 'unit_price': 10000, 'quantity': 1}]}, format='json')
+            self.stores.append(store)
+            self.orders.append(response.json()['data']['id'])
+
+    def test_orders_are_stored_on_store_shard(self):
+        self.assertNotEqual(*self.orders)
+        for shard, order_id in zip([self.first, self.second], self.orders):
+            self.assertEqual(list(Order.objects.using(shard).values_list('id', flat=True)), [order_id])
+            self.assertEqual(OrderDetail.objects.using(shard).get().order_id, order_id)
+            self.assertEqual(OrderEvent.objects.using(shard).get().order_id, order_id)
+
+        client = APIClient()
+        client.force_authenticate(user=self.customer)
+        self.assertEqual([o['id'] for o in client.get('/orders/').json()], sorted(self.orders))
+        self.assertEqual(client.get('/orders/%d/' % self.orders[1]).json()['store'], self.stores[1].pk)
+
+        client.force_authenticate(user=self.stores[1])
+        self.assertEqual([o['id'] for o in client.get('/orders/pending-order/').json()], [self.orders[1]])
+        self.assertEqual(client.post('/orders/%d/confirm-order/' % self.orders[1]).status_code, 200)
+        response = client.post('/orders/confirm-orders/', {'ids': self.orders, 'order_status': Order.SUCCESSED},
+                               format='json')
+        self.assertEqual([r['success'] for r in response.json()['results']], [False, True])
+        self.assertEqual(Order.objects.using(self.second).get().order_status, Order.SUCCESSED)
+
+        refresh_store_stats()
+        self.assertEqual(sum(s['total_orders'] for s in get_store_stats()['stores']), 1)
+
+    def test_move_store(self):
+        store = self.stores[1]
+        self.assertEqual(move_store(store.pk, self.first), 1)
+        self.assertEqual(shard_for_store(store.pk), self.first)
+        self.assertFalse(Order.objects.using(self.second).exists())
+        self.assertFalse(OrderDetail.objects.using(self.second).exists())
+        self.assertEqual(sorted(Order.objects.using(self.first).values_list('id', flat=True)), sorted(self.orders))
+
+        client = APIClient()
+        client.force_authenticate(user=store)
+        self.assertEqual([o['id'] for o in client.get('/orders/').json()], [self.orders[1]])
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Store', user_role=User.STORE, is_verify=True)
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        menu = MenuItem.objects.create(name='Món nước', store=self.store)
+        self.foods = [Food.objects.create(name=name, price=10000, description='', menu_item=menu)
+                      for name in ('phở', 'bún')]
+        method = PaymentMethod.objects.create(name='Tiền mặt')
+        self.orders = []
+        for i, (status, age) in enumerate([(Order.SUCCESSED, 400), (Order.SUCCESSED, 20), (Order.PENDING, 10),
+                                           (Order.SUCCESSED, 1), (Order.SUCCESSED, 0)]):
+            order = Order.objects.create(amount=10000 * (i + 1), delivery_fee=0, receiver_name='Nguyễn, A',
+                                         receiver_phone='0911111111', receiver_address='HCM', paymentmethod=method,
+                                         user=self.customer, store=self.store, order_status=status)
+            Order.objects.filter(pk=order.pk).update(created_date=timezone.now() - timedelta(days=age))
+            OrderDetail.objects.create(order=order, food=self.foods[i % 2], unit_price=10000, quantity=i + 1)
+            self.orders.append(order.pk)
+        archive_orders(days=180, batch_size=10)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.store)
+
+    def read_csv(self, response):
+        self.assertEqual(response.status_code, 200)
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+
+    def test_export_orders_csv(self):
+        rows = self.read_csv(self.client.get('/orders/export/'))
+        # đơn lưu trữ và đơn đang dùng được gộp theo id, đọc nhiều lô
+        self.assertEqual([int(r[0]) for r in rows[1:]], self.orders)
+        self.assertEqual(rows[1][2:4], ['SUCCESSED', 'Nguyễn, A'])
+        self.assertEqual(rows[1][8], 'Tiền mặt')
+
+        since = (timezone.localdate() - timedelta(days=15)).isoformat()
+        until = (timezone.localdate() - timedelta(days=1)).isoformat()
+        rows = self.read_csv(self.client.get('/orders/export/', {'from': since, 'to': until}))
+        self.assertEqual([int(r[0]) for r in rows[1:]], self.orders[2:4])
+
+        self.assertEqual(self.client.get('/orders/export/', {'from': '2023-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get('/orders/export/', {'type': 'pdf'}).status_code, 400)
+
+    def test_export_xlsx(self):
+        response = self.client.get('/orders/export-details/', {'type': 'xlsx'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('order-details.xlsx', response['Content-Disposition'])
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        sheet = archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 6)
+        self.assertIn('phở', sheet)
+
+    def test_export_revenue(self):
+        rows = self.read_csv(self.client.get('/orders/export-revenue/'))
+        # đơn PENDING không được tính
+        self.assertEqual(rows[1:], [[str(self.foods[0].pk), 'phở', 'Món nước', '6', '60000'],
+                                    [str(self.foods[1].pk), 'bún', 'Món nước', '6', '60000']])
+        rows = self.read_csv(self.client.get('/orders/export-revenue/', {'group': 'menu_item'}))
+        self.assertEqual(rows[1][1:], ['Món nước', '12', '120000'])
+
+    def test_customer_cannot_export(self):
+        self.client.force_authenticate(user=self.customer)
+        for url in ('/orders/export/', '/orders/export-details/', '/orders/export-revenue/'):
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ListDataTestCase(TestCase):
+    def setUp(self):
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              name_store='Quán\u2028Phở', user_role=User.STORE, is_verify=True,
+                                              avatar='image/upload/avatar.jpg')
+        self.customer = User.objects.create_user(username='customer', password='123', phone='0911111111')
+        menus = [MenuItem.objects.create(name='Menu %d' % i, store=self.store) for i in range(2)]
+        tags = [Tag.objects.create(name='tag %d' % i) for i in range(3)]
+        self.foods = []
+        for i in range(4):
+            food = Food.objects.create(name='phở %d' % i, price=10000 + i, description='"ngon"\n',
+                                       menu_item=menus[i % 2], start_time=time(7) if i else None,
+                                       image_food='image/upload/food%d.jpg' % i if i % 2 else None)
+            food.tags.add(*tags[:i])
+            self.foods.append(food)
+        Like.objects.create(food=self.foods[1], user=self.customer)
+        Rating.objects.create(food=self.foods[2], user=self.customer, rate=4)
+        method = PaymentMethod.objects.create(name='Tiền mặt')
+        for i in range(2):
+            Order.objects.create(amount=10000, delivery_fee=1500, receiver_name='A', receiver_phone='0911111111',
+                                 receiver_address='HCM', paymentmethod=method, user=self.customer, store=self.store)
+        self.request = RequestFactory().get('/', {'image_size': 'card'})
+        self.request.user = self.customer
+
+    def assertSameJSON(self, values, serializer_class, queryset):
+        expected = serializer_class(queryset, many=True, context={'request': self.request}).data
+        with self.assertNumQueries(1 + len(values.plan(self.request).many)):
+            data = values.data(queryset, self.request)
+        self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+
+    def assertSameAsSerializers(self):
+        foods = Food.objects.select_related('menu_item__store').prefetch_related('tags').order_by('id')
+        self.assertSameJSON(food_values, FoodSerializer, foods)
+        self.assertSameJSON(popular_food_values, PopularFoodSerializer, annotate_counts(foods))
+        self.assertSameJSON(authorized_food_values, AuthorizedFoodDetailsSerializer, annotate_counts(foods).annotate(
+            user_liked=Exists(Like.objects.filter(food=OuterRef('pk'), user=self.customer, liked=True)),
+            user_rate=Subquery(Rating.objects.filter(food=OuterRef('pk'), user=self.customer).values('rate')[:1])))
+        self.assertSameJSON(menu_item_values, MenuItemSerializer,
+                            MenuItem.objects.annotate(food_count=Count('menuitem_food')).order_by('id'))
+        self.assertSameJSON(order_values, OrderSerializer, Order.objects.order_by('id'))
+
+
+class ValuesSerializerTests(ListDataTestCase):
+    def test_same_output_as_serializer(self):
+        self.assertSameAsSerializers()
+
+    def test_list_endpoints(self):
+        client = APIClient()
+        response = client.get('/foods/', {'image_size': 'thumbnail'})
+        self.assertEqual(response.json()['count'], 4)
+        self.assertIn(b'\\u2028', response.content)
+        self.assertEqual(client.get('/stores/%d/menu-item/' % self.store.pk).json()[0]['food_count'], 2)
+
+        client.force_authenticate(user=self.customer)
+        results = client.get('/foods/').json()['results']
+        self.assertEqual([(f['liked'], f['rate']) for f in results], [(False, 0), (True, 0), (False, 4), (False, 0)])
+        self.assertEqual([len(f['tags']) for f in results], [0, 1, 2, 3])
+
+    def test_fast_renderer_same_bytes(self):
+        data = {'text': 'Phở\u2028bò\u2029"', 'price': Decimal('10000.50'), 'none': None, 1: [True, 2 ** 40],
+                'date': timezone.now(), 'time': time(7, 30), 'nested': [{'a': ()}]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render({'big': 2 ** 70}), JSONRenderer().render({'big': 2 ** 70}))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+    @skipUnless(msgpack, 'msgpack chưa được cài đặt')
+    def test_msgpack(self):
+        response = APIClient().get('/foods/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), APIClient().get('/foods/').json())
+
+
+class DynamicFieldsTests(ListDataTestCase):
+    def get(self, url, params, queries):
+        client = APIClient()
+        client.force_authenticate(user=self.customer)
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), queries)
+        return response, ' '.join(q['sql'] for q in ctx.captured_queries)
+
+    def test_sparse_fields(self):
+        response, sql = self.get('/foods/', {'fields': 'id,name'}, 2)
+        self.assertEqual(response.json()['results'][0], {'id': self.foods[0].pk, 'name': 'phở 0'})
+        # không JOIN danh mục/cửa hàng, không truy vấn tags
+        self.assertNotIn('menufood_menuitem', sql)
+        self.assertNotIn('menufood_tag', sql)
+
+        response, sql = self.get('/foods/', {'fields': 'id,menu_item.store.name_store'}, 2)
+        self.assertEqual(response.json()['results'][0],
+                         {'id': self.foods[0].pk, 'menu_item': {'store': {'name_store': 'Quán Phở'}}})
+
+        response, _ = self.get('/orders/', {'fields': 'id,order_status'}, 2)
+        self.assertEqual(set(response.json()[0]), {'id', 'order_status'})
+
+    def test_expand(self):
+        full, _ = self.get('/foods/', {}, 3)
+        response, sql = self.get('/foods/', {'expand': ''}, 3)
+        food = response.json()['results'][3]
+        self.assertEqual(food['menu_item'], self.foods[3].menu_item_id)
+        self.assertEqual(len(food['tags']), 3)
+        self.assertNotIn('menufood_user', sql.split('FROM', 2)[-1])
+        self.assertLess(len(response.content) * 2, len(full.content))
+
+        response, _ = self.get('/foods/', {'expand': 'menu_item,tags'}, 3)
+        food = response.json()['results'][3]
+        self.assertEqual(food['menu_item']['store'], self.store.pk)
+        self.assertEqual(food['tags'][0]['name'], 'tag 0')
+
+    def test_serializer_path(self):
+        food = self.foods[3]
+        Comment.objects.create(content='ngon', food=food, user=self.customer)
+        response, sql = self.get('/comments/', {'food_id': food.pk, 'expand': ''}, 2)
+        self.assertNotIn('menufood_user', sql)
+        self.assertEqual(response.json()['results'][0]['user'], self.customer.pk)
+        response, _ = self.get('/comments/', {'food_id': food.pk, 'fields': 'content,user.username'}, 2)
+        self.assertEqual(response.json()['results'][0], {'content': 'ngon', 'user': {'username': 'customer'}})
+
+        response, _ = self.get('/foods/%d/' % food.pk, {'expand': 'menu_item', 'fields': 'id,menu_item,tags'}, 2)
+        self.assertEqual(response.json(), {'id': food.pk, 'menu_item': {'id': food.menu_item_id, 'name': 'Menu 1',
+                                                                        'active': True, 'store': self.store.pk},
+                                           'tags': [t.pk for t in food.tags.all()]})
+
+    def test_same_output_as_serializer(self):
+        for params in ({'fields': 'id,tags.name,menu_item.store'}, {'expand': 'menu_item', 'image_size': 'card'}):
+            self.request = RequestFactory().get('/', params)
+            self.request.user = self.customer
+            self.assertSameAsSerializers()
+
+
+class StoreMenuDocumentTests(ListDataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.url = '/stores/%d/menu/' % self.store.pk
+        self.client = APIClient()
+
+    def get(self, queries=None, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'image_size': 'card'}, **headers)
+        if queries is not None:
+            self.assertEqual(len(ctx.captured_queries), queries)
+        return response, ' '.join(q['sql'] for q in ctx.captured_queries)
+
+    def test_document(self):
+        response, _ = self.get(4)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=%d' % settings.STORE_MENU['MAX_AGE'])
+        document = response.json()
+        self.assertEqual(document['store']['name_store'], 'Quán\u2028Phở')
+        self.assertEqual([m['name'] for m in document['menu_items']], ['Menu 0', 'Menu 1'])
+
+        request = RequestFactory().get('/', {'image_size': 'card'})
+        for menu in document['menu_items']:
+            foods = Food.objects.filter(menu_item=menu['id']).order_by('id')
+            expected = MenuFoodSerializer(foods, many=True, context={'request': request}).data
+            self.assertEqual(menu['foods'], json.loads(JSONRenderer().render(expected)))
+        self.assertEqual(len(document['menu_items'][1]['foods'][1]['tags']), 3)
+
+    def test_cached_and_not_modified(self):
+        response, _ = self.get(4)
+        self.assertEqual(self.get(0)[0].content, response.content)
+        response, _ = self.get(0, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_incremental_rebuild(self):
+        etag = self.get()[0]['ETag']
+        food = self.foods[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            food.name = 'bún'
+            food.save()
+
+        response, sql = self.get(4, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['menu_items'][1]['foods'][0]['name'], 'bún')
+        # chỉ dựng lại danh mục của món vừa sửa
+        self.assertIn('IN (%d)' % food.menu_item_id, sql)
+
+    def test_tag_and_menu_changes(self):
+        self.get()
+        tag = Tag.objects.get(name='tag 0')
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = 'cay'
+            tag.save()
+        document = self.get()[0].json()
+        self.assertEqual(document['menu_items'][0]['foods'][1]['tags'][0]['name'], 'cay')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            menu = MenuItem.objects.get(name='Menu 0')
+            menu.active = False
+            menu.save()
+        document = self.get()[0].json()
+        self.assertEqual([m['name'] for m in document['menu_items']], ['Menu 1'])
+
+    def test_not_found(self):
+        self.url = '/stores/%d/menu/' % self.customer.pk
+        self.assertEqual(self.get()[0].status_code, 404)
+        self.url = '/stores/abc/menu/'
+        self.assertEqual(self.get()[0].status_code, 404)
+
+
+@override_settings(SYNC={'OVERLAP': 0, 'TOMBSTONE_DAYS': 30})
+class SyncTests(ListDataTestCase):
+    def get(self, user=None, queries=None, **params):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get('/sync/', params)
+        if queries is not None:
+            self.assertEqual(len(ctx.captured_queries), queries)
+        return response
+
+    def test_snapshot(self):
+        data = self.get().json()
+        self.assertTrue(data['reset'])
+        self.assertNotIn('likes', data)
+        food = data['foods']['created'][3]
+        self.assertEqual((food['menu_item'], len(food['tags'])), (self.foods[3].menu_item_id, 3))
+        self.assertEqual([t['name'] for t in data['tags']['created']], ['tag 0', 'tag 1', 'tag 2'])
+
+        data = self.get(self.customer, 7).json()
+        self.assertEqual(data['likes']['created'], [{'id': Like.objects.get().pk, 'food': self.foods[1].pk,
+                                                     'liked': True}])
+        self.assertEqual(data['ratings']['created'][0]['rate'], 4)
+        self.assertEqual(data['orders'], [])
+
+    def test_delta(self):
+        token = self.get(self.customer).json()['token']
+        # không món nào thay đổi: không cần truy vấn tag của món
+        self.assertEqual(self.get(self.customer, 8, since=token).json()['foods'],
+                         {'created': [], 'updated': [], 'deactivated': [], 'deleted': []})
+
+        food = self.foods[0]
+        food.name = 'bún'
+        food.save()
+        self.foods[1].active = False
+        self.foods[1].save()
+        tag, like = Tag.objects.get(name='tag 2'), Like.objects.get()
+        deleted = [tag.pk, like.pk]
+        tag.delete()
+        like.delete()
+        order = Order.objects.first()
+        transition(order, Order.ACCEPTED, actor=self.store)
+
+        data = self.get(self.customer, 9, since=token).json()
+        self.assertFalse(data['reset'])
+        self.assertGreater(int(data['token']), int(token))
+        foods = data['foods']
+        self.assertEqual([f['id'] for f in foods['updated']], [food.pk, self.foods[3].pk])
+        self.assertEqual(foods['updated'][0]['name'], 'bún')
+        self.assertEqual(len(foods['updated'][1]['tags']), 2)
+        self.assertEqual(foods['deactivated'], [self.foods[1].pk])
+        self.assertEqual([data['tags']['deleted'], data['likes']['deleted']], [[i] for i in deleted])
+        self.assertEqual([(o['id'], o['order_status']) for o in data['orders']], [(order.pk, Order.ACCEPTED)])
+
+        # dữ liệu riêng của user khác không được trả về
+        data = self.get(since=token).json()
+        self.assertNotIn('likes', data)
+        self.assertEqual(self.get(self.store, since=token).json()['likes']['deleted'], [])
+
+    @override_settings(SYNC={**settings.SYNC, 'OVERLAP': 0}, UPLOAD_STAGING_ROOT=tempfile.mkdtemp())
+    def test_finished_upload(self):
+        food = self.foods[0]
+        with self.captureOnCommitCallbacks():
+            upload = stage_upload(food, 'image_food', SimpleUploadedFile('pho.jpg', b'jpg'))
+        token = self.get(self.customer).json()['token']
+        self.assertIsNone(self.get(self.customer, since=token).json()['foods']['updated'] or None)
+
+        with mock.patch.object(LocalImageStorage, 'upload', return_value='uploads/pho.jpg'), \
+                override_settings(IMAGE_STORAGE='menufood.images.LocalImageStorage'):
+            self.assertTrue(process_upload(upload.pk))
+        updated = self.get(self.customer, since=token).json()['foods']['updated']
+        self.assertEqual([f['id'] for f in updated], [food.pk])
+        self.assertIn('uploads/pho', updated[0]['image'])
+
+    def test_token(self):
+        self.assertEqual(self.get(since='abc').status_code, 400)
+        # token cũ hơn thời gian giữ Tombstone: tải lại toàn bộ
+        self.assertTrue(self.get(since='1').json()['reset'])
+
+        Tag.objects.get(name='tag 0').delete()
+        Tombstone.objects.update(deleted_date=timezone.now() - timedelta(days=31))
+        call_command('purge_tombstones', stdout=io.StringIO())
+        self.assertFalse(Tombstone.objects.exists())
+
+
+class BatchLookupTests(ListDataTestCase):
+    def get(self, url, ids, queries=None, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url, {'ids': ids, 'image_size': 'card'})
+        if queries is not None:
+            self.assertEqual(len(ctx.captured_queries), queries)
+        return response
+
+    def test_foods(self):
+        self.foods[2].active = False
+        self.foods[2].save()
+        ids = [self.foods[3].pk, self.foods[0].pk, self.foods[2].pk, 999, self.foods[1].pk]
+        for user in (None, self.customer):
+            data = self.get('/foods/batch/', ','.join(map(str, ids + ids[:1])), 2, user).json()
+            self.assertEqual([f['id'] for f in data['results']], [ids[0], ids[1], ids[4]])
+            self.assertEqual(data['missing'], [self.foods[2].pk, 999])
+
+            client = APIClient()
+            if user is not None:
+                client.force_authenticate(user=user)
+            self.assertEqual(data['results'][0],
+                             client.get('/foods/%d/' % ids[0], {'image_size': 'card'}).json())
+
+    def test_stores(self):
+        data = self.get('/stores/batch/', '%d, %d' % (self.customer.pk, self.store.pk), 1).json()
+        self.assertEqual(data['results'], [APIClient().get('/stores/%d/' % self.store.pk, {'image_size': 'card'}).json()])
+        self.assertEqual(data['missing'], [self.customer.pk])
+
+    def test_invalid_ids(self):
+        for ids in ('', 'a,1', ','.join(map(str, range(1, 102)))):
+            self.assertEqual(self.get('/foods/batch/', ids, 0).status_code, 400)
+
+
+class CartQuoteTests(ListDataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Food.objects.update(start_time=None)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.customer)
+
+    def post(self, url, items, queries=None, **data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, {'order_details': items, **data}, format='json')
+        if queries is not None:
+            self.assertEqual(len(ctx.captured_queries), queries)
+        return response
+
+    def test_quote(self):
+        f1, f3 = self.foods[1], self.foods[3]
+        items = [{'food': f1.pk, 'quantity': 2}, {'food': f3.pk}, {'food': f1.pk, 'quantity': 1}]
+        # lần đầu dựng bảng phí giao hàng của cửa hàng (địa chỉ cửa hàng, các bậc phí)
+        data = self.post('/orders/quote/', items, 3, receiver_address='HCM').json()
+        self.assertEqual(data['lines'], [
+            {'food': f1.pk, 'name': 'phở 1', 'unit_price': '10001', 'quantity': 3, 'line_total': '30003'},
+            {'food': f3.pk, 'name': 'phở 3', 'unit_price': '10003', 'quantity': 1, 'line_total': '10003'},
+        ])
+        self.assertEqual((data['store'], data['amount'], data['total']), (self.store.pk, '40006', '55006'))
+        self.assertEqual(self.post('/orders/quote/', items, 0, receiver_address='HCM').json(), data)
+        # chưa có địa chỉ giao hàng thì chưa tính phí
+        self.assertEqual([self.post('/orders/quote/', items).json()[k] for k in ('delivery_fee', 'total')],
+                         [None, None])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            f3.price = 20000
+            f3.save()
+        self.assertEqual(self.post('/orders/quote/', items, 1, receiver_address='HCM').json()['amount'], '50003')
+
+    def test_invalid_cart(self):
+        other = User.objects.create_user(username='store2', password='123', phone='0922222222',
+                                         user_role=User.STORE, name_store='Quán 2')
+        food = Food.objects.create(name='bún', price=5000, menu_item=MenuItem.objects.create(name='M', store=other))
+        self.foods[0].active = False
+        self.foods[0].save()
+        cases = [
+            ([], 'Giỏ hàng không hợp lệ (tối đa 50 món)!'),
+            ([{'food': self.foods[1].pk, 'quantity': 0}], 'Món ăn nào được đặt không hợp lệ!'),
+            ([{'food': 999}], 'Món ăn nào được đặt không hợp lệ!'),
+            ([{'food': self.foods[1].pk, 'quantity': 100}], 'Mỗi món được đặt tối đa 99 phần!'),
+            ([{'food': self.foods[0].pk}], 'Món ăn phở 0 hiện tại không còn bán!'),
+            ([{'food': self.foods[1].pk}, {'food': food.pk}], 'Các món trong một đơn phải cùng một cửa hàng!'),
+        ]
+        for items, message in cases:
+            response = self.post('/orders/quote/', items)
+            self.assertEqual((response.status_code, response.json()['message']), (400, message))
+
+    def test_selling_window(self):
+        self.assertTrue(in_selling_window(None, None, time(3)))
+        self.assertTrue(in_selling_window(time(7), time(21), time(7)))
+        self.assertFalse(in_selling_window(time(7), time(21), time(21, 30)))
+        self.assertTrue(in_selling_window(time(22), time(2), time(1)))
+        self.assertFalse(in_selling_window(time(22), time(2), time(12)))
+        self.assertFalse(in_selling_window(time(7), None, time(6)))
+
+    def test_order_uses_server_prices(self):
+        order = {'amount': 1, 'delivery_fee': 0, 'receiver_name': 'A', 'receiver_phone': '0911111111',
+                 'receiver_address': 'HCM', 'paymentmethod': PaymentMethod.objects.get().pk, 'user': self.customer.pk,
+                 'store': self.store.pk}
+        items = [{'food': self.foods[2].pk, 'unit_price': 1, 'quantity': 2}]
+        response = self.post('/orders/', items, **order)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['data']['amount'], response.json()['data']['delivery_fee']),
+                         ('20004', '15000'))
+        self.assertEqual(OrderDetail.objects.get().unit_price, 10002)
+
+        self.foods[2].active = False
+        self.foods[2].save()
+        response = self.post('/orders/', items, **order)
+        self.assertEqual(response.json()['message'], 'Món ăn phở 2 hiện tại không còn bán!')
+        self.assertEqual(Order.objects.count(), 3)
+
+
+@override_settings(DELIVERY={**settings.DELIVERY, 'GEOCODER': 'menufood.delivery.LocalGeocoder'})
+class DeliveryFeeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = User.objects.create_user(username='store', password='123', phone='0900000000',
+                                              user_role=User.STORE, address='10.7769,106.7009')
+
+    def fee(self, lat_offset, queries=None):
+        with CaptureQueriesContext(connection) as ctx:
+            fee = delivery_fee(self.store.pk, '%f,106.7009' % (10.7769 + lat_offset))
+        if queries is not None:
+            self.assertEqual(len(ctx.captured_queries), queries)
+        return fee
+
+    def test_default_zones(self):
+        self.assertAlmostEqual(distance_km((10, 106), (11, 106)), 111.19, places=2)
+        # 0.018 độ vĩ ~ 2km, 0.045 ~ 5km
+        self.assertEqual(self.fee(0.018), 15000)
+        self.assertEqual(self.fee(-0.045), 25000)
+        with self.assertRaisesMessage(DeliveryError, 'ngoài phạm vi giao hàng'):
+            self.fee(0.2)
+
+    def test_geocode_once(self):
+        with mock.patch.object(LocalGeocoder, 'geocode', autospec=True, side_effect=LocalGeocoder.geocode) as geocode:
+            self.fee(0.018)
+            cache.clear()
+            self.fee(0.018)
+        # địa chỉ cửa hàng và địa chỉ nhận, mỗi địa chỉ một lần
+        self.assertEqual(geocode.call_count, 2)
+        self.assertEqual(GeocodedAddress.objects.count(), 2)
+        # bảng phí và toạ độ đã cache: không truy vấn DB
+        self.fee(0.018, 0)
+
+    def test_store_zones(self):
+        self.assertEqual(self.fee(0.018), 15000)
+        with self.captureOnCommitCallbacks(execute=True):
+            DeliveryZone.objects.create(store=self.store, max_distance=Decimal('2.5'), fee=12000)
+            DeliveryZone.objects.create(store=self.store, max_distance=Decimal('4'), fee=18000)
+        self.assertEqual(self.fee(0.018), 12000)
+        self.assertEqual(self.fee(0.03), 18000)
+        with self.assertRaisesMessage(DeliveryError, 'ngoài phạm vi giao hàng'):
+            self.fee(0.045)
+
+        # cửa hàng chưa xác định được vị trí: phí mặc định
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store.address = None
+            self.store.save()
+        self.assertEqual(self.fee(0.045), settings.PRICING['DELIVERY_FEE'])
+
+
+@override_settings(POPULARITY={'FLUSH_INTERVAL': 3600, 'MAX_PENDING': 1000})
+class PopularityTests(ListDataTestCase):
+    def setUp(self):
+        super().setUp()
+        popularity.flush()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.customer)
+
+    def counts(self, food):
+        popularity.flush()
+        return FoodPopularity.objects.filter(food=food).values_list('likes', 'ratings', 'rating_total').first()
+
+    def test_like_toggle(self):
+        food = self.foods[3]
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                self.assertEqual(self.client.post('/foods/%d/like/' % food.pk).status_code, 200)
+        self.assertTrue(Like.objects.get(food=food).liked)
+        self.assertEqual(self.counts(food), (1, 0, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(toggle_like(food.pk, self.customer.pk))
+        self.assertEqual(self.counts(food), (0, 0, 0))
+        self.assertEqual(self.client.post('/foods/999/like/').status_code, 404)
+
+    def test_rating(self):
+        food = self.foods[3]
+        with self.captureOnCommitCallbacks(execute=True):
+            for rate in (3, 5, 5):
+                self.assertEqual(self.client.post('/foods/%d/rating/' % food.pk, {'rate': rate}).status_code, 200)
+            set_rating(food.pk, self.store.pk, 4)
+        self.assertEqual(Rating.objects.get(food=food, user=self.customer).rate, 5)
+        self.assertEqual(self.counts(food), (0, 2, 9))
+        for rate in ('x', 0, 6, -3):
+            self.assertEqual(self.client.post('/foods/%d/rating/' % food.pk, {'rate': rate}).status_code, 400)
+        self.assertRaises(ValueError, set_rating, food.pk, self.store.pk, 10)
+        self.assertEqual(self.counts(food), (0, 2, 9))
+
+    def test_coalesced_flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for food in self.foods:
+                toggle_like(food.pk, self.store.pk)
+            toggle_like(self.foods[0].pk, self.customer.pk)
+        # một INSERT và một UPDATE cho mỗi nhóm món có cùng thay đổi (cộng savepoint của transaction)
+        with self.assertNumQueries(5):
+            self.assertEqual(popularity.flush(), 4)
+        self.assertEqual(list(FoodPopularity.objects.order_by('food').values_list('likes', flat=True)), [2, 1, 1, 1])
+
+        call_command('rebuild_popularity', stdout=io.StringIO())
+        self.assertEqual(list(FoodPopularity.objects.order_by('food').values_list('likes', flat=True)), [2, 2, 1, 1])
+
+    def test_rebuild_flushes_pending(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_like(self.foods[0].pk, self.store.pk)
+        # thay đổi còn trong bộ đệm đã được tính khi đếm lại, không được cộng thêm lần nữa
+        popularity.rebuild()
+        self.assertEqual(popularity.flush(), 0)
+        self.assertEqual(self.counts(self.foods[0]), (1, 0, 0))
+
+    def test_counts_in_food_endpoints(self):
+        food = self.foods[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            set_rating(food.pk, self.store.pk, 5)
+            toggle_like(food.pk, self.store.pk)
+        popularity.rebuild()
+
+        expected = {'like_count': 1, 'rating_count': 2, 'rating_avg': '4.5'}
+        for client in (self.client, APIClient()):
+            data = client.get('/foods/%d/' % food.pk).json()
+            self.assertEqual({k: data[k] for k in expected}, expected)
+            results = client.get('/foods/').json()['results']
+            self.assertEqual([f['like_count'] for f in results], [0, 1, 1, 0])
+            self.assertEqual(results[0]['rating_avg'], None)
+
+
+@override_settings(THROTTLING={**settings.THROTTLING, 'RATES': {
+    'write': {'user': '2/min', 'ip': '4/min'}, 'search': {'ip': '2/min'}, 'payment': {'ip': '1/min'}}})
+class ThrottleTests(ListDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.customer)
+        self.url = '/foods/%d/like/' % self.foods[0].pk
+
+    def test_write_limit_per_user_and_ip(self):
+        self.assertEqual([self.client.post(self.url).status_code for _ in range(2)], [200, 200])
+        # bị chặn trước khi chạy view: không truy vấn DB
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertFalse(Like.objects.get(food=self.foods[0]).liked)
+
+        # user khác cùng IP chỉ còn một lượt của bucket IP (request bị chặn theo user vẫn tính vào IP)
+        self.client.force_authenticate(user=self.store)
+        self.assertEqual(self.client.post(self.url).status_code, 200)
+        self.assertEqual(self.client.post(self.url).status_code, 429)
+
+    def test_ip_limit_before_authentication(self):
+        client = APIClient(HTTP_AUTHORIZATION='Bearer invalid', REMOTE_ADDR='10.0.0.9')
+        self.assertEqual([client.post(self.url).status_code for _ in range(4)], [401] * 4)
+        # bị chặn theo IP trước khi tra token
+        with self.assertNumQueries(0):
+            response = client.post(self.url)
+        self.assertEqual(response.status_code, 429)
+
+    def test_search_only_with_keyword(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/foods/').status_code, 200)
+        codes = [self.client.get('/stores/', {'kw': 'st'}).status_code for _ in range(2)]
+        self.assertEqual(codes + [self.client.get('/foods/', {'name': 'a'}).status_code], [200, 200, 429])
+
+    @mock.patch('menufood.views.payments.get_client')
+    def test_payment_limit(self, get_client):
+        get_client.return_value.create_payment.return_value.pay_url = 'http://momo/pay'
+        data = json.dumps({**PaymentGatewayTests.PAYLOAD, 'order': Order.objects.first().pk})
+        responses = [self.client.post('/create_payment/', data, content_type='application/json', REMOTE_ADDR=ip)
+                     for ip in ('10.0.0.1', '10.0.0.1', '10.0.0.2')]
+        self.assertEqual([r.status_code for r in responses], [200, 429, 200])
+        self.assertEqual(responses[1]['Retry-After'], '60')
+        self.assertEqual(get_client.return_value.create_payment.call_count, 2)
+
+    def test_bucket_refills(self):
+        store = LocalBucketStore()
+        limits = [('k', 2, 1.0)]
+        with mock.patch('menufood.throttling.time.monotonic', side_effect=[0, 0, 0, 0.5, 1]):
+            self.assertEqual([store.consume(limits) for _ in range(3)], [0, 0, 1])
+            self.assertEqual(store.consume(limits), 0.5)
+            self.assertEqual(store.consume(limits), 0)
@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    # '30/min' -> (tối đa 30 request liên tiếp, hồi 30 lượt mỗi 60 giây)
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBucketStore:
+    """
+    Token bucket trong bộ nhớ của process, không truy vấn DB/cache.
+    Chạy nhiều process thì mỗi process có giới hạn riêng, dùng CacheBucketStore để giới hạn chung.
+    """
+    def __init__(self):
+        self.buckets = {}  # key -> (số lượt còn lại, thời điểm tính, thời điểm hồi đầy)
+        self.lock = threading.Lock()
+
+    def consume(self, limits):
+        # limits: [(key, capacity, rate)], chỉ trừ lượt khi mọi bucket còn lượt; trả về số giây phải chờ
+        now = time.monotonic()
+        with self.lock:
+            buckets, wait = [], 0
+            for key, capacity, rate in limits:
+                tokens, stamp, _ = self.buckets.get(key, (capacity, now, now))
+                tokens = min(capacity, tokens + (now - stamp) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                buckets.append((key, tokens, capacity, rate))
+            if wait:
+                return wait
+
+            if len(self.buckets) >= settings.THROTTLING['MAX_KEYS']:
+                self._prune(now)
+            for key, tokens, capacity, rate in buckets:
+                self.buckets[key] = (tokens - 1, now, now + (capacity - tokens + 1) / rate)
+        return 0
+
+    def _prune(self, now):
+        # bucket đã hồi đầy giống hệt bucket mới, bỏ đi được
+        self.buckets = {k: b for k, b in self.buckets.items() if b[2] > now}
+        if len(self.buckets) >= settings.THROTTLING['MAX_KEYS']:
+            self.buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Token bucket lưu trong cache THROTTLING['CACHE'] (redis/memcached dùng chung cho mọi process).
+    Đọc rồi ghi không nguyên tử: nhiều process cùng ghi một key có thể cho qua thêm vài request.
+    """
+    def __init__(self):
+        self.cache = caches[settings.THROTTLING.get('CACHE', 'default')]
+
+    def consume(self, limits):
+        now = time.time()
+        keys = ['throttle:%s' % key for key, _, _ in limits]
+        stored = self.cache.get_many(keys)
+        buckets, wait = {}, 0
+        for cache_key, (_, capacity, rate) in zip(keys, limits):
+            tokens, stamp = stored.get(cache_key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            buckets[cache_key] = (tokens, capacity, rate)
+        if wait:
+            return wait
+
+        for cache_key, (tokens, capacity, rate) in buckets.items():
+            self.cache.set(cache_key, (tokens - 1, now), math.ceil((capacity - tokens + 1) / rate))
+        return 0
+
+
+_stores = {}
+
+
+def get_store():
+    path = settings.THROTTLING['STORE']
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+
+    return _stores[path]
+
+
+@receiver(setting_changed)
+def throttling_changed(setting, **kwargs):
+    if setting == 'THROTTLING':
+        _stores.clear()
+
+
+def get_wait(scope, kind, ident):
+    """
+    Trừ một lượt của bucket kind ('ip' hoặc 'user') trong nhóm endpoint scope.
+    Trả về 0 nếu được phép (hoặc nhóm không giới hạn theo kind), ngược lại số giây phải chờ.
+    """
+    rate = settings.THROTTLING['RATES'][scope].get(kind)
+    if rate is None:
+        return 0
+
+    return get_store().consume([('%s:%s:%s' % (scope, kind, ident), *parse_rate(rate))])
+
+
+def get_scope(request, view):
+    # nhóm endpoint của action đang gọi (throttle_scopes = {'action': 'scope'}), None nếu không giới hạn
+    scope = getattr(view, 'throttle_scopes', {}).get(getattr(view, 'action', None))
+    search_params = settings.THROTTLING['SEARCH_PARAMS']
+    if scope == 'search' and not any(request.query_params.get(p) for p in search_params):
+        return None
+    return scope
+
+
+class IPThrottleMixin:
+    """
+    Trừ lượt bucket theo IP trước khi xác thực: DRF xác thực và kiểm tra quyền trước check_throttles,
+    nên request mang token sai/không có token vẫn tốn truy vấn DB nếu chỉ giới hạn trong BucketThrottle.
+    """
+    def initial(self, request, *args, **kwargs):
+        scope = get_scope(request, self)
+        if scope is not None:
+            wait = get_wait(scope, 'ip', BaseThrottle().get_ident(request))
+            if wait:
+                self.throttled(request, wait)
+
+        super().initial(request, *args, **kwargs)
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Giới hạn theo user đã đăng nhập cho nhóm endpoint khai báo ở viewset: throttle_scopes = {'action': 'scope'}.
+    Nhóm 'search' chỉ tính các request có tham số tìm kiếm (THROTTLING['SEARCH_PARAMS']).
+    Action không khai báo thì không giới hạn; giới hạn theo IP nằm ở IPThrottleMixin.
+    """
+    def allow_request(self, request, view):
+        scope = get_scope(request, view)
+        if scope is None or not request.user.is_authenticated:
+            return True
+
+        self.retry_after = get_wait(scope, 'user', request.user.pk)
+        return not self.retry_after
+
+    def wait(self):
+        return self.retry_after
+
+
+def throttle(scope):
+    # cho view Django thường (không qua DRF): chỉ giới hạn theo IP
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            wait = get_wait(scope, 'ip', BaseThrottle().get_ident(request))
+            if wait:
+                response = JsonResponse({"status": status.HTTP_429_TOO_MANY_REQUESTS,
+                                         "message": "Bạn thao tác quá nhanh, vui lòng thử lại sau!"},
+                                        status=status.HTTP_429_TOO_MANY_REQUESTS)
+                response['Retry-After'] = '%d' % math.ceil(wait)
+                return response
+
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,92 @@
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction, connections
+from django.utils import timezone
+
+from . import store_menus
+from .images import get_image_storage
+from .models import MediaUpload
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_WORKERS, thread_name_prefix='media-upload')
+
+    return _executor
+
+
+def stage_upload(instance, field_name, file):
+    """
+    Lưu file vào thư mục tạm và xếp hàng đẩy lên storage sau khi transaction commit.
+    Field ảnh của instance được cập nhật khi upload xong.
+    """
+    os.makedirs(settings.UPLOAD_STAGING_ROOT, exist_ok=True)
+    path = os.path.join(settings.UPLOAD_STAGING_ROOT,
+                        '%s_%s' % (uuid.uuid4().hex, os.path.basename(file.name)))
+    with open(path, 'wb') as f:
+        for chunk in file.chunks():
+            f.write(chunk)
+
+    upload = MediaUpload.objects.create(model=instance._meta.label, object_id=instance.pk,
+                                        field_name=field_name, staged_path=path)
+    transaction.on_commit(lambda: get_executor().submit(_run_upload, upload.pk))
+
+    return upload
+
+
+def _run_upload(upload_id):
+    try:
+        process_upload(upload_id)
+    except Exception:
+        logger.exception('Upload %s failed', upload_id)
+    finally:
+        # thread của pool không đi qua request nên phải tự đóng kết nối DB
+        connections.close_all()
+
+
+def process_upload(upload_id):
+    # chỉ một worker nhận được upload (UPDATE có điều kiện)
+    # update() không tự cập nhật auto_now: updated_date là mốc để process_uploads biết worker còn chạy
+    claimed = MediaUpload.objects.filter(pk=upload_id, status=MediaUpload.PENDING) \
+        .update(status=MediaUpload.UPLOADING, updated_date=timezone.now())
+    if not claimed:
+        return False
+
+    upload = MediaUpload.objects.get(pk=upload_id)
+    storage = get_image_storage()
+    for attempt in range(1, settings.UPLOAD_MAX_ATTEMPTS + 1):
+        try:
+            value = storage.upload(upload.staged_path)
+            break
+        except Exception as e:
+            upload.last_error = str(e)[:255]
+            if attempt < settings.UPLOAD_MAX_ATTEMPTS:
+                time.sleep(settings.UPLOAD_RETRY_DELAY * 2 ** (attempt - 1))
+    else:
+        MediaUpload.objects.filter(pk=upload_id).update(status=MediaUpload.FAILED, attempts=attempt,
+                                                        last_error=upload.last_error, updated_date=timezone.now())
+        return False
+
+    model = apps.get_model(upload.model)
+    values = {upload.field_name: value}
+    # update() không tự cập nhật auto_now: /sync/ lọc theo updated_date để gửi lại url ảnh mới
+    if any(f.name == 'updated_date' for f in model._meta.concrete_fields):
+        values['updated_date'] = timezone.now()
+    model.objects.filter(pk=upload.object_id).update(**values)
+    store_menus.invalidate_object(model, upload.object_id)
+    MediaUpload.objects.filter(pk=upload_id).update(status=MediaUpload.DONE, attempts=attempt,
+                                                    updated_date=timezone.now())
+    os.remove(upload.staged_path)
+
+    return True
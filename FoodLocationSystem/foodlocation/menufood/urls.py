@@ -16,6 +16,7 @@ router.register('comments', views.CommentViewSet, basename='comment')
 router.register('subcribes', views.SubcribeViewSet, basename='subcribe')
 router.register('food-store', views.FoodStoreViewSet, basename='food-store')
 router.register('food-list', views.FoodByStoreViewSet, basename='food-list')
+router.register('sync', views.SyncViewSet, basename='sync')
 # router.register('paid-momo', views.PaidMomoView, basename='paid-momo')
 
 urlpatterns = [
@@ -25,4 +26,6 @@ urlpatterns = [
     path('revenue-stats-quarter/', views.RevenueStatsQuarter.as_view(), name='revenue-stats-quarter'),
     path('revenue-stats-year/', views.RevenueStatsYear.as_view(), name='revenue-stats-year'),
     path('create_payment/', views.create_payment, name='create_payment'),
+    path('momo_ipn/', views.momo_ipn, name='momo_ipn'),
+    path('images/<str:variant>/<path:public_id>', views.image_variant, name='image-variant'),
 ]
@@ -0,0 +1,164 @@
+from functools import partial
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+VALUE, METHOD, NESTED, MANY = range(4)
+
+
+class _Node:
+    # cách dựng dict cho một serializer; serializer lồng qua khoá ngoại dùng chung dòng (cột có tiền tố)
+    def __init__(self, model, prefix, columns, many, methods):
+        self.model = model
+        self.prefix = prefix
+        self.columns = columns
+        self.many = many
+        self.methods = methods
+        self.fields = []
+
+    def column(self, name):
+        column = self.prefix + name
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+
+class ValuesSerializer:
+    """
+    Danh sách chỉ đọc dựng thẳng từ các dòng .values() thay vì object model + ModelSerializer,
+    kết quả giống hệt serializer_class(queryset, many=True).data.
+    Cách chuyển giá trị lấy từ các field của serializer (DecimalField, DateTimeField...), biên dịch một lần.
+    SerializerMethodField không có cột nguồn nên serializer khai báo trong thuộc tính values_methods:
+    {'tên field': ('cột', hàm(request) -> hàm(giá trị))}.
+    Quan hệ many (tags...) được lấy bằng một truy vấn cho cả trang, như prefetch_related.
+    Mỗi tổ hợp ?fields=/?expand= (DynamicFieldsMixin) có một bản biên dịch riêng, chỉ đọc các cột cần trả về.
+    """
+    max_plans = 256
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.plans = {}
+
+    def plan(self, request=None):
+        key = (request.method, request.GET.get('fields'), request.GET.get('expand')) if request is not None else None
+        root = self.plans.get(key)
+        if root is None:
+            if len(self.plans) >= self.max_plans:
+                self.plans.clear()
+            serializer = self.serializer_class(context={'request': request} if request is not None else {})
+            root = self.plans[key] = self._compile(serializer, '', [], [], [])
+
+        return root
+
+    def _compile(self, serializer, prefix, columns, many, methods):
+        node = _Node(serializer.Meta.model, prefix, columns, many, methods)
+        values_methods = getattr(serializer, 'values_methods', {})
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                column, factory = values_methods[name]
+                methods.append(factory)
+                node.fields.append((name, METHOD, node.column(column), len(methods) - 1))
+            elif isinstance(field, serializers.ListSerializer):
+                relation = self._relation(node.model, field.source)
+                if relation is None:
+                    # serializer bỏ qua field read_only không có thuộc tính trên model
+                    continue
+                child = self._compile(field.child, '', [], [], methods)
+                many.append((node.column('id'), relation, child))
+                node.fields.append((name, MANY, len(many) - 1, None))
+            elif isinstance(field, ManyRelatedField):
+                # danh sách id (object lồng không được expand)
+                relation = self._relation(node.model, field.source)
+                if relation is None:
+                    continue
+                many.append((node.column('id'), relation, None))
+                node.fields.append((name, MANY, len(many) - 1, None))
+            elif isinstance(field, serializers.BaseSerializer):
+                fk = node.column(field.source)
+                child = self._compile(field, '%s%s__' % (prefix, field.source), columns, many, methods)
+                node.fields.append((name, NESTED, fk, child))
+            elif isinstance(field, PrimaryKeyRelatedField):
+                # values() trả về sẵn id của khoá ngoại
+                convert = field.pk_field.to_representation if field.pk_field else _same
+                node.fields.append((name, VALUE, node.column(field.source), convert))
+            elif isinstance(field, serializers.ModelField):
+                # field model không có field DRF tương ứng (CloudinaryField...) đọc giá trị từ object
+                attname = field.model_field.attname
+                node.fields.append((name, VALUE, node.column(attname), partial(_model_field_value, field, attname)))
+            elif field.source == '*' or '.' in field.source:
+                raise TypeError('%s.%s: field không đọc được từ values()' % (type(serializer).__name__, name))
+            else:
+                node.fields.append((name, VALUE, node.column(field.source), field.to_representation))
+
+        return node
+
+    @staticmethod
+    def _relation(model, source):
+        try:
+            field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return None
+        # (model con, lookup từ model con về object cha)
+        if field.many_to_many and not field.auto_created:
+            return field.related_model, field.related_query_name()
+        if field.one_to_many or field.many_to_many:
+            return field.related_model, field.field.name
+        return None
+
+    def values(self, queryset, request=None, extra=()):
+        # prefetch_related không dùng được với values(); extra: cột thêm cho nơi gọi, không có trong kết quả
+        return queryset.prefetch_related(None).values(*self.plan(request).columns, *extra)
+
+    def represent(self, rows, request=None, using=None):
+        root = self.plan(request)
+        convert = [factory(request) for factory in root.methods]
+        return self._represent(root, list(rows), convert, using)
+
+    def data(self, queryset, request=None):
+        return self.represent(self.values(queryset, request), request, queryset.db)
+
+    def _represent(self, node, rows, convert, using):
+        related = []
+        for pk, (model, lookup), child in node.many:
+            ids = {row[pk] for row in rows if row[pk] is not None}
+            groups = {}
+            children = model._default_manager.db_manager(using).filter(**{lookup + '__in': ids})
+            if ids and child is None:
+                for parent, value in children.values_list(F(lookup), 'pk'):
+                    groups.setdefault(parent, []).append(value)
+            elif ids:
+                children = list(children.values(*child.columns, _parent=F(lookup)))
+                for row, data in zip(children, self._represent(child, children, convert, using)):
+                    groups.setdefault(row['_parent'], []).append(data)
+            related.append((pk, groups))
+
+        return [self._build(node, row, convert, related) for row in rows]
+
+    def _build(self, node, row, convert, related):
+        data = {}
+        for name, kind, column, arg in node.fields:
+            if kind == VALUE:
+                value = row[column]
+                data[name] = None if value is None else arg(value)
+            elif kind == METHOD:
+                data[name] = convert[arg](row[column])
+            elif kind == NESTED:
+                data[name] = None if row[column] is None else self._build(arg, row, convert, related)
+            else:
+                pk, groups = related[column]
+                data[name] = groups.get(row[pk], [])
+
+        return data
+
+
+def _same(value):
+    return value
+
+
+def _model_field_value(field, attname, value):
+    return field.to_representation(SimpleNamespace(**{attname: value}))
@@ -1,36 +1,63 @@
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, permissions, generics, parsers, status
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from rest_framework.decorators import action, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.views import Response, APIView
-from .models import Food, User, MenuItem, Order, OrderDetail, Tag, Comment, Like, Rating, Subcribes, PaymentMethod
+from .models import (Food, User, MenuItem, Order, OrderDetail, Tag, Comment, Like, Rating, Subcribes, PaymentMethod,
+                     ArchivedOrder, ArchivedOrderDetail)
 from .serializers import (
     FoodSerializer,
+    PopularFoodSerializer,
     FoodDetailsSerializer,
     UserSerializer,
     StoreSerializer,
     MenuItemSerializer,
     TagSerializer,
     OrderSerializer,
+    ArchivedOrderSerializer,
     OrderDetailSerializer,
     AuthorizedFoodDetailsSerializer,
     SubcribeSerializer,
     CommentSerializer,
-    PaymentMethodSerializer
+    PaymentMethodSerializer,
+    CartQuoteSerializer,
+    food_values,
+    popular_food_values,
+    authorized_food_values,
+    menu_item_values,
+    order_values,
+    archived_order_values,
+    optimize_queryset
 )
+from .renderers import FAST_RENDERER_CLASSES
 from . import paginators
 import json
 from .perms import CommentOwner
-from django.db.models import Count
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Subquery, Sum
 from django.core.mail import send_mail, EmailMessage
 import json
-import time
-import hmac
-import hashlib
-import http.client
-from django.http import JsonResponse
+from . import payments
+from django.http import JsonResponse, FileResponse, Http404
+from .images import get_image_storage, requested_variant
+from .store_menus import get_store_menu
+from .sync import get_changes
+from .batch import BATCH_LIMIT, parse_ids, batch_result
+from .pricing import PricingError, quote
+from .reactions import toggle_like, set_rating
+from .popularity import annotate_counts
+from .uploads import stage_upload
+from .idempotency import idempotent
+from .throttling import IPThrottleMixin, throttle
+from .archive import all_order_details
+from .exports import EXPORT_TYPES, iter_rows, merge_rows, export_response
+from .sharding import for_store, all_shards, find, join_default
+from .orders import (NEXT_STATUS, BULK_CONFIRM_LIMIT, record_created, transition, bulk_transition,
+                     completed_email, notify_completed)
+from django.core.files.uploadedfile import UploadedFile
+from django.utils.dateparse import parse_date
 
 
 # TAG
@@ -38,13 +65,19 @@ class TagViewSet(viewsets.ModelViewSet):
     queryset = Tag.objects.filter(active=True)
     serializer_class = TagSerializer
     pagination_class = paginators.BaseCustomPaginator
+    # số truy vấn tối đa cho từng action GET (được kiểm tra trong tests.py)
+    query_budget = {'list': 2, 'retrieve': 1}
 
 
 # GET LIST FOOD
-class FoodViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIView):
-    queryset = Food.objects.filter(active=True)
-    serializer_class = FoodSerializer
+class FoodViewSet(IPThrottleMixin, viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIView):
+    queryset = Food.objects.filter(active=True).select_related('menu_item__store').prefetch_related('tags')
+    serializer_class = PopularFoodSerializer
     pagination_class = paginators.BaseCustomPaginator
+    renderer_classes = FAST_RENDERER_CLASSES
+    query_budget = {'list': 3, 'retrieve': 2, 'get_batch': 2}
+    # nhóm giới hạn request (menufood/throttling.py)
+    throttle_scopes = {'list': 'search', 'comments': 'write', 'like': 'write', 'rating': 'write'}
 
     def get_queryset(self):
         q = self.queryset
@@ -65,7 +98,42 @@ class FoodViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
         # if store_id:
         #     q = q.filter(store_id=store_id)
 
-        return q
+        # số lượt thích/đánh giá đọc từ FoodPopularity
+        q = annotate_counts(q)
+
+        # tính sẵn liked/rate của user đăng nhập trong cùng truy vấn (tránh N+1)
+        user = self.request.user
+        if user.is_authenticated:
+            q = q.annotate(
+                user_liked=Exists(Like.objects.filter(food=OuterRef('pk'), user=user, liked=True)),
+                user_rate=Subquery(Rating.objects.filter(food=OuterRef('pk'), user=user).values('rate')[:1])
+            )
+
+        # chỉ JOIN các object lồng được trả về (?fields=/?expand=)
+        return optimize_queryset(q, self.get_serializer())
+
+    # danh sách dựng từ values() thay vì object model, cùng định dạng với serializer
+    def list(self, request, *args, **kwargs):
+        values = authorized_food_values if request.user.is_authenticated else popular_food_values
+        queryset = values.values(self.filter_queryset(self.get_queryset()), request)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values.represent(page, request))
+
+        return Response(values.represent(queryset, request))
+
+    # nhiều món theo id (giỏ hàng, món yêu thích), mỗi món cùng định dạng với /foods/{id}/
+    @action(methods=['get'], detail=False, url_path='batch')
+    def get_batch(self, request):
+        ids = parse_ids(request.query_params.get('ids'))
+        if ids is None:
+            return Response({"message": f"Danh sách id không hợp lệ (tối đa {BATCH_LIMIT} id)!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        values = authorized_food_values if request.user.is_authenticated else popular_food_values
+        rows = list(values.values(self.get_queryset().filter(pk__in=ids), request, extra=('id',)))
+        items = zip([row['id'] for row in rows], values.represent(rows, request))
+        return Response(batch_result(ids, items), status=status.HTTP_200_OK)
 
     def get_permissions(self):
         if self.action in ['assign_tags', 'comments', 'like', 'rating']:
@@ -90,26 +158,36 @@ class FoodViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
         return Response(FoodDetailsSerializer(food, context={'request': request}).data)
 
     @action(methods=['post'], detail=True, url_path='comments')
+    @idempotent
     def comments(self, request, pk):
         c = Comment(content=request.data['content'], food=self.get_object(), user=request.user)
         c.save()
 
-        return Response(CommentSerializer(c).data, status=status.HTTP_201_CREATED)
+        return Response(CommentSerializer(c, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
     @action(methods=['post'], detail=True, url_path='like')
+    @idempotent
     def like(self, request, pk):
-        l, created = Like.objects.get_or_create(food=self.get_object(), user=request.user)
-        if not created:
-            l.liked = not l.liked
-        l.save()
+        # chỉ kiểm tra món còn bán, không cần tải object
+        if not str(pk).isdigit() or not Food.objects.filter(pk=pk, active=True).exists():
+            raise Http404
+        toggle_like(int(pk), request.user.id)
 
         return Response(status=status.HTTP_200_OK)
 
     @action(methods=['post'], detail=True, url_path='rating')
     def rating(self, request, pk):
-        r, _ = Rating.objects.get_or_create(food=self.get_object(), user=request.user)
-        r.rate = request.data['rate']
-        r.save()
+        rate = request.data.get('rate')
+        try:
+            rate = int(rate)
+        except (TypeError, ValueError):
+            return Response({"message": "Điểm đánh giá không hợp lệ!"}, status=status.HTTP_400_BAD_REQUEST)
+        if not str(pk).isdigit() or not Food.objects.filter(pk=pk, active=True).exists():
+            raise Http404
+        try:
+            set_rating(int(pk), request.user.id, rate)
+        except ValueError:
+            return Response({"message": "Điểm đánh giá không hợp lệ!"}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response(status=status.HTTP_200_OK)
 
@@ -153,6 +231,7 @@ class UserViewSet(viewsets.ViewSet, generics.CreateAPIView):
     queryset = User.objects.filter(is_active=True)
     serializer_class = UserSerializer
     parser_classes = [parsers.MultiPartParser, ]
+    query_budget = {'current_user': 0}
 
     def get_permissions(self):
         if self.action in ['current_user']:
@@ -160,21 +239,38 @@ class UserViewSet(viewsets.ViewSet, generics.CreateAPIView):
 
         return [permissions.AllowAny()]
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if isinstance(request.data.get('avatar'), UploadedFile):
+            response.data['image_status'] = 'PENDING'
+
+        return response
+
     # xem và chỉnh sửa thông tin user khi đã được xác thực
     @action(methods=['get', 'put'], detail=False, url_path='current-user')
     def current_user(self, request):
         u = request.user
         if request.method.__eq__('PUT'):
+            avatar = None
             for k, v in request.data.items():
+                if k == 'avatar' and isinstance(v, UploadedFile):
+                    avatar = v
+                    continue
                 setattr(u, k, v)
             u.save()
+            if avatar:
+                stage_upload(u, 'avatar', avatar)
 
         return Response(UserSerializer(u, context={'request': request}).data, status=status.HTTP_200_OK)
 
 
 # STORE
-class StoreViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
+class StoreViewSet(IPThrottleMixin, viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
     serializer_class = StoreSerializer
+    renderer_classes = FAST_RENDERER_CLASSES
+    query_budget = {'list': 2, 'retrieve': 1, 'get_menu_item': 2, 'get_menu_store': 2, 'get_food_store': 3,
+                    'get_menu_document': 4, 'get_batch': 1}
+    throttle_scopes = {'list': 'search', 'get_menu_item': 'search'}
 
     def get_queryset(self):
         menu = User.objects.filter(is_active=True, is_verify=True, user_role=1)
@@ -236,17 +332,44 @@ class StoreViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
     @action(methods=['get'], detail=True, url_path='menu-item')
     def get_menu_item(self, request, pk):
         store = self.get_object()
-        menu_items = store.menuitem_store.filter(active=True).annotate(
+        menu_items = store.menuitem_store.filter(active=True).select_related('store').annotate(
             food_count=Count('menuitem_food'))
 
         kw = request.query_params.get('kw')
         if kw:
             menu_items = menu_items.filter(name__icontains=kw)
 
-        return Response(MenuItemSerializer(menu_items, many=True).data, status=status.HTTP_200_OK)
+        return Response(menu_item_values.data(menu_items, request), status=status.HTTP_200_OK)
+
+    # nhiều cửa hàng theo id, mỗi cửa hàng cùng định dạng với /stores/{id}/
+    @action(methods=['get'], detail=False, url_path='batch')
+    def get_batch(self, request):
+        ids = parse_ids(request.query_params.get('ids'))
+        if ids is None:
+            return Response({"message": f"Danh sách id không hợp lệ (tối đa {BATCH_LIMIT} id)!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        stores = self.get_serializer(self.get_queryset().filter(pk__in=ids), many=True).data
+        return Response(batch_result(ids, [(store['id'], store) for store in stores]), status=status.HTTP_200_OK)
+
+    # toàn bộ menu cửa hàng (danh mục -> món -> tag) trong một tài liệu đã render sẵn
+    @action(methods=['get'], detail=True, url_path='menu')
+    def get_menu_document(self, request, pk):
+        document = get_store_menu(int(pk), requested_variant(request)) if str(pk).isdigit() else None
+        if document is None:
+            return Response({"message": "Không tìm thấy cửa hàng!"}, status=status.HTTP_404_NOT_FOUND)
+
+        etag, body = document
+        if etag in [t.strip() for t in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=%d' % settings.STORE_MENU['MAX_AGE']
+        return response
 
     def get_permissions(self):
-        if self.action in ['get_store_detail', 'get_menu_store']:
+        if self.action in ['get_store_detail', 'get_menu_store', 'get_food_store']:
             return [permissions.IsAuthenticated()]
         return [permissions.AllowAny()]
 
@@ -263,10 +386,10 @@ class StoreViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
 
         # Lấy store
         store = User.objects.get(id=user.id)
-        menu_items = store.menuitem_store.annotate(
+        menu_items = store.menuitem_store.select_related('store').annotate(
             food_count=Count('menuitem_food'))
 
-        return Response(MenuItemSerializer(menu_items, many=True).data, status=status.HTTP_200_OK)
+        return Response(menu_item_values.data(menu_items, request), status=status.HTTP_200_OK)
 
     # GET LIST FOOD STORE - MANAGEMENT
     @action(methods=['get'], detail=False, url_path='food-management')
@@ -282,10 +405,10 @@ class StoreViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         # Lấy store
         try:
             store = User.objects.get(id=user.id, user_role=User.STORE)
-            foods = Food.objects.filter(menu_item__store=user.id)
+            foods = Food.objects.filter(menu_item__store=user.id) \
+                .select_related('menu_item__store').prefetch_related('tags')
 
-            serializer = FoodSerializer(foods, many=True)
-            return Response(serializer.data)
+            return Response(food_values.data(foods, request))
         except User.DoesNotExist:
             return Response({'error': 'Store not found.'}, status=404)
 
@@ -463,9 +586,13 @@ class FoodStoreViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.Update
         image_food = request.data.get('image_food')
 
         if name != "" and price != "":
+            # file ảnh được upload nền, trả kết quả ngay với image_status=PENDING
+            staged = isinstance(image_food, UploadedFile)
             food = Food.objects.create(name=name, active=True, price=price, description=description,
                                        start_time=start_time, end_time=end_time,
-                                       image_food=image_food, menu_item=menu_item)
+                                       image_food=None if staged else image_food, menu_item=menu_item)
+            if staged:
+                stage_upload(food, 'image_food', image_food)
 
             # Gắn tag vào food
             tags = json.loads(request.data.get("tags"))
@@ -504,7 +631,9 @@ class FoodStoreViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.Update
             #             send_email.send()
             #             return Response(status=status.HTTP_200_OK)
 
-            return Response({"message": f"Lưu thông tin món ăn thành công cho cửa hàng {user.name_store}!"},
+            return Response({"message": f"Lưu thông tin món ăn thành công cho cửa hàng {user.name_store}!",
+                             "data": FoodSerializer(food, context={'request': request}).data,
+                             "image_status": 'PENDING' if staged else None},
                             status=status.HTTP_201_CREATED)
         return Response({"message": "Lưu thông tin món ăn không thành công!"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -592,8 +721,12 @@ class OrderViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.RetrieveAP
     serializer_class = OrderSerializer
     queryset = Order.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+    query_budget = {'list': 2, 'retrieve': 1, 'get_list_pending': 1, 'get_list_accepted': 1,
+                    'export_orders': 3, 'export_order_details': 3, 'export_revenue': 3}
 
     # đặt món - tạo đơn hàng
+    @idempotent
     def create(self, request):
         # Lấy thông tin người dùng và kiểm tra quyền truy cập của người dùng
         user = request.user
@@ -604,37 +737,44 @@ class OrderViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.RetrieveAP
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         if serializer.is_valid():
+            # kiểm tra món và tính tiền trước khi lưu, giá/tổng tiền/phí giao hàng do server tính
+            try:
+                cart = quote(request.data.get('order_details'), request.data.get('receiver_address'),
+                             use_cache=False)
+            except PricingError as e:
+                return Response({"message": e.message}, status=status.HTTP_400_BAD_REQUEST)
+            store = serializer.validated_data['store']
+            if cart['store'] != store.pk:
+                return Response(
+                    {"message": f"Món ăn {cart['lines'][0]['name']} không có trong cửa hàng {store.name_store}! Đặt hàng không thành công!"},
+                    status=status.HTTP_400_BAD_REQUEST)
+
             # Lưu thông tin đơn hàng
-            order = serializer.save(order_status=Order.PENDING, user=request.user)
+            order = serializer.save(order_status=Order.PENDING, user=request.user,
+                                    amount=cart['amount'], delivery_fee=cart['delivery_fee'])
 
             # Lưu thông tin chi tiết đơn hàng
-            order_details_data = request.data.pop('order_details')
-            # kiểm tra thông tin món được đặt có hợp lệ
-            for order_detail_data in order_details_data:
-                food_id = order_detail_data.pop('food')
-                food = Food.objects.get(id=food_id)
-                if not food:
-                    return Response({"message": "Món ăn nào được đặt không hợp lệ!"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                if food.active == 0:
-                    OrderDetail.objects.filter(order_id=order.id).delete()
-                    Order.objects.filter(id=order.id).delete()
-                    return Response({"message": f"Món ăn {food.name} hiện tại không còn bán!"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                if food.menu_item.store != order.store:
-                    OrderDetail.objects.filter(order_id=order.id).delete()
-                    Order.objects.filter(id=order.id).delete()
-                    return Response(
-                        {"message": f"Món ăn {food.name} không có trong cửa hàng {order.store.name_store}! Đặt hàng không thành công!"},
-                        status=status.HTTP_400_BAD_REQUEST)
-
-                OrderDetail.objects.create(order=order, food=food, **order_detail_data)
+            for line in cart['lines']:
+                OrderDetail.objects.using(order._state.db).create(order=order, food_id=line['food'],
+                                                                  unit_price=line['unit_price'],
+                                                                  quantity=line['quantity'])
 
+            record_created(order, actor=request.user)
             headers = self.get_success_headers(serializer.data)
             return Response({"message": "Đặt hàng thành công!", "data": serializer.data},
                             status=status.HTTP_201_CREATED, headers=headers)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    # báo giá giỏ hàng trước khi đặt: giá từng món, tổng tiền, phí giao hàng
+    @action(methods=['post'], detail=False, url_path='quote')
+    def cart_quote(self, request):
+        try:
+            cart = quote(request.data.get('order_details'), request.data.get('receiver_address'))
+        except PricingError as e:
+            return Response({"message": e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(CartQuoteSerializer(cart).data, status=status.HTTP_200_OK)
+
     # xem chi tiết đơn hàng cho user (==chưa dùng bên FE==)
     # def retrieve(self, request, pk):
     #     try:
@@ -684,20 +824,35 @@ class OrderViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.RetrieveAP
     def list(self, request):
         try:
             user = request.user
-            orders = Order.objects.all()
+            # gồm cả các đơn cũ đã chuyển sang bảng lưu trữ
             if user.user_role == User.STORE:
-                orders = orders.filter(store=user.id)
+                orders = [for_store(Order, user.id).filter(store=user.id)]
+                archived = [for_store(ArchivedOrder, user.id).filter(store=user.id)]
             elif user.user_role == User.USER:
-                orders = orders.filter(user=user.id)
+                # đơn của khách hàng nằm rải rác trên các shard theo cửa hàng
+                orders = [q.filter(user=user.id) for q in all_shards(Order)]
+                archived = [q.filter(user=user.id) for q in all_shards(ArchivedOrder)]
             else:
                 return Response({'error': 'Forbidden', 'message': 'Bạn không có quyền thực hiện chức năng này!'},
                                 status=status.HTTP_403_FORBIDDEN)
 
-            return Response(OrderSerializer(orders, many=True).data, status=status.HTTP_200_OK)
+            data = [o for q in orders for o in order_values.data(q, request)] + \
+                   [o for q in archived for o in archived_order_values.data(q, request)]
+            return Response(sorted(data, key=lambda o: o['id']), status=status.HTTP_200_OK)
 
         except Order.DoesNotExist:
             return Response({'error': 'Bạn không có đơn hàng nào!'}, status=status.HTTP_404_NOT_FOUND)
 
+    def retrieve(self, request, pk=None):
+        order = find(Order, id=pk)
+        if order is not None:
+            return Response(OrderSerializer(order).data, status=status.HTTP_200_OK)
+
+        archived = find(ArchivedOrder, id=pk)
+        if archived is None:
+            raise Http404
+        return Response(ArchivedOrderSerializer(archived).data, status=status.HTTP_200_OK)
+
     # GET LIST ORDER - STATUS=PENDING
     @action(methods=['get'], detail=False, url_path='pending-order')
     def get_list_pending(self, request):
@@ -708,10 +863,9 @@ class OrderViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.RetrieveAP
                             status=status.HTTP_403_FORBIDDEN)
 
         try:
-            orders = Order.objects.filter(store=user, order_status=Order.PENDING)
+            orders = for_store(Order, user.id).filter(store=user, order_status=Order.PENDING)
 
-            return Response(OrderSerializer(orders, many=True).data,
-                            status=status.HTTP_200_OK)
+            return Response(order_values.data(orders, request), status=status.HTTP_200_OK)
 
         except Order.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
@@ -724,59 +878,176 @@ class OrderViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.RetrieveAP
             return Response({"message": "Bạn không có quyền thực hiện chức năng này."},
                             status=status.HTTP_403_FORBIDDEN)
 
-        try:
-            order = Order.objects.get(id=pk)
-        except Order.DoesNotExist:
+        order = find(Order, id=pk)
+        if order is None:
             return Response({'message': f'Đơn hàng không được tìm thấy hoặc đã được xử lý!'},
                             status=status.HTTP_404_NOT_FOUND)
 
         if request.method == 'POST':
             if order.store.id == user.id:
-                if order.order_status == Order.PENDING:
-                    order.order_status = Order.ACCEPTED
-                    order.save()
+                to_status = NEXT_STATUS.get(order.order_status)
+                if to_status is None:
+                    return Response({'message': f'Đơn hàng {pk} đã giao thành công!'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                # request khác đã chuyển trạng thái đơn trước
+                if not transition(order, to_status, actor=user):
+                    return Response({'message': f'Đơn hàng {pk} đã được xử lý!'},
+                                    status=status.HTTP_409_CONFLICT)
+
+                if to_status == Order.ACCEPTED:
                     return Response({'message': f'Đơn hàng {pk} đã được xác nhận thành công!'},
                                     status=status.HTTP_200_OK)
 
-                if order.order_status == Order.ACCEPTED:
-                    if order.payment_status == 0:
-                        order.order_status = Order.SUCCESSED
-                        order.payment_status = True
-                        order.save()
-
-                        # send mail
-                        email = order.user.email
-                        subject = "Xác nhận đơn hàng đã được giao thành công"
-                        content = """
-                            Chào {0},
-                            Chúng tôi đã ghi nhận thanh toán của bạn.
-                            Chi tiết:
-                            Mã đơn hàng: {1}
-                            Tên cửa hàng: {2}
-                            Tên khách hàng nhận: {3}
-                            Địa chỉ giao hàng: {4}
-                            Tổng thanh toán: {5:,.0f} VND
-                            Hình thức thanh toán: {6}
-                            Ngày thanh toán: {7}
-                            Cám ơn bạn đã tin tưởng chọn dịch vụ của chúng tôi.
-                            Mọi thắc mắc và yêu cầu hỗ trợ xin gửi về địa chỉ foodlocationapp@gmail.com.
-                            """.format(order.user.first_name + " " + order.user.last_name,
-                                       order.pk, order.store.name_store,
-                                       order.receiver_name, order.receiver_address,
-                                       order.amount, order.paymentmethod.name, order.payment_date)
-                        if email and subject and content:
-                            send_email = EmailMessage(subject, content, to=[email])
-                            send_email.send()
-                            return Response(data={"message": "Gửi mail thành công! Đã xác nhận đơn hàng giao hàng thành công!"},
-                                            status=status.HTTP_200_OK)
-                        return Response({'message': f'Đơn hàng {pk} đã được xác nhận thành công! Khách hàng chưa nhận được mail!'},
-                                        status=status.HTTP_200_OK)
+                # send mail
+                send_email = completed_email(order)
+                if send_email:
+                    send_email.send()
+                    return Response(data={"message": "Gửi mail thành công! Đã xác nhận đơn hàng giao hàng thành công!"},
+                                    status=status.HTTP_200_OK)
+                return Response({'message': f'Đơn hàng {pk} đã được xác nhận thành công! Khách hàng chưa nhận được mail!'},
+                                status=status.HTTP_200_OK)
             return Response({'message': f'Đơn hàng {pk} không thuộc quyền xử lý của bạn. Cập nhật không thành công!'},
                             status=status.HTTP_404_NOT_FOUND)
 
         return Response({'message': f'Đơn hàng {pk} xác nhận không thành công. Vui lòng thử lại!'},
                         status=status.HTTP_404_NOT_FOUND)
 
+    # xác nhận nhiều đơn cùng lúc: {"ids": [...], "order_status": 1 | 2}
+    @action(methods=['post'], detail=False, url_path='confirm-orders')
+    def confirm_orders(self, request):
+        user = request.user
+        if user.user_role != User.STORE or user.is_active == 0 or user.is_superuser == 1 or user.is_staff == 1:
+            return Response({"message": "Bạn không có quyền thực hiện chức năng này."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        ids = request.data.get('ids')
+        to_status = request.data.get('order_status')
+        if not isinstance(ids, list) or not ids or len(ids) > BULK_CONFIRM_LIMIT \
+                or not all(isinstance(i, int) for i in ids):
+            return Response({"message": f"Danh sách đơn hàng không hợp lệ (tối đa {BULK_CONFIRM_LIMIT} đơn)!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if to_status not in NEXT_STATUS.values():
+            return Response({"message": "Trạng thái đơn hàng không hợp lệ!"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # một truy vấn kiểm tra đơn thuộc cửa hàng
+        orders = for_store(Order, user.id)
+        owned = set(orders.filter(id__in=ids, store=user).values_list('id', flat=True))
+        changed = {o.pk for o in bulk_transition(orders.filter(id__in=owned), to_status, actor=user)}
+        if changed and to_status == Order.SUCCESSED:
+            notify_completed(orders.filter(id__in=changed))
+
+        results = []
+        for i in dict.fromkeys(ids):
+            if i in changed:
+                results.append({"id": i, "success": True, "order_status": to_status})
+            elif i in owned:
+                results.append({"id": i, "success": False, "message": "Đơn hàng đã được xử lý hoặc chưa thể chuyển trạng thái!"})
+            else:
+                results.append({"id": i, "success": False,
+                                "message": "Đơn hàng không được tìm thấy hoặc không thuộc quyền xử lý của bạn!"})
+
+        return Response({"message": f"Đã cập nhật {len(changed)}/{len(results)} đơn hàng!", "results": results},
+                        status=status.HTTP_200_OK)
+
+    # xuất file cho cửa hàng: ?type=csv|xlsx&from=YYYY-MM-DD&to=YYYY-MM-DD (theo ngày tạo đơn)
+    @staticmethod
+    def _export_params(request, prefix=''):
+        export_type = request.query_params.get('type', 'csv')
+        if export_type not in EXPORT_TYPES:
+            return None
+        lookups = {}
+        for param, lookup in (('from', 'created_date__date__gte'), ('to', 'created_date__date__lte')):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    value = parse_date(value)
+                except ValueError:
+                    value = None
+                if value is None:
+                    return None
+                lookups[prefix + lookup] = value
+
+        return export_type, lookups
+
+    @action(methods=['get'], detail=False, url_path='export')
+    def export_orders(self, request):
+        user = request.user
+        if user.user_role != User.STORE or user.is_active == 0 or user.is_superuser == 1 or user.is_staff == 1:
+            return Response({"message": "Bạn không có quyền thực hiện chức năng này."},
+                            status=status.HTTP_403_FORBIDDEN)
+        params = self._export_params(request)
+        if params is None:
+            return Response({"message": "Định dạng file hoặc khoảng thời gian không hợp lệ!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        export_type, lookups = params
+
+        methods = dict(PaymentMethod.objects.values_list('id', 'name'))
+        order_status = dict(Order.STATUS)
+        fields = ['id', 'created_date', 'order_status', 'receiver_name', 'receiver_phone', 'receiver_address',
+                  'amount', 'delivery_fee', 'paymentmethod_id', 'payment_status', 'payment_date', 'user_id']
+        # đơn đang dùng và đơn đã lưu trữ, đọc từng lô theo id
+        rows = merge_rows(*[iter_rows(for_store(model, user.id).filter(store=user, **lookups), fields)
+                            for model in (Order, ArchivedOrder)])
+        rows = ((*r[:2], order_status[r[2]], *r[3:8], methods.get(r[8]), int(r[9]), *r[10:]) for r in rows)
+        header = ['Mã đơn', 'Ngày tạo', 'Trạng thái', 'Người nhận', 'Số điện thoại', 'Địa chỉ', 'Tiền món',
+                  'Phí giao hàng', 'Phương thức thanh toán', 'Đã thanh toán', 'Ngày thanh toán', 'Mã khách hàng']
+        return export_response(export_type, 'orders', header, rows)
+
+    @action(methods=['get'], detail=False, url_path='export-details')
+    def export_order_details(self, request):
+        user = request.user
+        if user.user_role != User.STORE or user.is_active == 0 or user.is_superuser == 1 or user.is_staff == 1:
+            return Response({"message": "Bạn không có quyền thực hiện chức năng này."},
+                            status=status.HTTP_403_FORBIDDEN)
+        params = self._export_params(request, prefix='order__')
+        if params is None:
+            return Response({"message": "Định dạng file hoặc khoảng thời gian không hợp lệ!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        export_type, lookups = params
+
+        # món ăn ở 'default', chi tiết đơn có thể ở shard khác nên không JOIN
+        foods = {f[0]: f[1:] for f in Food.objects.filter(menu_item__store=user)
+                 .values_list('id', 'name', 'menu_item__name')}
+        fields = ['id', 'order_id', 'order__created_date', 'food_id', 'quantity', 'unit_price']
+        rows = merge_rows(*[iter_rows(for_store(model, user.id).filter(order__store=user, **lookups), fields)
+                            for model in (OrderDetail, ArchivedOrderDetail)])
+        rows = ((*r[:4], *foods.get(r[3], ('', '')), *r[4:]) for r in rows)
+        header = ['Mã dòng', 'Mã đơn', 'Ngày tạo đơn', 'Mã món', 'Tên món', 'Danh mục', 'Số lượng', 'Đơn giá']
+        return export_response(export_type, 'order-details', header, rows)
+
+    # doanh thu của đơn giao thành công theo món (?group=food) hoặc theo danh mục (?group=menu_item)
+    @action(methods=['get'], detail=False, url_path='export-revenue')
+    def export_revenue(self, request):
+        user = request.user
+        if user.user_role != User.STORE or user.is_active == 0 or user.is_superuser == 1 or user.is_staff == 1:
+            return Response({"message": "Bạn không có quyền thực hiện chức năng này."},
+                            status=status.HTTP_403_FORBIDDEN)
+        params = self._export_params(request, prefix='order__')
+        group = request.query_params.get('group', 'food')
+        if params is None or group not in ('food', 'menu_item'):
+            return Response({"message": "Định dạng file, khoảng thời gian hoặc cách nhóm không hợp lệ!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        export_type, lookups = params
+
+        foods = {f[0]: f[1:] for f in Food.objects.filter(menu_item__store=user)
+                 .values_list('id', 'name', 'menu_item_id', 'menu_item__name')}
+        totals = {}
+        for model in (OrderDetail, ArchivedOrderDetail):
+            details = for_store(model, user.id).filter(order__store=user, order__order_status=Order.SUCCESSED,
+                                                       **lookups)
+            for food_id, quantity, revenue in details.values('food_id').order_by().annotate(
+                    q=Sum('quantity'), r=Sum(F('unit_price') * F('quantity'), output_field=DecimalField())) \
+                    .values_list('food_id', 'q', 'r'):
+                name, menu_item_id, menu_item_name = foods.get(food_id, ('', None, ''))
+                key = (food_id, name, menu_item_name) if group == 'food' else (menu_item_id, menu_item_name)
+                row = totals.setdefault(key, [0, 0])
+                row[0] += quantity
+                row[1] += revenue
+
+        rows = ((*key, quantity, revenue) for key, (quantity, revenue) in sorted(totals.items(), key=lambda t: -t[1][1]))
+        header = ['Mã món', 'Tên món', 'Danh mục'] if group == 'food' else ['Mã danh mục', 'Danh mục']
+        return export_response(export_type, 'revenue-' + group, header + ['Số lượng', 'Doanh thu'], rows)
+
     # GET LIST ORDER - STATUS=ACCEPTED
     @action(methods=['get'], detail=False, url_path='accepted-order')
     def get_list_accepted(self, request):
@@ -787,10 +1058,9 @@ class OrderViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.RetrieveAP
                             status=status.HTTP_403_FORBIDDEN)
 
         try:
-            orders = Order.objects.filter(store=user, order_status=Order.ACCEPTED)
+            orders = for_store(Order, user.id).filter(store=user, order_status=Order.ACCEPTED)
 
-            return Response(OrderSerializer(orders, many=True).data,
-                            status=status.HTTP_200_OK)
+            return Response(order_values.data(orders, request), status=status.HTTP_200_OK)
 
         except Order.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
@@ -854,9 +1124,21 @@ class OrderViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.RetrieveAP
 
 # ORDER_DETAIL
 class OrderDetailViewSet(viewsets.ViewSet, generics.RetrieveUpdateDestroyAPIView):
-    queryset = OrderDetail.objects.all()
+    queryset = OrderDetail.objects.select_related('food__menu_item__store').prefetch_related('food__tags')
     serializer_class = OrderDetailSerializer
     lookup_field = 'id'
+    query_budget = {'retrieve': 2}
+
+    def get_object(self):
+        # chi tiết đơn nằm trên shard của đơn hàng
+        for queryset in all_shards(OrderDetail):
+            obj = join_default(queryset, 'food__menu_item__store').prefetch_related('food__tags') \
+                .filter(id=self.kwargs['id']).first()
+            if obj is not None:
+                self.check_object_permissions(self.request, obj)
+                return obj
+
+        raise Http404
 
 
 # COMMENT
@@ -864,15 +1146,21 @@ class CommentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.DestroyAPI
     queryset = Comment.objects.filter(active=True)
     serializer_class = CommentSerializer
     permission_classes = [CommentOwner, ]
+    query_budget = {'list': 2}
 
     def get_queryset(self):
-        food_id = self.kwargs['id']
-        return Comment.objects.filter(food__id=food_id)
+        # route của router không có kwarg 'id' => cho phép truyền ?food_id=
+        food_id = self.kwargs.get('id', self.request.query_params.get('food_id'))
+        return optimize_queryset(Comment.objects.filter(food__id=food_id), self.get_serializer())
 
 
 class SubcribeViewSet(viewsets.ViewSet, generics.ListAPIView, generics.DestroyAPIView, generics.UpdateAPIView):
-    queryset = Subcribes.objects.filter(active=True)
+    queryset = Subcribes.objects.filter(active=True).select_related('follower')
     serializer_class = SubcribeSerializer
+    query_budget = {'list': 2, 'get_sub_by_store_id': 2, 'count_follower_by_store': 2}
+
+    def get_queryset(self):
+        return optimize_queryset(self.queryset, self.get_serializer())
 
     def get_permissions(self):
         if self.action in ['post', 'delete', 'destroy']:
@@ -885,9 +1173,8 @@ class SubcribeViewSet(viewsets.ViewSet, generics.ListAPIView, generics.DestroyAP
         try:
             store = User.objects.get(id=pk, user_role=User.STORE)
             if store:
-                subs = Subcribes.objects.filter(store=pk)
-
-                serializer = SubcribeSerializer(subs, many=True)
+                serializer = SubcribeSerializer(many=True, context={'request': request})
+                serializer.instance = optimize_queryset(Subcribes.objects.filter(store=pk), serializer)
                 return Response(serializer.data, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'error': 'Không tìm thấy cửa hàng nào!!!!'}, status=status.HTTP_404_NOT_FOUND)
@@ -907,16 +1194,18 @@ class SubcribeViewSet(viewsets.ViewSet, generics.ListAPIView, generics.DestroyAP
         except User.DoesNotExist:
             return Response({'error': 'Không tìm thấy thông tin!'}, status=status.HTTP_404_NOT_FOUND)
 
+    @idempotent
     def post(self, request):
         try:
             follower = request.user
             store_id = request.data.get('store_id')
             store = User.objects.get(id=store_id)
 
-            sub = Subcribes.objects.create(follower=follower, store=store)
+            # đã theo dõi rồi thì trả 200 thay vì lỗi unique_together
+            sub, created = Subcribes.objects.get_or_create(follower=follower, store=store)
 
             # serializer = SubcribeSerializer(sub)
-            return Response(request.data, status=status.HTTP_201_CREATED)
+            return Response(request.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'message': 'Người dùng không tồn tại!'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -943,6 +1232,8 @@ class SubcribeViewSet(viewsets.ViewSet, generics.ListAPIView, generics.DestroyAP
 # GET LIST FOOD BY STORE
 class FoodByStoreViewSet(viewsets.ViewSet):
     serializer_class = FoodSerializer
+    renderer_classes = FAST_RENDERER_CLASSES
+    query_budget = {'get_food_by_store_id': 3}
 
     def get_queryset(self):
         store_id = self.kwargs.get('store_id')
@@ -953,18 +1244,33 @@ class FoodByStoreViewSet(viewsets.ViewSet):
     def get_food_by_store_id(self, request, pk):
         try:
             store = User.objects.get(id=pk, user_role=User.STORE)
-            foods = Food.objects.filter(menu_item__store=pk)
+            foods = Food.objects.filter(menu_item__store=pk) \
+                .select_related('menu_item__store').prefetch_related('tags')
 
-            serializer = FoodSerializer(foods, many=True)
-            return Response(serializer.data)
+            return Response(food_values.data(foods, request))
         except User.DoesNotExist:
             return Response({'error': 'Store not found.'}, status=404)
 
 
+# ĐỒNG BỘ THAY ĐỔI CHO APP (dữ liệu lưu trên máy, chỉ tải phần thay đổi từ lần trước)
+class SyncViewSet(viewsets.ViewSet):
+    renderer_classes = FAST_RENDERER_CLASSES
+    query_budget = {'list': 9}
+
+    def list(self, request):
+        try:
+            data = get_changes(request.user, request.query_params.get('since'), request)
+        except ValueError:
+            return Response({"message": "Token đồng bộ không hợp lệ!"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
 # PAYMENT_METHOD
 class PaymentmethodViewSet(viewsets.ViewSet, generics.ListAPIView):
     serializer_class = PaymentMethodSerializer
     queryset = PaymentMethod.objects.all()
+    query_budget = {'list': 2}
 
 
 #Cửa hàng được phép xem: Thống kê doanh thu các sản phẩm, danh mục sản phẩm theo tháng, quý và năm
@@ -980,7 +1286,7 @@ class RevenueStatsMonth(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         # Lấy danh sách tất cả các order detail trong tháng đó
-        order_details = OrderDetail.objects.filter(order__created_date__month=month)
+        order_details = all_order_details(order__created_date__month=month)
 
         # Tính tổng doanh thu của cửa hàng trong tháng đó
         total_revenue = sum([order_detail.unit_price * order_detail.quantity for order_detail in order_details])
@@ -1040,8 +1346,8 @@ class RevenueStatsQuarter(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         # Lấy danh sách tất cả các order detail trong quý đó
-        order_details = OrderDetail.objects.filter(order__created_date__year=year,
-                                                    order__created_date__month__in=[(quarter-1)*3 + 1, (quarter-1)*3 + 2, (quarter-1)*3 + 3])
+        order_details = all_order_details(order__created_date__year=year,
+                                           order__created_date__month__in=[(quarter-1)*3 + 1, (quarter-1)*3 + 2, (quarter-1)*3 + 3])
 
         # Tính tổng doanh thu của cửa hàng trong quý đó
         total_revenue = sum([order_detail.unit_price * order_detail.quantity
@@ -1089,8 +1395,8 @@ class RevenueStatsQuarter(APIView):
         monthly_stats = []
         for month_num, year_num in months:
             # Lấy danh sách tất cả các order detail trong tháng đó
-            order_details = OrderDetail.objects.filter(order__created_date__year=year_num,
-                                                       order__created_date__month=month_num)
+            order_details = all_order_details(order__created_date__year=year_num,
+                                              order__created_date__month=month_num)
 
             # Tính tổng doanh thu của cửa hàng trong tháng đó
             monthly_total_revenue = sum([order_detail.unit_price * order_detail.quantity
@@ -1123,7 +1429,7 @@ class RevenueStatsYear(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         # Lấy danh sách tất cả các order detail trong năm đó
-        order_details = OrderDetail.objects.filter(order__created_date__year=year)
+        order_details = all_order_details(order__created_date__year=year)
 
         # Tính tổng doanh thu của cửa hàng trong năm đó
         total_revenue = sum([order_detail.unit_price * order_detail.quantity
@@ -1171,8 +1477,8 @@ class RevenueStatsYear(APIView):
         monthly_stats = []
         for month_num, year_num in months:
             # Lấy danh sách tất cả các order detail trong tháng đó
-            order_details = OrderDetail.objects.filter(order__created_date__year=year_num,
-                                                       order__created_date__month=month_num)
+            order_details = all_order_details(order__created_date__year=year_num,
+                                              order__created_date__month=month_num)
 
             # Tính tổng doanh thu của cửa hàng trong tháng đó
             monthly_total_revenue = sum([order_detail.unit_price * order_detail.quantity
@@ -1192,70 +1498,62 @@ class RevenueStatsYear(APIView):
             "monthly_stats": monthly_stats
         }, status=status.HTTP_200_OK)
 
-@csrf_exempt
+# token OAuth2 chỉ được kiểm tra qua DRF (api_view), đơn hàng phải thuộc về user đăng nhập
+@throttle('payment')
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
 def create_payment(request):
-    json_data = request.body.decode('utf-8')
-    data = json.loads(json_data)
-
-    order_info = data['orderInfo']
-    redirect_url = data['redirectUrl']
-    ipn_url = data['ipnUrl']
-    amount = data['amount']
-    extra_data = data['extraData']
-    # order_id = data['orderId']
-
-    partner_code = "MOMO"
-    access_key = "F8BBA842ECF85"
-    secret_key = "K951B6PE1waDMi640xX08PD3vg6EkVlz"
-    request_id = partner_code + str(int(time.time()))
-    order_id = request_id
-    # order_info = "pay with MoMo"
-    # redirect_url = "https://momo.vn/return"
-    # ipn_url = "https://callback.url/notify"
-    # amount = "50000"
-    request_type = "captureWallet"
-    # extra_data = ""
-
-    # before sign HMAC SHA256 with format
-    # accessKey=$accessKey&amount=$amount&extraData=$extraData&ipnUrl=$ipnUrl&orderId=$orderId&orderInfo=$orderInfo&partnerCode=$partnerCode&redirectUrl=$redirectUrl&requestId=$requestId&requestType=$requestType
-    raw_signature = "accessKey=" + access_key + "&amount=" + amount + "&extraData=" + extra_data + "&ipnUrl=" + ipn_url + "&orderId=" + order_id + "&orderInfo=" + order_info + "&partnerCode=" + partner_code + "&redirectUrl=" + redirect_url + "&requestId=" + request_id + "&requestType=" + request_type
-
-    # signature
-    signature = hmac.new(secret_key.encode('utf-8'), raw_signature.encode('utf-8'), hashlib.sha256).hexdigest()
-
-    # json object send to MoMo endpoint
-    data = {
-        'partnerCode': partner_code,
-        'accessKey': access_key,
-        'requestId': request_id,
-        'amount': amount,
-        'orderId': order_id,
-        'orderInfo': order_info,
-        'redirectUrl': redirect_url,
-        'ipnUrl': ipn_url,
-        'extraData': extra_data,
-        'requestType': request_type,
-        'signature': signature,
-        'lang': 'en'
-    }
-    json_data = json.dumps(data)
-
-    # create the HTTP request
-    conn = http.client.HTTPSConnection("test-payment.momo.vn")
-    headers = {
-        'Content-Type': 'application/json',
-        'Content-Length': len(json_data)
-    }
-    conn.request("POST", "/v2/gateway/api/create", json_data, headers)
-
-    # get the response
-    res = conn.getresponse()
-
-    # read the response body
-    response_data = res.read().decode("utf-8")
-    pay_url = json.loads(response_data)['payUrl']
-
-    conn.close()
-
-    return JsonResponse({ "status": status.HTTP_200_OK, "message": 'success', "data": { "payURL": pay_url}})
+    data = request.data
+    order_id = data.get('order') if isinstance(data, dict) else None
+    if not str(order_id).isdigit() or any(not isinstance(data.get(k, ''), str)
+                                          for k in ('orderInfo', 'redirectUrl', 'ipnUrl', 'extraData')):
+        return JsonResponse({"status": status.HTTP_400_BAD_REQUEST, "message": "Dữ liệu không hợp lệ!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    order = find(Order, id=order_id, user=request.user)
+    if order is None:
+        return JsonResponse({"status": status.HTTP_404_NOT_FOUND, "message": "Không tìm thấy đơn hàng!"},
+                            status=status.HTTP_404_NOT_FOUND)
+    if order.payment_status:
+        return JsonResponse({"status": status.HTTP_400_BAD_REQUEST, "message": "Đơn hàng đã được thanh toán!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    # số tiền lấy từ đơn hàng, không theo client gửi lên
+    try:
+        attempt = payments.get_client().create_payment(amount=order.amount + order.delivery_fee,
+                                                       order_info=data.get('orderInfo', ''),
+                                                       redirect_url=data.get('redirectUrl', ''),
+                                                       ipn_url=data.get('ipnUrl', ''),
+                                                       extra_data=data.get('extraData', ''), order=order)
+    except payments.PaymentGatewayError as e:
+        return JsonResponse({"status": status.HTTP_502_BAD_GATEWAY, "message": str(e)},
+                            status=status.HTTP_502_BAD_GATEWAY)
+
+    return JsonResponse({ "status": status.HTTP_200_OK, "message": 'success', "data": { "payURL": attempt.pay_url}})
+
+
+# MoMo gọi về ipnUrl khi có kết quả thanh toán
+@csrf_exempt
+def momo_ipn(request):
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        return JsonResponse({"message": "Dữ liệu không hợp lệ!"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not isinstance(data, dict) or not payments.get_client().verify_ipn(data):
+        return JsonResponse({"message": "Chữ ký không hợp lệ!"}, status=status.HTTP_400_BAD_REQUEST)
+
+    payments.process_ipn(data)
+
+    # MoMo chỉ cần 204, IPN trùng cũng trả 204 để MoMo không gửi lại
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+# ảnh theo kích thước của LocalImageStorage (Cloudinary tự phục vụ url của nó)
+def image_variant(request, variant, public_id):
+    storage = get_image_storage()
+    path = storage.variant_path(public_id, variant) if hasattr(storage, 'variant_path') else None
+    if path is None:
+        raise Http404
 
+    return FileResponse(open(path, 'rb'))